@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, get_object_or_404
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
@@ -13,6 +15,18 @@ from .serializers import (
     UserUpdateSerializer,
     ChangePasswordSerializer
 )
+from apps.cart.storage import CART_TOKEN_HEADER, merge_guest_cart
+
+logger = logging.getLogger(__name__)
+
+
+def merge_guest_cart_into(user, request):
+    """Fold the visitor's guest cart (X-Cart-Token) into the user's cart"""
+    try:
+        merge_guest_cart(user, request.headers.get(CART_TOKEN_HEADER))
+    except Exception as e:
+        # Never block authentication because of the cart
+        logger.error(f"Error merging guest cart for user {user.id}: {e}")
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserRegisterSerializer
@@ -22,6 +36,7 @@ class RegisterView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
+        merge_guest_cart_into(user, request)
 
         refresh = RefreshToken.for_user(user)
 
@@ -40,6 +55,7 @@ class LoginView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
+        merge_guest_cart_into(user, request)
 
         refresh = RefreshToken.for_user(user)
 
@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-19 10:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_base_items(apps, schema_editor):
+    """
+    The old unique_together treated NULL variants as distinct, so a cart
+    could hold several base-product lines. Fold them into the oldest one.
+    """
+    CartItem = apps.get_model('cart', 'CartItem')
+
+    duplicates = CartItem.objects.filter(variant__isnull=True).values(
+        'cart_id', 'product_id'
+    ).annotate(lines=Count('id')).filter(lines__gt=1)
+
+    for dup in duplicates:
+        items = list(CartItem.objects.filter(
+            cart_id=dup['cart_id'],
+            product_id=dup['product_id'],
+            variant__isnull=True
+        ).order_by('created_at', 'id'))
+        keep, extra = items[0], items[1:]
+        keep.quantity = sum(item.quantity for item in items)
+        keep.save(update_fields=['quantity'])
+        CartItem.objects.filter(id__in=[item.id for item in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_version'),
+        ('main', '0003_alter_productvariant_sku'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_base_items, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product', 'variant'), name='cart_items_cart_product_variant_uniq', nulls_distinct=False),
+        ),
+    ]
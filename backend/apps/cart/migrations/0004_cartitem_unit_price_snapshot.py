@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_cart_items_unique_nulls_not_distinct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='unit_price_snapshot',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Unit price when the line was added (used to detect price changes)', max_digits=10, null=True),
+        ),
+    ]
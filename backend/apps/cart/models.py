@@ -14,6 +14,10 @@ class Cart(models.Model):
         on_delete=models.CASCADE,
         related_name='cart'
     )
+    version = models.PositiveIntegerField(
+        default=0,
+        help_text="Incremented on every cart mutation (used by delta responses)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -73,6 +77,13 @@ class CartItem(models.Model):
         default=1,
         validators=[MinValueValidator(1)]
     )
+    unit_price_snapshot = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Unit price when the line was added (used to detect price changes)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -80,8 +91,16 @@ class CartItem(models.Model):
         db_table = 'cart_items'
         verbose_name = 'Cart Item'
         verbose_name_plural = 'Cart Items'
-        unique_together = ['cart', 'product', 'variant']
         ordering = ['-created_at']
+        constraints = [
+            # NULLS NOT DISTINCT so that (cart, product, NULL) is unique too
+            # and can be used as the ON CONFLICT target of the add upsert
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variant'],
+                nulls_distinct=False,
+                name='cart_items_cart_product_variant_uniq'
+            ),
+        ]
 
     def __str__(self):
         if self.variant:
@@ -119,18 +138,18 @@ class CartItem(models.Model):
     def is_available(self):
         """Check if item is still available in sufficient quantity"""
         if self.variant:
-            return self.variant.is_active and self.variant.stock_quantity >= self.quantity
-        return self.product.is_active and self.product.stock_quantity >= self.quantity
+            return self.variant.is_active and self.variant.available_quantity >= self.quantity
+        return self.product.is_active and self.product.available_quantity >= self.quantity
 
     def save(self, *args, **kwargs):
         # Validate stock availability
         if self.variant:
-            if self.quantity > self.variant.stock_quantity:
+            if self.quantity > self.variant.available_quantity:
                 from django.core.exceptions import ValidationError
-                raise ValidationError(f"Only {self.variant.stock_quantity} items available in stock")
+                raise ValidationError(f"Only {self.variant.available_quantity} items available in stock")
         else:
-            if self.quantity > self.product.stock_quantity:
+            if self.quantity > self.product.available_quantity:
                 from django.core.exceptions import ValidationError
-                raise ValidationError(f"Only {self.product.stock_quantity} items available in stock")
+                raise ValidationError(f"Only {self.product.available_quantity} items available in stock")
 
         super().save(*args, **kwargs)
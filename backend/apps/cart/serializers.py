@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
+from .services import VERDICTS
 from apps.main.serializers import ProductListSerializer, ProductVariantSerializer
-from apps.main.models import Product, ProductVariant
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -24,55 +24,56 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class CartItemCreateSerializer(serializers.ModelSerializer):
-    """Serializer for creating/updating cart items"""
-    product_id = serializers.PrimaryKeyRelatedField(
-        queryset=Product.objects.filter(is_active=True),
-        source='product',
-        write_only=True
-    )
-    variant_id = serializers.PrimaryKeyRelatedField(
-        queryset=ProductVariant.objects.filter(is_active=True),
-        source='variant',
-        write_only=True,
-        required=False,
-        allow_null=True
-    )
+class CartAddItemSerializer(serializers.Serializer):
+    """
+    Input for adding an item to the cart.
+    Existence, ownership and stock are checked by the add upsert itself.
+    """
+    product_id = serializers.IntegerField()
+    variant_id = serializers.IntegerField(required=False, allow_null=True)
+    quantity = serializers.IntegerField(min_value=1, default=1)
 
-    class Meta:
-        model = CartItem
-        fields = ['product_id', 'variant_id', 'quantity']
 
-    def validate_quantity(self, value):
-        """Validate quantity is positive"""
-        if value < 1:
-            raise serializers.ValidationError("Quantity must be at least 1")
-        return value
+class CartOperationSerializer(serializers.Serializer):
+    """Single operation of a batch cart request"""
+    OP_CHOICES = ['add', 'update', 'remove']
+
+    op = serializers.ChoiceField(choices=OP_CHOICES)
+    product_id = serializers.IntegerField(required=False)
+    variant_id = serializers.IntegerField(required=False, allow_null=True)
+    item_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=1)
 
     def validate(self, attrs):
-        """Validate stock availability"""
-        product = attrs.get('product')
-        variant = attrs.get('variant')
-        quantity = attrs.get('quantity', 1)
-
-        # Check if variant belongs to product
-        if variant and variant.product != product:
-            raise serializers.ValidationError({
-                'variant_id': 'This variant does not belong to the selected product'
-            })
-
-        # Check stock availability
-        if variant:
-            if quantity > variant.stock_quantity:
-                raise serializers.ValidationError({
-                    'quantity': f'Only {variant.stock_quantity} items available in stock'
-                })
+        op = attrs['op']
+        if op == 'add':
+            if 'product_id' not in attrs:
+                raise serializers.ValidationError({'product_id': 'This field is required.'})
+            attrs.setdefault('quantity', 1)
         else:
-            if quantity > product.stock_quantity:
-                raise serializers.ValidationError({
-                    'quantity': f'Only {product.stock_quantity} items available in stock'
-                })
+            if 'item_id' not in attrs:
+                raise serializers.ValidationError({'item_id': 'This field is required.'})
+            if op == 'update' and 'quantity' not in attrs:
+                raise serializers.ValidationError({'quantity': 'This field is required.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Batch cart request: either an explicit list of operations
+    or the order number of a past order to put back in the cart.
+    """
+    operations = CartOperationSerializer(many=True, required=False)
+    reorder = serializers.CharField(required=False)
+
+    def validate_operations(self, value):
+        if len(value) > 100:
+            raise serializers.ValidationError("At most 100 operations per request")
+        return value
 
+    def validate(self, attrs):
+        if bool(attrs.get('operations')) == bool(attrs.get('reorder')):
+            raise serializers.ValidationError("Provide either operations or reorder")
         return attrs
 
 
@@ -87,11 +88,49 @@ class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = [
-            'id', 'user', 'items', 'total_items',
+            'id', 'user', 'version', 'items', 'total_items',
             'subtotal', 'total_discount', 'total',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['user', 'created_at', 'updated_at']
+        read_only_fields = ['user', 'version', 'created_at', 'updated_at']
+
+
+class CartDeltaSerializer(serializers.Serializer):
+    """
+    Lightweight response for cart mutations: only the changed line
+    plus recomputed totals and the cart version.
+    """
+    cart_version = serializers.IntegerField(read_only=True)
+    item = CartItemSerializer(read_only=True, allow_null=True)
+    removed_item_id = serializers.IntegerField(read_only=True, allow_null=True)
+    cleared = serializers.BooleanField(read_only=True)
+    total_items = serializers.IntegerField(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    total_discount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+
+
+class CartLineVerdictSerializer(serializers.Serializer):
+    """Revalidation result for one cart line"""
+    item_id = serializers.IntegerField(read_only=True)
+    product_id = serializers.IntegerField(read_only=True)
+    variant_id = serializers.IntegerField(read_only=True, allow_null=True)
+    verdict = serializers.ChoiceField(choices=VERDICTS, read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    available_quantity = serializers.IntegerField(read_only=True)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, allow_null=True)
+    previous_unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, allow_null=True)
+    price_changed = serializers.BooleanField(read_only=True)
+
+
+class CartRevalidationSerializer(serializers.Serializer):
+    """
+    Availability check of the whole cart.
+    is_valid is False when any line is out of stock or reduced.
+    """
+    is_valid = serializers.BooleanField(read_only=True)
+    has_price_changes = serializers.BooleanField(read_only=True)
+    lines = CartLineVerdictSerializer(many=True, read_only=True)
 
 
 class CartItemUpdateSerializer(serializers.Serializer):
@@ -103,13 +142,13 @@ class CartItemUpdateSerializer(serializers.Serializer):
         cart_item = self.context.get('cart_item')
         if cart_item:
             if cart_item.variant:
-                if value > cart_item.variant.stock_quantity:
+                if value > cart_item.variant.available_quantity:
                     raise serializers.ValidationError(
-                        f'Only {cart_item.variant.stock_quantity} items available in stock'
+                        f'Only {cart_item.variant.available_quantity} items available in stock'
                     )
             else:
-                if value > cart_item.product.stock_quantity:
+                if value > cart_item.product.available_quantity:
                     raise serializers.ValidationError(
-                        f'Only {cart_item.product.stock_quantity} items available in stock'
+                        f'Only {cart_item.product.available_quantity} items available in stock'
                     )
         return value
@@ -0,0 +1,469 @@
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.db import connection, transaction
+from django.db.models import (
+    DecimalField, ExpressionWrapper, F, IntegerField, Prefetch, Sum, Value
+)
+from django.db.models.functions import Coalesce, Greatest, NullIf
+from django.utils import timezone
+
+from apps.main.models import Product, ProductVariant
+from apps.main.services import available_stock_sql
+from .models import Cart, CartItem
+
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+ZERO = Value(Decimal('0.00'), output_field=MONEY)
+
+# Available stock (snapshot + uncompacted movements - held) per table alias
+P_AVAILABLE = available_stock_sql('products', 'p')
+V_AVAILABLE = available_stock_sql('product_variants', 'v')
+SP_AVAILABLE = available_stock_sql('products', 'sp')
+SV_AVAILABLE = available_stock_sql('product_variants', 'sv')
+
+
+ADD_ITEM_SQL = f"""
+WITH cart AS (
+    INSERT INTO carts (user_id, version, created_at, updated_at)
+    VALUES (%(user_id)s, 1, %(now)s, %(now)s)
+    ON CONFLICT (user_id) DO UPDATE
+    SET version = carts.version + 1, updated_at = EXCLUDED.updated_at
+    RETURNING id
+)
+INSERT INTO cart_items (cart_id, product_id, variant_id, quantity, unit_price_snapshot,
+                        created_at, updated_at)
+SELECT cart.id, p.id, v.id, %(quantity)s,
+       COALESCE(NULLIF(p.discount_price, 0), p.base_price) + COALESCE(v.price_adjustment, 0),
+       %(now)s, %(now)s
+FROM cart
+CROSS JOIN products p
+LEFT JOIN product_variants v
+    ON v.id = %(variant_id)s::bigint AND v.product_id = p.id AND v.is_active
+WHERE p.id = %(product_id)s
+    AND p.is_active
+    AND (%(variant_id)s::bigint IS NULL OR v.id IS NOT NULL)
+    AND COALESCE({V_AVAILABLE}, {P_AVAILABLE}) >= %(quantity)s
+ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE
+SET quantity = cart_items.quantity + EXCLUDED.quantity,
+    updated_at = EXCLUDED.updated_at
+WHERE cart_items.quantity + EXCLUDED.quantity <= (
+    SELECT COALESCE({SV_AVAILABLE}, {SP_AVAILABLE})
+    FROM products sp
+    LEFT JOIN product_variants sv ON sv.id = EXCLUDED.variant_id
+    WHERE sp.id = EXCLUDED.product_id
+)
+RETURNING id, cart_id, quantity
+"""
+
+
+LINE_AVAILABILITY_SQL = f"""
+SELECT k.product_id, k.variant_id,
+       p.id, p.is_active, GREATEST({P_AVAILABLE}, 0),
+       p.base_price, p.discount_price,
+       v.id, v.product_id, v.is_active, GREATEST({V_AVAILABLE}, 0),
+       v.price_adjustment
+FROM (VALUES {{values}}) AS k(product_id, variant_id)
+LEFT JOIN products p ON p.id = k.product_id
+LEFT JOIN product_variants v ON v.id = k.variant_id
+"""
+
+MERGE_LINES_SQL = f"""
+INSERT INTO cart_items (cart_id, product_id, variant_id, quantity, unit_price_snapshot,
+                        created_at, updated_at)
+SELECT %s, p.id, v.id,
+       LEAST(k.quantity, COALESCE({V_AVAILABLE}, {P_AVAILABLE})),
+       COALESCE(NULLIF(p.discount_price, 0), p.base_price) + COALESCE(v.price_adjustment, 0),
+       %s, %s
+FROM (VALUES {{values}}) AS k(product_id, variant_id, quantity)
+JOIN products p ON p.id = k.product_id AND p.is_active
+LEFT JOIN product_variants v
+    ON v.id = k.variant_id AND v.product_id = p.id AND v.is_active
+WHERE (k.variant_id IS NULL OR v.id IS NOT NULL)
+    AND COALESCE({V_AVAILABLE}, {P_AVAILABLE}) > 0
+ON CONFLICT (cart_id, product_id, variant_id) DO UPDATE
+SET quantity = GREATEST(cart_items.quantity, LEAST(
+        cart_items.quantity + EXCLUDED.quantity,
+        (SELECT COALESCE({SV_AVAILABLE}, {SP_AVAILABLE})
+         FROM products sp
+         LEFT JOIN product_variants sv ON sv.id = EXCLUDED.variant_id
+         WHERE sp.id = EXCLUDED.product_id)
+    )),
+    updated_at = EXCLUDED.updated_at
+"""
+
+LineKey = Tuple[int, Optional[int]]
+
+# Revalidation verdicts, most severe first
+VERDICT_OUT_OF_STOCK = 'out_of_stock'
+VERDICT_REDUCED = 'reduced'
+VERDICT_PRICE_CHANGED = 'price_changed'
+VERDICT_OK = 'ok'
+VERDICTS = [VERDICT_OUT_OF_STOCK, VERDICT_REDUCED, VERDICT_PRICE_CHANGED, VERDICT_OK]
+# Lines that can't be ordered as they are
+BLOCKING_VERDICTS = (VERDICT_OUT_OF_STOCK, VERDICT_REDUCED)
+
+
+class CartItemError(Exception):
+    """Cart line could not be changed (missing product, not enough stock, ...)"""
+
+
+class CartBatchError(Exception):
+    """One or more batch operations were rejected"""
+
+    def __init__(self, errors):
+        super().__init__('Cart operations rejected')
+        self.errors = errors
+
+
+def _line_prices(prefix=''):
+    """
+    SQL expressions for (unit_price, original_price) of a cart line.
+    Mirrors CartItem.unit_price / CartItem.original_price.
+    """
+    adjustment = Coalesce(F(f'{prefix}variant__price_adjustment'), ZERO, output_field=MONEY)
+    unit_price = ExpressionWrapper(
+        Coalesce(
+            NullIf(F(f'{prefix}product__discount_price'), ZERO),
+            F(f'{prefix}product__base_price'),
+            output_field=MONEY
+        ) + adjustment,
+        output_field=MONEY
+    )
+    original_price = ExpressionWrapper(
+        F(f'{prefix}product__base_price') + adjustment,
+        output_field=MONEY
+    )
+    return unit_price, original_price
+
+
+class CartService:
+    """Helpers for cart mutations and lightweight (delta) responses"""
+
+    @staticmethod
+    def get_cart_with_items(cart_id) -> Cart:
+        """Load cart with everything CartSerializer needs"""
+        return Cart.objects.prefetch_related(
+            Prefetch('items__product', queryset=Product.objects.with_stock()),
+            'items__product__images',
+            'items__product__category',
+            'items__product__brand',
+            Prefetch('items__variant', queryset=ProductVariant.objects.with_stock())
+        ).get(id=cart_id)
+
+    @staticmethod
+    def add_item(user, product_id: int, variant_id: Optional[int], quantity: int) -> CartItem:
+        """
+        Add quantity to the user's cart in a single statement.
+
+        Creates the cart if needed, bumps its version and inserts the line or
+        increments an existing one, with the stock guard evaluated by the
+        database so concurrent adds can neither fail on the unique
+        constraint nor oversell.
+        """
+        params = {
+            'user_id': user.id,
+            'product_id': product_id,
+            'variant_id': variant_id,
+            'quantity': quantity,
+            'now': timezone.now(),
+        }
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(ADD_ITEM_SQL, params)
+                row = cursor.fetchone()
+            if row is None:
+                # Nothing was written: roll back the version bump
+                # and explain why (off the hot path)
+                transaction.set_rollback(True)
+
+        if row is None:
+            raise CartItemError(CartService._add_item_error(user, product_id, variant_id, quantity))
+
+        item_id, cart_id, new_quantity = row
+        return CartItem(id=item_id, cart_id=cart_id, product_id=product_id,
+                        variant_id=variant_id, quantity=new_quantity)
+
+    @staticmethod
+    def _add_item_error(user, product_id, variant_id, quantity) -> str:
+        """Error message for a rejected add"""
+        product = Product.objects.filter(id=product_id, is_active=True).only(
+            'stock_quantity', 'reserved_quantity'
+        ).with_stock().first()
+        if product is None:
+            return 'Product not found'
+
+        stock = product.available_quantity
+        if variant_id is not None:
+            variant = ProductVariant.objects.filter(
+                id=variant_id, is_active=True
+            ).only('product_id', 'stock_quantity', 'reserved_quantity').with_stock().first()
+            if variant is None:
+                return 'Variant not found'
+            if variant.product_id != product_id:
+                return 'This variant does not belong to the selected product'
+            stock = variant.available_quantity
+
+        in_cart = CartItem.objects.filter(
+            cart__user=user, product_id=product_id, variant_id=variant_id
+        ).exists()
+        if in_cart:
+            return f'Cannot add {quantity} more. Only {stock} items available in stock'
+        return f'Only {stock} items available in stock'
+
+    @staticmethod
+    def line_availability(keys: Iterable[LineKey]) -> Dict[LineKey, Dict]:
+        """
+        Available stock, status and current prices for many (product_id, variant_id)
+        lines in one query, without hydrating Product/ProductVariant rows.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        values = ', '.join(['(%s::bigint, %s::bigint)'] * len(keys))
+        params = [value for key in keys for value in key]
+        with connection.cursor() as cursor:
+            cursor.execute(LINE_AVAILABILITY_SQL.format(values=values), params)
+            rows = cursor.fetchall()
+
+        lines = {}
+        for (product_id, variant_id, p_id, p_active, p_stock, base_price, discount_price,
+             v_id, v_product_id, v_active, v_stock, adjustment) in rows:
+            line = {'error': None, 'is_active': False, 'available_quantity': 0,
+                    'unit_price': None, 'original_price': None}
+            lines[(product_id, variant_id)] = line
+
+            if p_id is None:
+                line['error'] = 'Product not found'
+                continue
+
+            # Prices are reported even for inactive lines (cart totals include them)
+            adjustment = adjustment or Decimal('0.00')
+            line['unit_price'] = (discount_price or base_price) + adjustment
+            line['original_price'] = base_price + adjustment
+
+            if not p_active:
+                line['error'] = 'Product not found'
+                continue
+            if variant_id is not None:
+                if v_id is None or not v_active:
+                    line['error'] = 'Variant not found'
+                    continue
+                if v_product_id != product_id:
+                    line['error'] = 'This variant does not belong to the selected product'
+                    continue
+
+            line['is_active'] = True
+            line['available_quantity'] = v_stock if variant_id is not None else p_stock
+        return lines
+
+    @staticmethod
+    def revalidate(lines: Iterable[Dict]) -> List[Dict]:
+        """
+        Check cart lines against current stock, status and price.
+
+        Lines are dicts with id, product_id, variant_id, quantity and
+        unit_price_snapshot; availability of all of them is fetched with
+        one query. Returns one verdict per line: out_of_stock, reduced
+        (less stock than the cart quantity), price_changed or ok.
+        """
+        lines = list(lines)
+        availability = CartService.line_availability(
+            (line['product_id'], line['variant_id']) for line in lines
+        )
+
+        verdicts = []
+        for line in lines:
+            current = availability[(line['product_id'], line['variant_id'])]
+            stock = current['available_quantity'] if not current['error'] else 0
+            previous_price = line['unit_price_snapshot']
+            price_changed = (
+                previous_price is not None
+                and current['unit_price'] is not None
+                and current['unit_price'] != previous_price
+            )
+
+            if stock <= 0:
+                verdict = VERDICT_OUT_OF_STOCK
+            elif line['quantity'] > stock:
+                verdict = VERDICT_REDUCED
+            elif price_changed:
+                verdict = VERDICT_PRICE_CHANGED
+            else:
+                verdict = VERDICT_OK
+
+            verdicts.append({
+                'item_id': line['id'],
+                'product_id': line['product_id'],
+                'variant_id': line['variant_id'],
+                'verdict': verdict,
+                'quantity': line['quantity'],
+                'available_quantity': min(line['quantity'], max(stock, 0)),
+                'unit_price': current['unit_price'],
+                'previous_unit_price': previous_price,
+                'price_changed': price_changed,
+            })
+        return verdicts
+
+    @staticmethod
+    def apply_operations(user, operations: List[Dict]) -> Cart:
+        """
+        Apply a list of add/update/remove operations atomically.
+
+        Resulting quantities are computed in memory, stock for every
+        referenced line is checked with one query, and changes are written
+        with one bulk upsert plus one delete. Raises CartBatchError listing
+        every failing operation; nothing is written in that case.
+        """
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            # Serialize with other batches and single adds on this cart
+            Cart.objects.select_for_update().filter(id=cart.id).first()
+
+            existing = {
+                (item['product_id'], item['variant_id']): item
+                for item in CartItem.objects.filter(cart=cart).values(
+                    'id', 'product_id', 'variant_id', 'quantity'
+                )
+            }
+            by_id = {item['id']: key for key, item in existing.items()}
+            quantities = {key: item['quantity'] for key, item in existing.items()}
+            touched = {}
+            errors = []
+
+            for index, op in enumerate(operations):
+                if op['op'] == 'add':
+                    key = (op['product_id'], op.get('variant_id'))
+                    quantities[key] = quantities.get(key, 0) + op['quantity']
+                else:
+                    key = by_id.get(op['item_id'])
+                    if key is None:
+                        errors.append({'index': index, 'error': 'Cart item not found'})
+                        continue
+                    quantities[key] = op['quantity'] if op['op'] == 'update' else 0
+                touched.setdefault(key, index)
+
+            availability = CartService.line_availability(
+                key for key in touched if quantities[key] > 0
+            )
+            for key, index in touched.items():
+                quantity = quantities[key]
+                if quantity == 0:
+                    continue
+                line = availability[key]
+                if line['error']:
+                    errors.append({'index': index, 'error': line['error']})
+                elif quantity > line['available_quantity']:
+                    errors.append({
+                        'index': index,
+                        'error': f"Only {line['available_quantity']} items available in stock"
+                    })
+
+            if errors:
+                raise CartBatchError(sorted(errors, key=lambda e: e['index']))
+
+            now = timezone.now()
+            # unit_price_snapshot is only written for new lines
+            upserts = [
+                CartItem(cart=cart, product_id=key[0], variant_id=key[1],
+                         quantity=quantities[key], unit_price_snapshot=availability[key]['unit_price'],
+                         created_at=now, updated_at=now)
+                for key in touched
+                if quantities[key] > 0 and quantities[key] != existing.get(key, {}).get('quantity')
+            ]
+            removed = [existing[key]['id'] for key in touched if quantities[key] == 0 and key in existing]
+
+            if upserts:
+                CartItem.objects.bulk_create(
+                    upserts,
+                    update_conflicts=True,
+                    unique_fields=['cart', 'product', 'variant'],
+                    update_fields=['quantity', 'updated_at']
+                )
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+            CartService.bump_version(cart.id)
+
+        return cart
+
+    @staticmethod
+    def merge_lines(user, lines: List[Tuple[int, Optional[int], int]]) -> int:
+        """
+        Add (product_id, variant_id, quantity) lines to the user's cart
+        with one upsert. Quantities are capped at current stock instead of
+        rejected, and inactive or missing products are skipped.
+        Returns the number of lines written.
+        """
+        if not lines:
+            return 0
+
+        now = timezone.now()
+        values = ', '.join(['(%s::bigint, %s::bigint, %s::integer)'] * len(lines))
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            params = [cart.id, now, now] + [value for line in lines for value in line]
+            with connection.cursor() as cursor:
+                cursor.execute(MERGE_LINES_SQL.format(values=values), params)
+                merged = cursor.rowcount
+            if merged:
+                CartService.bump_version(cart.id)
+        return merged
+
+    @staticmethod
+    def reorder_operations(user, order_number: str) -> List[Dict]:
+        """Add operations that put every line of a past order back in the cart"""
+        from apps.payment.models import ArchivedOrder, Order, OrderItem
+
+        if not Order.objects.filter(order_number=order_number, user=user).exists():
+            archived = ArchivedOrder.objects.filter(
+                order_number=order_number, user=user
+            ).only('document').first()
+            if archived is None:
+                raise CartItemError('Order not found')
+            return [
+                {'op': 'add', 'product_id': item['product']['id'],
+                 'variant_id': item['variant']['id'] if item['variant'] else None,
+                 'quantity': item['quantity']}
+                for item in archived.data['order']['items']
+            ]
+
+        return [
+            {'op': 'add', 'product_id': item['product_id'],
+             'variant_id': item['variant_id'], 'quantity': item['quantity']}
+            for item in OrderItem.objects.filter(
+                order__order_number=order_number
+            ).values('product_id', 'variant_id', 'quantity')
+        ]
+
+    @staticmethod
+    def bump_version(cart_id) -> None:
+        """Mark cart as changed so clients can detect stale copies"""
+        Cart.objects.filter(id=cart_id).update(
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def summary(user) -> Dict:
+        """
+        Cart version and totals computed in a single aggregate query,
+        without loading any items.
+        """
+        unit_price, original_price = _line_prices('items__')
+        quantity = F('items__quantity')
+
+        row = Cart.objects.filter(user=user).annotate(
+            total_items=Coalesce(Sum(quantity), 0, output_field=IntegerField()),
+            subtotal=Coalesce(Sum(original_price * quantity, output_field=MONEY), ZERO),
+            total_discount=Coalesce(
+                Sum(Greatest(original_price - unit_price, ZERO) * quantity, output_field=MONEY),
+                ZERO
+            ),
+        ).values('version', 'total_items', 'subtotal', 'total_discount').get()
+
+        return {
+            'cart_version': row['version'],
+            'total_items': row['total_items'],
+            'subtotal': row['subtotal'],
+            'total_discount': row['total_discount'],
+            'total': row['subtotal'] - row['total_discount'],
+        }
@@ -0,0 +1,684 @@
+"""
+Cart storage backends.
+
+DatabaseCartStore reads and writes Cart/CartItem directly (default).
+RedisCartStore keeps active carts in Redis hashes and writes them behind
+to PostgreSQL: dirty carts are flushed periodically by
+apps.cart.tasks.flush_dirty_carts and synchronously before checkout.
+
+The backend is selected with settings.CART_STORAGE_BACKEND.
+
+GuestCartStore keeps anonymous carts (signed X-Cart-Token) in Redis only;
+merge_guest_cart() folds them into the user's cart on login.
+"""
+import json
+import uuid
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.main.models import Product, ProductVariant
+from config.redis_client import get_redis
+from .models import Cart, CartItem
+from .services import CartService, CartItemError
+
+
+class DatabaseCartStore:
+    """Carts live only in PostgreSQL"""
+
+    def get_cart(self, user) -> Cart:
+        cart, created = Cart.objects.get_or_create(user=user)
+        return CartService.get_cart_with_items(cart.id)
+
+    def get_item(self, user, item_id) -> CartItem:
+        return get_object_or_404(
+            CartItem.objects.select_related('cart').prefetch_related(
+                Prefetch('product', queryset=Product.objects.select_related(
+                    'category', 'brand'
+                ).with_stock()),
+                'product__images',
+                Prefetch('variant', queryset=ProductVariant.objects.with_stock())
+            ),
+            id=item_id,
+            cart__user=user
+        )
+
+    def add_item(self, user, product_id, variant_id, quantity) -> CartItem:
+        return CartService.add_item(user, product_id, variant_id, quantity)
+
+    def set_quantity(self, user, cart_item, quantity) -> CartItem:
+        cart_item.quantity = quantity
+        cart_item.save()
+        CartService.bump_version(cart_item.cart_id)
+        return cart_item
+
+    def remove_item(self, user, item_id) -> None:
+        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=user)
+        cart_item.delete()
+        CartService.bump_version(cart_item.cart_id)
+
+    def clear(self, user) -> None:
+        cart, created = Cart.objects.get_or_create(user=user)
+        cart.items.all().delete()
+        CartService.bump_version(cart.id)
+
+    def apply_operations(self, user, operations) -> None:
+        CartService.apply_operations(user, operations)
+
+    def merge_lines(self, user, lines) -> int:
+        return CartService.merge_lines(user, lines)
+
+    def summary(self, user) -> Dict:
+        return CartService.summary(user)
+
+    def revalidate(self, user) -> List[Dict]:
+        return CartService.revalidate(
+            CartItem.objects.filter(cart__user=user).values(
+                'id', 'product_id', 'variant_id', 'quantity', 'unit_price_snapshot'
+            )
+        )
+
+    def flush(self, user_id, evict=False) -> bool:
+        # Nothing to persist: PostgreSQL is the only copy
+        return False
+
+
+# Redis layout: one hash per user cart
+#   cart_id, version, created_at, updated_at
+#   item:<product_id>:<variant_id>  -> cart item id
+#   line:<item_id>                  -> JSON {product_id, variant_id, quantity,
+#                                            unit_price_snapshot, ...}
+# plus a set of user ids whose carts have unflushed changes.
+CART_KEY = 'cart:{user_id}'
+CART_LOCK_KEY = 'cart:{user_id}:lock'
+DIRTY_CARTS_KEY = 'cart:dirty'
+GUEST_CART_KEY = 'guest_cart:{user_id}'
+GUEST_TOKEN_SALT = 'apps.cart.guest'
+CART_TOKEN_HEADER = 'X-Cart-Token'
+
+# Common tail of every mutation: version, TTL and dirty marker (if any)
+_TOUCH_LUA = """
+redis.call('HSET', KEYS[1], 'updated_at', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if KEYS[2] then
+    redis.call('SADD', KEYS[2], ARGV[3])
+end
+"""
+
+# Populate the hash only if nobody else did in the meantime
+LOAD_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Drop the cart only if no mutation landed since the given version was read
+EVICT_LUA = """
+if redis.call('HGET', KEYS[1], 'version') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# ARGV: touch args (3), item field, quantity, stock, new id, product id, variant id, unit price
+# Returns {item_id, quantity}; {0, current} when stock is insufficient,
+# {-1, 0} when a new id is needed, {-2, 0} when the cart is not loaded.
+ADD_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-2, 0}
+end
+local id = redis.call('HGET', KEYS[1], ARGV[4])
+local line
+if id then
+    line = cjson.decode(redis.call('HGET', KEYS[1], 'line:' .. id))
+else
+    if ARGV[7] == '' then
+        return {-1, 0}
+    end
+    id = ARGV[7]
+    line = {
+        product_id = tonumber(ARGV[8]),
+        variant_id = ARGV[9] ~= '' and tonumber(ARGV[9]) or cjson.null,
+        quantity = 0,
+        unit_price_snapshot = ARGV[10],
+        created_at = ARGV[1],
+        field = ARGV[4],
+    }
+end
+local quantity = line.quantity + tonumber(ARGV[5])
+if quantity > tonumber(ARGV[6]) then
+    return {0, line.quantity}
+end
+line.quantity = quantity
+line.updated_at = ARGV[1]
+redis.call('HSET', KEYS[1], ARGV[4], id, 'line:' .. id, cjson.encode(line))
+""" + _TOUCH_LUA + """
+return {tonumber(id), quantity}
+"""
+
+# ARGV: touch args (3), item id, quantity
+SET_QUANTITY_LUA = """
+local raw = redis.call('HGET', KEYS[1], 'line:' .. ARGV[4])
+if not raw then
+    return 0
+end
+local line = cjson.decode(raw)
+line.quantity = tonumber(ARGV[5])
+line.updated_at = ARGV[1]
+redis.call('HSET', KEYS[1], 'line:' .. ARGV[4], cjson.encode(line))
+""" + _TOUCH_LUA + """
+return 1
+"""
+
+# ARGV: touch args (3), item id
+REMOVE_LUA = """
+local raw = redis.call('HGET', KEYS[1], 'line:' .. ARGV[4])
+if not raw then
+    return 0
+end
+local line = cjson.decode(raw)
+redis.call('HDEL', KEYS[1], 'line:' .. ARGV[4], line.field)
+""" + _TOUCH_LUA + """
+return 1
+"""
+
+# ARGV: touch args (3)
+CLEAR_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    local prefix = string.sub(field, 1, 5)
+    if prefix == 'line:' or prefix == 'item:' then
+        redis.call('HDEL', KEYS[1], field)
+    end
+end
+""" + _TOUCH_LUA + """
+return 1
+"""
+
+NEXT_ITEM_ID_SQL = "SELECT nextval(pg_get_serial_sequence('cart_items', 'id'))"
+
+
+def _item_field(product_id, variant_id):
+    return f"item:{product_id}:{'' if variant_id is None else variant_id}"
+
+
+def _lines(data) -> List[Dict]:
+    """Decode cart lines from a raw cart hash"""
+    lines = []
+    for field, raw in data.items():
+        if field.startswith('line:'):
+            line = json.loads(raw)
+            line['id'] = int(field[len('line:'):])
+            snapshot = line.get('unit_price_snapshot')
+            line['unit_price_snapshot'] = Decimal(snapshot) if snapshot is not None else None
+            lines.append(line)
+    return lines
+
+
+class RedisCartStore:
+    """
+    Active carts in Redis, persisted to Cart/CartItem asynchronously.
+
+    Mutations are single Lua scripts, so concurrent requests on one cart
+    can't lose updates. New lines take their id from the cart_items
+    sequence, so item ids are the same before and after a flush.
+    """
+
+    key_template = CART_KEY
+    dirty_key = DIRTY_CARTS_KEY
+
+    def __init__(self):
+        self.redis = get_redis()
+
+    @property
+    def ttl(self):
+        return settings.CART_REDIS_TTL
+
+    def _owner(self, user):
+        """Value the cart key is built from"""
+        return user.id
+
+    def _key(self, owner):
+        return self.key_template.format(user_id=owner)
+
+    def _run(self, script, owner, *args):
+        """Run a mutation script; the first three args are shared by all of them"""
+        keys = [self._key(owner)]
+        if self.dirty_key:
+            keys.append(self.dirty_key)
+        return self.redis.register_script(script)(
+            keys=keys,
+            args=[timezone.now().isoformat(), self.ttl, owner, *args]
+        )
+
+    def _read(self, owner) -> Dict:
+        """Raw cart hash (empty if not in Redis), refreshing its TTL"""
+        key = self._key(owner)
+        with self.redis.pipeline() as pipe:
+            pipe.hgetall(key)
+            pipe.expire(key, self.ttl)
+            data, _ = pipe.execute()
+        return data
+
+    def _load(self, user) -> Dict:
+        """Raw cart hash, copied from PostgreSQL on first access"""
+        key = self._key(user.id)
+        data = self._read(user.id)
+        if data:
+            return data
+
+        cart, created = Cart.objects.get_or_create(user=user)
+        mapping = {
+            'cart_id': cart.id,
+            'version': cart.version,
+            'created_at': cart.created_at.isoformat(),
+            'updated_at': cart.updated_at.isoformat(),
+        }
+        for item in CartItem.objects.filter(cart=cart).values(
+            'id', 'product_id', 'variant_id', 'quantity', 'unit_price_snapshot',
+            'created_at', 'updated_at'
+        ):
+            snapshot = item['unit_price_snapshot']
+            field = _item_field(item['product_id'], item['variant_id'])
+            mapping[field] = item['id']
+            mapping[f"line:{item['id']}"] = json.dumps({
+                'product_id': item['product_id'],
+                'variant_id': item['variant_id'],
+                'quantity': item['quantity'],
+                'unit_price_snapshot': str(snapshot) if snapshot is not None else None,
+                'created_at': item['created_at'].isoformat(),
+                'updated_at': item['updated_at'].isoformat(),
+                'field': field,
+            })
+
+        args = [value for pair in mapping.items() for value in pair]
+        self.redis.register_script(LOAD_LUA)(keys=[key], args=[self.ttl, *args])
+        return self.redis.hgetall(key)
+
+    def _cart_id(self, data):
+        return int(data['cart_id'])
+
+    def _cart(self, user, data, items) -> Cart:
+        """Unsaved Cart serving cart.items.all() from memory"""
+        cart = Cart(
+            id=self._cart_id(data),
+            user=user,
+            version=int(data['version']),
+            created_at=parse_datetime(data['created_at']),
+            updated_at=parse_datetime(data['updated_at'])
+        )
+        # Same cache prefetch_related('items') fills
+        queryset = CartItem.objects.none()
+        queryset._result_cache = items
+        queryset._prefetch_done = True
+        cart._prefetched_objects_cache = {'items': queryset}
+        return cart
+
+    def _hydrate(self, data, lines) -> List[CartItem]:
+        """Unsaved CartItem instances with product relations loaded"""
+        products = Product.objects.select_related('category', 'brand').prefetch_related(
+            'images'
+        ).with_stock().in_bulk({line['product_id'] for line in lines})
+        variants = ProductVariant.objects.with_stock().in_bulk(
+            {line['variant_id'] for line in lines if line['variant_id'] is not None}
+        )
+
+        items = []
+        for line in sorted(lines, key=lambda line: line['created_at'], reverse=True):
+            product = products.get(line['product_id'])
+            variant = variants.get(line['variant_id'])
+            # Product or variant deleted since it was added: dropped on next flush
+            if product is None or (line['variant_id'] is not None and variant is None):
+                continue
+            items.append(CartItem(
+                id=line['id'],
+                cart_id=self._cart_id(data),
+                product=product,
+                variant=variant,
+                quantity=line['quantity'],
+                created_at=parse_datetime(line['created_at']),
+                updated_at=parse_datetime(line['updated_at'])
+            ))
+        return items
+
+    def get_cart(self, user) -> Cart:
+        data = self._load(user)
+        return self._cart(user, data, self._hydrate(data, _lines(data)))
+
+    def get_item(self, user, item_id) -> CartItem:
+        data = self._load(user)
+        raw = data.get(f'line:{item_id}')
+        if raw is None:
+            raise Http404('No CartItem matches the given query.')
+
+        line = json.loads(raw)
+        line['id'] = int(item_id)
+        items = self._hydrate(data, [line])
+        if not items:
+            raise Http404('No CartItem matches the given query.')
+        return items[0]
+
+    def _next_item_id(self, owner) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(NEXT_ITEM_ID_SQL)
+            return cursor.fetchone()[0]
+
+    def add_item(self, user, product_id, variant_id, quantity) -> CartItem:
+        line = CartService.line_availability([(product_id, variant_id)])[(product_id, variant_id)]
+        if line['error']:
+            raise CartItemError(line['error'])
+
+        owner = self._owner(user)
+        data = self._load(user)
+        field = _item_field(product_id, variant_id)
+        new_id = '' if field in data else self._next_item_id(owner)
+
+        for attempt in range(3):
+            item_id, new_quantity = self._run(
+                ADD_LUA, owner, field, quantity, line['available_quantity'],
+                new_id, product_id, '' if variant_id is None else variant_id,
+                str(line['unit_price'])
+            )
+            if item_id == -1:
+                # Line was removed concurrently
+                new_id = self._next_item_id(owner)
+            elif item_id == -2:
+                # Cart expired between load and write
+                data = self._load(user)
+            else:
+                break
+
+        if item_id == 0:
+            stock = line['available_quantity']
+            if new_quantity > 0:
+                raise CartItemError(f'Cannot add {quantity} more. Only {stock} items available in stock')
+            raise CartItemError(f'Only {stock} items available in stock')
+        if item_id < 0:
+            raise CartItemError('Cart is busy, please try again')
+
+        return CartItem(id=item_id, cart_id=self._cart_id(data), product_id=product_id,
+                        variant_id=variant_id, quantity=new_quantity)
+
+    def set_quantity(self, user, cart_item, quantity) -> CartItem:
+        if not self._run(SET_QUANTITY_LUA, self._owner(user), cart_item.id, quantity):
+            raise Http404('No CartItem matches the given query.')
+        cart_item.quantity = quantity
+        return cart_item
+
+    def remove_item(self, user, item_id) -> None:
+        self._load(user)
+        if not self._run(REMOVE_LUA, self._owner(user), item_id):
+            raise Http404('No CartItem matches the given query.')
+
+    def clear(self, user) -> None:
+        self._load(user)
+        self._run(CLEAR_LUA, self._owner(user))
+
+    def _in_database(self, user, write, *args):
+        """
+        Run a PostgreSQL-side cart write: persist and drop the Redis copy
+        first, so the next read picks up the result.
+        """
+        with self.redis.lock(CART_LOCK_KEY.format(user_id=user.id), timeout=30, blocking_timeout=10):
+            self._evict_locked(user.id)
+            version = Cart.objects.filter(user=user).values_list('version', flat=True).first()
+            result = write(user, *args)
+            # A copy read back while the write ran predates it; drop it
+            # unless a mutation already landed on it
+            if version is not None:
+                self.redis.register_script(EVICT_LUA)(keys=[self._key(user.id)], args=[version])
+        return result
+
+    def apply_operations(self, user, operations) -> None:
+        self._in_database(user, CartService.apply_operations, operations)
+
+    def merge_lines(self, user, lines) -> int:
+        return self._in_database(user, CartService.merge_lines, lines)
+
+    def summary(self, user) -> Dict:
+        data = self._load(user)
+        lines = _lines(data)
+        availability = CartService.line_availability(
+            (line['product_id'], line['variant_id']) for line in lines
+        )
+
+        total_items = 0
+        subtotal = total_discount = Decimal('0.00')
+        for line in lines:
+            prices = availability[(line['product_id'], line['variant_id'])]
+            if prices['unit_price'] is None:
+                continue
+            quantity = line['quantity']
+            total_items += quantity
+            subtotal += prices['original_price'] * quantity
+            total_discount += max(prices['original_price'] - prices['unit_price'], Decimal('0.00')) * quantity
+
+        return {
+            'cart_version': int(data['version']),
+            'total_items': total_items,
+            'subtotal': subtotal,
+            'total_discount': total_discount,
+            'total': subtotal - total_discount,
+        }
+
+    def revalidate(self, user) -> List[Dict]:
+        return CartService.revalidate(_lines(self._load(user)))
+
+    def flush(self, user_id, evict=False) -> bool:
+        """
+        Write the Redis copy of a cart to PostgreSQL.
+        With evict=True the Redis copy is dropped afterwards (checkout).
+        """
+        with self.redis.lock(CART_LOCK_KEY.format(user_id=user_id), timeout=30, blocking_timeout=10):
+            if evict:
+                return self._evict_locked(user_id)
+            return self._flush_locked(user_id) is not None
+
+    def _evict_locked(self, user_id) -> bool:
+        """
+        Flush, then drop the Redis copy if it still holds the flushed
+        version; a mutation that landed in between is flushed again.
+        """
+        flushed = False
+        while True:
+            version = self._flush_locked(user_id)
+            if version is None:
+                return flushed
+            flushed = True
+            if self.redis.register_script(EVICT_LUA)(keys=[self._key(user_id)], args=[version]):
+                return True
+
+    def _flush_locked(self, user_id) -> Optional[str]:
+        """Write the Redis copy to PostgreSQL; returns the version written (None if no copy)"""
+        data = self.redis.hgetall(self._key(user_id))
+        if not data:
+            return None
+
+        cart_id = int(data['cart_id'])
+        lines = _lines(data)
+        product_ids = set(Product.objects.filter(
+            id__in={line['product_id'] for line in lines}
+        ).values_list('id', flat=True))
+        variant_ids = set(ProductVariant.objects.filter(
+            id__in={line['variant_id'] for line in lines if line['variant_id'] is not None}
+        ).values_list('id', flat=True))
+
+        items = [
+            CartItem(
+                id=line['id'],
+                cart_id=cart_id,
+                product_id=line['product_id'],
+                variant_id=line['variant_id'],
+                quantity=line['quantity'],
+                unit_price_snapshot=line['unit_price_snapshot'],
+                created_at=parse_datetime(line['created_at']),
+                updated_at=parse_datetime(line['updated_at'])
+            )
+            for line in lines
+            if line['product_id'] in product_ids
+            and (line['variant_id'] is None or line['variant_id'] in variant_ids)
+        ]
+
+        with transaction.atomic():
+            # Delete first: a line removed and added again has a new id but
+            # the same (cart, product, variant) as the row it replaces
+            CartItem.objects.filter(cart_id=cart_id).exclude(
+                id__in=[item.id for item in items]
+            ).delete()
+            if items:
+                CartItem.objects.bulk_create(
+                    items,
+                    update_conflicts=True,
+                    unique_fields=['id'],
+                    update_fields=['quantity', 'updated_at']
+                )
+            Cart.objects.filter(id=cart_id).update(
+                version=int(data['version']),
+                updated_at=parse_datetime(data['updated_at'])
+            )
+        return data['version']
+
+
+class GuestCart:
+    """
+    In-memory cart of a guest (there is no carts row).
+    Has the attributes CartSerializer reads from Cart.
+    """
+    id = None
+    user = None
+
+    def __init__(self, version, created_at, updated_at, items):
+        self.version = version
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.items = items
+
+    @property
+    def total_items(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def subtotal(self):
+        return sum(item.original_price * item.quantity for item in self.items)
+
+    @property
+    def total_discount(self):
+        return sum(item.discount_amount for item in self.items)
+
+    @property
+    def total(self):
+        return self.subtotal - self.total_discount
+
+
+class GuestCartStore(RedisCartStore):
+    """
+    Carts of anonymous visitors, identified by a signed cart token.
+
+    Stored only in Redis (never flushed, no PostgreSQL rows) and expire
+    after GUEST_CART_TTL seconds without activity. Merged into the user's
+    cart on login/registration with merge_guest_cart().
+    Methods take the guest id (from read_guest_token) in place of a user.
+    """
+    key_template = GUEST_CART_KEY
+    dirty_key = None
+
+    @property
+    def ttl(self):
+        return settings.GUEST_CART_TTL
+
+    def _owner(self, guest_id):
+        return guest_id
+
+    def _load(self, guest_id) -> Dict:
+        data = self._read(guest_id)
+        if data:
+            return data
+        # Not stored until the first add
+        now = timezone.now().isoformat()
+        return {'version': '0', 'created_at': now, 'updated_at': now}
+
+    def _cart_id(self, data):
+        return None
+
+    def _cart(self, guest_id, data, items) -> 'GuestCart':
+        return GuestCart(
+            version=int(data['version']),
+            created_at=parse_datetime(data['created_at']),
+            updated_at=parse_datetime(data['updated_at']),
+            items=items
+        )
+
+    def _next_item_id(self, guest_id) -> int:
+        return self.redis.hincrby(self._key(guest_id), 'next_id', 1)
+
+    def add_item(self, guest_id, product_id, variant_id, quantity) -> CartItem:
+        now = timezone.now().isoformat()
+        self.redis.register_script(LOAD_LUA)(
+            keys=[self._key(guest_id)],
+            args=[self.ttl, 'version', 0, 'created_at', now, 'updated_at', now]
+        )
+        return super().add_item(guest_id, product_id, variant_id, quantity)
+
+    def lines(self, guest_id) -> List[Dict]:
+        return _lines(self.redis.hgetall(self._key(guest_id)))
+
+    def delete(self, guest_id) -> None:
+        self.redis.delete(self._key(guest_id))
+
+
+def new_guest_token() -> Tuple[str, str]:
+    """New (guest_id, signed token) pair"""
+    guest_id = uuid.uuid4().hex
+    return guest_id, signing.Signer(salt=GUEST_TOKEN_SALT).sign(guest_id)
+
+
+def read_guest_token(token) -> Optional[str]:
+    """Guest id from a cart token, or None if missing or tampered with"""
+    if not token:
+        return None
+    try:
+        return signing.Signer(salt=GUEST_TOKEN_SALT).unsign(token)
+    except signing.BadSignature:
+        return None
+
+
+def merge_guest_cart(user, token) -> int:
+    """
+    Fold a guest cart into the user's cart (login/registration).
+    Quantities are added to existing lines and capped at current stock;
+    unavailable products are skipped. Returns the number of merged lines.
+    """
+    guest_id = read_guest_token(token)
+    if guest_id is None:
+        return 0
+
+    guest_store = GuestCartStore()
+    lines = guest_store.lines(guest_id)
+    merged = 0
+    if lines:
+        merged = get_cart_store().merge_lines(user, [
+            (line['product_id'], line['variant_id'], line['quantity']) for line in lines
+        ])
+    guest_store.delete(guest_id)
+    return merged
+
+
+def get_cart_store():
+    """Cart storage backend configured by settings.CART_STORAGE_BACKEND"""
+    if settings.CART_STORAGE_BACKEND == 'redis':
+        return RedisCartStore()
+    return DatabaseCartStore()
@@ -0,0 +1,104 @@
+import logging
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from config.redis_client import get_redis
+from .models import Cart
+from .storage import CART_KEY, DIRTY_CARTS_KEY, get_cart_store
+
+logger = logging.getLogger(__name__)
+
+# Carts in one id range untouched since the cutoff, with their items.
+# cart_items.cart_id is a deferred FK, so both deletes can share a statement.
+DELETE_ABANDONED_CARTS_SQL = """
+WITH deleted_carts AS (
+    DELETE FROM carts
+    WHERE id > %(low)s AND id <= %(high)s AND updated_at < %(cutoff)s
+    RETURNING id, user_id
+),
+deleted_items AS (
+    DELETE FROM cart_items
+    WHERE cart_id IN (SELECT id FROM deleted_carts)
+    RETURNING 1
+)
+SELECT (SELECT array_agg(user_id) FROM deleted_carts),
+       (SELECT count(*) FROM deleted_items)
+"""
+
+
+@shared_task
+def flush_dirty_carts(batch_size=500):
+    """Write carts changed in Redis since the last run back to PostgreSQL"""
+    if settings.CART_STORAGE_BACKEND != 'redis':
+        return {'flushed_carts': 0, 'failed_carts': 0}
+
+    store = get_cart_store()
+    redis = get_redis()
+    flushed = failed = 0
+
+    # SPOP before flushing: a change made during the flush marks the cart dirty again
+    for user_id in redis.spop(DIRTY_CARTS_KEY, batch_size) or []:
+        try:
+            if store.flush(int(user_id)):
+                flushed += 1
+        except Exception as e:
+            logger.error(f"Failed to flush cart of user {user_id}: {e}")
+            redis.sadd(DIRTY_CARTS_KEY, user_id)
+            failed += 1
+
+    return {'flushed_carts': flushed, 'failed_carts': failed}
+
+
+@shared_task
+def cleanup_abandoned_carts(days=None, batch_size=None, sleep=None):
+    """
+    Delete carts (and their items) untouched for CART_ABANDONED_DAYS.
+
+    Walks the carts primary key in ranges of CART_CLEANUP_BATCH_SIZE ids,
+    one short transaction per range, sleeping CART_CLEANUP_SLEEP seconds
+    between ranges to keep load on the primary low. A cart is recreated
+    empty on the user's next visit.
+    """
+    days = days if days is not None else settings.CART_ABANDONED_DAYS
+    batch_size = batch_size or settings.CART_CLEANUP_BATCH_SIZE
+    sleep = sleep if sleep is not None else settings.CART_CLEANUP_SLEEP
+
+    cutoff = timezone.now() - timedelta(days=days)
+    max_id = Cart.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    started = time.monotonic()
+    deleted_carts = deleted_items = batches = 0
+
+    for low in range(0, max_id, batch_size):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(DELETE_ABANDONED_CARTS_SQL, {
+                    'low': low, 'high': low + batch_size, 'cutoff': cutoff
+                })
+                user_ids, items = cursor.fetchone()
+        batches += 1
+
+        if user_ids:
+            deleted_carts += len(user_ids)
+            deleted_items += items
+            if settings.CART_STORAGE_BACKEND == 'redis':
+                # Drop copies of deleted carts so they are never flushed back
+                get_redis().delete(*[CART_KEY.format(user_id=user_id) for user_id in user_ids])
+
+        if sleep and low + batch_size < max_id:
+            time.sleep(sleep)
+
+    metrics = {
+        'deleted_carts': deleted_carts,
+        'deleted_items': deleted_items,
+        'batches': batches,
+        'cutoff': cutoff.isoformat(),
+        'duration_seconds': round(time.monotonic() - started, 2),
+    }
+    logger.info(f"Abandoned cart cleanup: {metrics}")
+    return metrics
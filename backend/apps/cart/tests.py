@@ -1,3 +1,58 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from redis.exceptions import RedisError
+
+from apps.main.models import Category, Product
+from config.redis_client import get_redis
+from .models import CartItem
+from .storage import CART_KEY, DIRTY_CARTS_KEY, RedisCartStore
+
+
+def redis_available():
+    try:
+        return get_redis().ping()
+    except RedisError:
+        return False
+
+
+@skipUnless(redis_available(), "Redis is not reachable at REDIS_URL")
+class RedisCartFlushTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='cart@example.com', username='cart', password='x'
+        )
+        category = Category.objects.create(name='Shirts')
+        self.product = Product.objects.create(
+            name='Shirt', description='d', category=category, base_price=10, stock_quantity=20
+        )
+        self.store = RedisCartStore()
+
+    def tearDown(self):
+        get_redis().delete(CART_KEY.format(user_id=self.user.id))
+        get_redis().srem(DIRTY_CARTS_KEY, self.user.id)
+
+    def test_flush_after_remove_and_add_again(self):
+        old = self.store.add_item(self.user, self.product.id, None, 1)
+        self.assertTrue(self.store.flush(self.user.id))
+
+        self.store.remove_item(self.user, old.id)
+        new = self.store.add_item(self.user, self.product.id, None, 3)
+        self.assertNotEqual(new.id, old.id)
+        self.assertTrue(self.store.flush(self.user.id, evict=True))
+
+        self.assertEqual(
+            list(CartItem.objects.values_list('id', 'product_id', 'quantity')),
+            [(new.id, self.product.id, 3)]
+        )
+
+    def test_flush_after_clear_and_add_again(self):
+        self.store.add_item(self.user, self.product.id, None, 2)
+        self.store.flush(self.user.id)
+
+        self.store.clear(self.user)
+        new = self.store.add_item(self.user, self.product.id, None, 1)
+        self.store.flush(self.user.id)
 
-# Create your tests here.
+        self.assertEqual(list(CartItem.objects.values_list('id', 'quantity')), [(new.id, 1)])
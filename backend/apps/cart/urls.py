@@ -6,9 +6,20 @@ urlpatterns = [
     path('', views.CartView.as_view(), name='cart-detail'),
     path('add/', views.CartAddItemView.as_view(), name='cart-add-item'),
     path('clear/', views.CartClearView.as_view(), name='cart-clear'),
+    path('batch/', views.CartBatchView.as_view(), name='cart-batch'),
+    path('revalidate/', views.CartRevalidateView.as_view(), name='cart-revalidate'),
 
     # Cart item operations
     path('items/<int:pk>/', views.CartItemDetailView.as_view(), name='cart-item-detail'),
     path('items/<int:item_id>/update/', views.CartUpdateItemView.as_view(), name='cart-update-item'),
     path('items/<int:item_id>/remove/', views.CartRemoveItemView.as_view(), name='cart-remove-item'),
+
+    # Guest cart (X-Cart-Token header)
+    path('guest/', views.GuestCartView.as_view(), name='guest-cart-detail'),
+    path('guest/add/', views.GuestCartAddItemView.as_view(), name='guest-cart-add-item'),
+    path('guest/clear/', views.GuestCartClearView.as_view(), name='guest-cart-clear'),
+    path('guest/revalidate/', views.GuestCartRevalidateView.as_view(), name='guest-cart-revalidate'),
+    path('guest/items/<int:pk>/', views.GuestCartItemDetailView.as_view(), name='guest-cart-item-detail'),
+    path('guest/items/<int:item_id>/update/', views.GuestCartUpdateItemView.as_view(), name='guest-cart-update-item'),
+    path('guest/items/<int:item_id>/remove/', views.GuestCartRemoveItemView.as_view(), name='guest-cart-remove-item'),
 ]
@@ -1,112 +1,130 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.shortcuts import get_object_or_404
-from .models import Cart, CartItem
 from .serializers import (
-    CartSerializer, CartItemSerializer, CartItemCreateSerializer,
-    CartItemUpdateSerializer
+    CartSerializer, CartItemSerializer, CartAddItemSerializer,
+    CartItemUpdateSerializer, CartDeltaSerializer, CartBatchSerializer,
+    CartRevalidationSerializer
 )
+from .services import BLOCKING_VERDICTS, CartService, CartItemError, CartBatchError
+from .storage import (
+    CART_TOKEN_HEADER, GuestCartStore, get_cart_store, new_guest_token, read_guest_token
+)
+
+
+def wants_delta(request):
+    """Client asked for a lightweight response (?mode=delta)"""
+    return request.query_params.get('mode') == 'delta'
+
+
+class CartStoreMixin:
+    """Cart storage and owner used by the cart views (the user's cart)"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_store(self):
+        return get_cart_store()
+
+    def get_owner(self):
+        return self.request.user
 
+    def cart_response(self, item_id=None, removed_item_id=None, cleared=False):
+        """
+        Response for a cart mutation.
+        Full cart by default; only the changed line plus totals in delta mode.
+        """
+        store, owner = self.get_store(), self.get_owner()
+        if not wants_delta(self.request):
+            cart = store.get_cart(owner)
+            return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
 
-class CartView(APIView):
+        data = store.summary(owner)
+        data.update({
+            'item': store.get_item(owner, item_id) if item_id is not None else None,
+            'removed_item_id': removed_item_id,
+            'cleared': cleared,
+        })
+        return Response(CartDeltaSerializer(data).data, status=status.HTTP_200_OK)
+
+
+class GuestCartMixin(CartStoreMixin):
+    """
+    Anonymous cart identified by the signed X-Cart-Token header.
+    A new token is issued (in the same response header) when the request
+    has none or an invalid one.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.new_token = None
+        self.guest_id = read_guest_token(request.headers.get(CART_TOKEN_HEADER))
+        if self.guest_id is None:
+            self.guest_id, self.new_token = new_guest_token()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'new_token', None):
+            response[CART_TOKEN_HEADER] = self.new_token
+        return response
+
+    def get_store(self):
+        return GuestCartStore()
+
+    def get_owner(self):
+        return self.guest_id
+
+
+class CartView(CartStoreMixin, APIView):
     """
     Get user's cart with all items.
     Creates cart automatically if it doesn't exist.
     """
-    permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart = Cart.objects.prefetch_related(
-            'items__product__images',
-            'items__product__category',
-            'items__product__brand',
-            'items__variant'
-        ).get(id=cart.id)
+        cart = self.get_store().get_cart(self.get_owner())
 
         serializer = CartSerializer(cart)
         return Response(serializer.data)
 
 
-class CartAddItemView(APIView):
+class CartAddItemView(CartStoreMixin, APIView):
     """
     Add item to cart or update quantity if item already exists.
-    Returns the full cart object with all items.
+    Returns the full cart object with all items
+    (or only the changed line with ?mode=delta).
     """
-    permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        # Get or create cart for user
-        cart, created = Cart.objects.get_or_create(user=request.user)
-
-        serializer = CartItemCreateSerializer(data=request.data)
+        serializer = CartAddItemSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        product = serializer.validated_data['product']
-        variant = serializer.validated_data.get('variant')
-        quantity = serializer.validated_data['quantity']
-
-        # Check if item already exists in cart
-        existing_item = CartItem.objects.filter(
-            cart=cart,
-            product=product,
-            variant=variant
-        ).first()
-
-        if existing_item:
-            # Update quantity of existing item
-            new_quantity = existing_item.quantity + quantity
-
-            # Validate new quantity against stock
-            if variant:
-                if new_quantity > variant.stock_quantity:
-                    return Response({
-                        'error': f'Cannot add {quantity} more. Only {variant.stock_quantity} items available in stock'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                if new_quantity > product.stock_quantity:
-                    return Response({
-                        'error': f'Cannot add {quantity} more. Only {product.stock_quantity} items available in stock'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-            existing_item.quantity = new_quantity
-            existing_item.save()
-        else:
-            # Create new cart item
-            cart_item = CartItem.objects.create(
-                cart=cart,
-                product=product,
-                variant=variant,
-                quantity=quantity
+        # Cart creation, stock check and insert-or-increment in one write
+        try:
+            cart_item = self.get_store().add_item(
+                self.get_owner(),
+                serializer.validated_data['product_id'],
+                serializer.validated_data.get('variant_id'),
+                serializer.validated_data['quantity']
             )
+        except CartItemError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Refresh cart with all related data and return full cart
-        cart = Cart.objects.prefetch_related(
-            'items__product__images',
-            'items__product__category',
-            'items__product__brand',
-            'items__variant'
-        ).get(id=cart.id)
-
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.cart_response(item_id=cart_item.id)
 
 
-class CartUpdateItemView(APIView):
+class CartUpdateItemView(CartStoreMixin, APIView):
     """
     Update quantity of a specific cart item.
-    Returns the full cart object with all items.
+    Returns the full cart object with all items
+    (or only the changed line with ?mode=delta).
     """
-    permission_classes = [permissions.IsAuthenticated]
 
     def patch(self, request, item_id):
+        store = self.get_store()
         # Get cart item and verify ownership
-        cart_item = get_object_or_404(
-            CartItem,
-            id=item_id,
-            cart__user=request.user
-        )
+        cart_item = store.get_item(self.get_owner(), item_id)
 
         serializer = CartItemUpdateSerializer(
             data=request.data,
@@ -114,85 +132,120 @@ class CartUpdateItemView(APIView):
         )
         serializer.is_valid(raise_exception=True)
 
-        cart_item.quantity = serializer.validated_data['quantity']
-        cart_item.save()
-
-        # Return full cart object
-        cart = Cart.objects.prefetch_related(
-            'items__product__images',
-            'items__product__category',
-            'items__product__brand',
-            'items__variant'
-        ).get(id=cart_item.cart.id)
-
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        store.set_quantity(self.get_owner(), cart_item, serializer.validated_data['quantity'])
+        return self.cart_response(item_id=cart_item.id)
 
 
-class CartRemoveItemView(APIView):
+class CartRemoveItemView(CartStoreMixin, APIView):
     """
     Remove specific item from cart.
-    Returns the full cart object with remaining items.
+    Returns the full cart object with remaining items
+    (or only the removed line id with ?mode=delta).
     """
-    permission_classes = [permissions.IsAuthenticated]
 
     def delete(self, request, item_id):
-        # Get cart item and verify ownership
-        cart_item = get_object_or_404(
-            CartItem,
-            id=item_id,
-            cart__user=request.user
-        )
+        self.get_store().remove_item(self.get_owner(), item_id)
+        return self.cart_response(removed_item_id=item_id)
 
-        cart_id = cart_item.cart.id
-        cart_item.delete()
 
-        # Return full cart object
-        cart = Cart.objects.prefetch_related(
-            'items__product__images',
-            'items__product__category',
-            'items__product__brand',
-            'items__variant'
-        ).get(id=cart_id)
+class CartClearView(CartStoreMixin, APIView):
+    """
+    Clear all items from cart.
+    Returns the empty cart object (or just the totals with ?mode=delta).
+    """
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def delete(self, request):
+        self.get_store().clear(self.get_owner())
+        return self.cart_response(cleared=True)
 
 
-class CartClearView(APIView):
+class CartBatchView(CartStoreMixin, APIView):
     """
-    Clear all items from cart.
-    Returns the empty cart object.
+    Apply many add/update/remove operations in one transaction
+    (restoring a saved cart, syncing an offline cart, re-ordering).
+    Returns the full cart object once, after all changes.
     """
-    permission_classes = [permissions.IsAuthenticated]
 
-    def delete(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart.items.all().delete()
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        # Return empty cart object
-        cart = Cart.objects.prefetch_related(
-            'items__product__images',
-            'items__product__category',
-            'items__product__brand',
-            'items__variant'
-        ).get(id=cart.id)
+        try:
+            operations = serializer.validated_data.get('operations')
+            if not operations:
+                operations = CartService.reorder_operations(
+                    request.user, serializer.validated_data['reorder']
+                )
+            self.get_store().apply_operations(request.user, operations)
+        except CartItemError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except CartBatchError as e:
+            return Response({
+                'error': 'Some operations could not be applied',
+                'errors': e.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.cart_response()
+
+
+class CartRevalidateView(CartStoreMixin, APIView):
+    """
+    Check every cart line against current stock and prices (before checkout).
+    Returns a verdict per line: ok, reduced, out_of_stock or price_changed.
+    """
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get(self, request):
+        lines = self.get_store().revalidate(self.get_owner())
+        data = {
+            'is_valid': not any(line['verdict'] in BLOCKING_VERDICTS for line in lines),
+            'has_price_changes': any(line['price_changed'] for line in lines),
+            'lines': lines,
+        }
+        return Response(CartRevalidationSerializer(data).data)
 
 
-class CartItemDetailView(generics.RetrieveAPIView):
+class CartItemDetailView(CartStoreMixin, generics.RetrieveAPIView):
     """
     Get details of a specific cart item.
     """
     serializer_class = CartItemSerializer
-    permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        return CartItem.objects.filter(
-            cart__user=self.request.user
-        ).select_related('product', 'variant', 'cart')
+    def get_object(self):
+        return self.get_store().get_item(self.get_owner(), self.kwargs['pk'])
+
+
+# Guest carts: same endpoints for anonymous visitors, kept only in Redis
+# and merged into the user's cart on login/registration
+
+class GuestCartView(GuestCartMixin, CartView):
+    """Get guest cart with all items"""
+
+
+class GuestCartAddItemView(GuestCartMixin, CartAddItemView):
+    """Add item to guest cart"""
+
+
+class GuestCartUpdateItemView(GuestCartMixin, CartUpdateItemView):
+    """Update quantity of a guest cart item"""
+
+
+class GuestCartRemoveItemView(GuestCartMixin, CartRemoveItemView):
+    """Remove item from guest cart"""
+
+
+class GuestCartClearView(GuestCartMixin, CartClearView):
+    """Clear guest cart"""
+
+
+class GuestCartItemDetailView(GuestCartMixin, CartItemDetailView):
+    """Get details of a guest cart item"""
+
+
+class GuestCartRevalidateView(GuestCartMixin, CartRevalidateView):
+    """Check guest cart lines against current stock and prices"""
+
     
 class SummaryCartView(generics.RetrieveAPIView):
     """
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     Category, Brand, Product, ProductImage, ProductVariant,
-    Review, Wishlist, ProductTag, ProductTagAssociation
+    Review, Wishlist, ProductTag, ProductTagAssociation, StockMovement
 )
 
 
@@ -70,12 +70,14 @@ class BrandAdmin(admin.ModelAdmin):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'slug', 'category', 'brand', 'base_price', 'discount_price',
-                    'stock_quantity', 'is_active', 'is_featured', 'sales_count', 'created_at']
+                    'current_stock', 'reserved_quantity', 'is_active', 'is_featured',
+                    'sales_count', 'created_at']
     list_filter = ['is_active', 'is_featured', 'is_new', 'category', 'brand', 'created_at']
     search_fields = ['name', 'description', 'sku']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active', 'is_featured', 'base_price', 'discount_price']
-    readonly_fields = ['views_count', 'sales_count', 'created_at', 'updated_at']
+    readonly_fields = ['current_stock', 'reserved_quantity', 'views_count', 'sales_count',
+                       'created_at', 'updated_at']
     inlines = [ProductImageInline, ProductVariantInline, ProductTagAssociationInline]
 
     fieldsets = (
@@ -89,7 +91,10 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('base_price', 'discount_price')
         }),
         ('Inventory', {
-            'fields': ('stock_quantity', 'low_stock_threshold', 'sku', 'weight')
+            'fields': ('stock_quantity', 'current_stock', 'reserved_quantity',
+                       'low_stock_threshold', 'sku', 'weight'),
+            'description': 'Saving a new stock quantity records an adjustment '
+                           'setting current stock to it.'
         }),
         ('Flags', {
             'fields': ('is_active', 'is_featured', 'is_new')
@@ -105,6 +110,19 @@ class ProductAdmin(admin.ModelAdmin):
     )
 
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stock()
+
+    def save_model(self, request, obj, form, change):
+        obj.stock_changed_by = request.user
+        super().save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        for inline_form in formset.forms:
+            inline_form.instance.stock_changed_by = request.user
+        super().save_formset(request, form, formset, change)
+
+
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'alt_text', 'is_primary', 'order', 'created_at']
@@ -116,11 +134,35 @@ class ProductImageAdmin(admin.ModelAdmin):
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
     list_display = ['product', 'name', 'sku', 'price_adjustment', 'stock_quantity',
-                    'is_active', 'created_at']
+                    'current_stock', 'reserved_quantity', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['product__name', 'name', 'sku']
     list_editable = ['is_active', 'stock_quantity', 'price_adjustment']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['current_stock', 'reserved_quantity', 'created_at', 'updated_at']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stock()
+
+    def save_model(self, request, obj, form, change):
+        # Stock edits are recorded as adjustments, not in-place rewrites
+        obj.stock_changed_by = request.user
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'variant', 'quantity', 'reason', 'reference',
+                    'created_by', 'is_compacted', 'created_at']
+    list_filter = ['reason', 'is_compacted', 'created_at']
+    search_fields = ['product__sku', 'variant__sku', 'product__name', 'reference']
+    list_select_related = ['product', 'variant', 'created_by']
+    readonly_fields = ['created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Review)
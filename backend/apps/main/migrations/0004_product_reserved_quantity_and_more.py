@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_alter_productvariant_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Held by unpaid orders (active stock reservations)'),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Held by unpaid orders (active stock reservations)'),
+        ),
+    ]
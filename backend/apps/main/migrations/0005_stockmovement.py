@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-19 09:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Existing stock becomes each row's opening balance in the ledger
+OPENING_BALANCES_SQL = """
+INSERT INTO stock_movements (product_id, variant_id, quantity, reason, reference, is_compacted, created_at)
+SELECT id, NULL, stock_quantity, 'restock', 'Opening balance', TRUE, NOW()
+FROM products WHERE stock_quantity > 0;
+INSERT INTO stock_movements (product_id, variant_id, quantity, reason, reference, is_compacted, created_at)
+SELECT product_id, id, stock_quantity, 'restock', 'Opening balance', TRUE, NOW()
+FROM product_variants WHERE stock_quantity > 0;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_product_reserved_quantity_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(help_text='Signed stock change')),
+                ('reason', models.CharField(choices=[('sale', 'Sale'), ('cancellation', 'Cancellation'), ('restock', 'Restock'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('reference', models.CharField(blank=True, help_text='e.g. order number', max_length=100)),
+                ('is_compacted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='main.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='main.productvariant')),
+            ],
+            options={
+                'verbose_name': 'Stock Movement',
+                'verbose_name_plural': 'Stock Movements',
+                'db_table': 'stock_movements',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['product', 'variant', '-created_at'], name='stock_movem_product_5dd1ee_idx'), models.Index(condition=models.Q(('is_compacted', False)), fields=['product', 'variant'], name='stock_mov_pending_idx')],
+            },
+        ),
+        migrations.RunSQL(OPENING_BALANCES_SQL, migrations.RunSQL.noop),
+    ]
@@ -1,10 +1,118 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.text import slugify
 from django.urls import reverse
 
 
+class StockQuerySet(models.QuerySet):
+    """Products or variants"""
+
+    def with_stock(self):
+        """
+        Annotate stock_delta (movements not yet compacted into the
+        stock_quantity snapshot) so stock reads need no query per row.
+        """
+        if issubclass(self.model, ProductVariant):
+            movements = StockMovement.objects.filter(
+                product=OuterRef('product_id'), variant=OuterRef('pk')
+            ).values('variant')
+        else:
+            movements = StockMovement.objects.filter(
+                product=OuterRef('pk'), variant__isnull=True
+            ).values('product')
+        delta = movements.filter(is_compacted=False).order_by().annotate(
+            total=Sum('quantity')
+        ).values('total')
+        return self.annotate(stock_delta=Coalesce(Subquery(delta), 0))
+
+
+class StockedModel:
+    """
+    Stock bookkeeping shared by Product and ProductVariant.
+
+    stock_quantity is a snapshot: current stock is the snapshot plus the
+    StockMovement rows not compacted into it yet. save() never writes the
+    snapshot nor reserved_quantity (both maintained with set-based UPDATEs,
+    see apps.main.services); a changed stock_quantity is recorded as an
+    adjustment movement bringing current stock to the new value.
+    """
+    COUNTER_FIELDS = ('stock_quantity', 'reserved_quantity')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock = instance.__dict__.get('stock_quantity')
+        return instance
+
+    def stock_key(self):
+        """(product_id, variant_id) identifying this stock row in the ledger"""
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        from .services import InventoryService
+
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            self._loaded_stock = self.stock_quantity
+            if self.stock_quantity:
+                # Already in the snapshot, recorded for the stock history
+                product_id, variant_id = self.stock_key()
+                StockMovement.objects.create(
+                    product_id=product_id, variant_id=variant_id,
+                    quantity=self.stock_quantity, reason='restock',
+                    reference='Initial stock', is_compacted=True
+                )
+            return
+
+        update_fields = kwargs.get('update_fields')
+        loaded_stock = getattr(self, '_loaded_stock', None)
+        stock_changed = (
+            loaded_stock is not None
+            and 'stock_quantity' in self.__dict__
+            and self.stock_quantity != loaded_stock
+            and (update_fields is None or 'stock_quantity' in update_fields)
+        )
+        if update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        kwargs['update_fields'] = [
+            name for name in update_fields if name not in self.COUNTER_FIELDS
+        ]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if stock_changed:
+                product_id, variant_id = self.stock_key()
+                InventoryService.set_stock(
+                    product_id, variant_id, self.stock_quantity,
+                    user=getattr(self, 'stock_changed_by', None)
+                )
+
+        if stock_changed:
+            self.refresh_from_db(fields=['stock_quantity', 'reserved_quantity'])
+            self._loaded_stock = self.stock_quantity
+            self.__dict__.pop('stock_delta', None)
+
+    @property
+    def current_stock(self):
+        """Snapshot plus movements not compacted into it yet"""
+        if 'stock_delta' not in self.__dict__:
+            product_id, variant_id = self.stock_key()
+            self.stock_delta = StockMovement.objects.pending_total(product_id, variant_id)
+        return self.stock_quantity + self.stock_delta
+
+    @property
+    def available_quantity(self):
+        """Current stock not held by unpaid orders"""
+        return max(self.current_stock - self.reserved_quantity, 0)
+
+
 class Category(models.Model):
     """
     Product categories with hierarchical structure (parent-child relationships).
@@ -85,7 +193,7 @@ class Brand(models.Model):
         super().save(*args, **kwargs)
 
 
-class Product(models.Model):
+class Product(StockedModel, models.Model):
     """
     Main product model.
     Each product can have multiple variants (sizes, colors, etc.)
@@ -124,6 +232,11 @@ class Product(models.Model):
 
     # Stock tracking (for simple products without variants)
     stock_quantity = models.PositiveIntegerField(default=0)
+    reserved_quantity = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Held by unpaid orders (active stock reservations)"
+    )
     low_stock_threshold = models.PositiveIntegerField(default=10)
 
     # Product attributes
@@ -155,6 +268,8 @@ class Product(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(null=True, blank=True)
 
+    objects = StockQuerySet.as_manager()
+
     class Meta:
         db_table = 'products'
         verbose_name = 'Product'
@@ -188,6 +303,9 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('product-detail', kwargs={'slug': self.slug})
 
+    def stock_key(self):
+        return self.pk, None
+
     @property
     def price(self):
         """Returns discount price if available, otherwise base price"""
@@ -203,12 +321,12 @@ class Product(models.Model):
     @property
     def is_in_stock(self):
         """Check if product is in stock"""
-        return self.stock_quantity > 0
+        return self.available_quantity > 0
 
     @property
     def is_low_stock(self):
         """Check if stock is low"""
-        return 0 < self.stock_quantity <= self.low_stock_threshold
+        return 0 < self.available_quantity <= self.low_stock_threshold
 
     @property
     def average_rating(self):
@@ -258,7 +376,7 @@ class ProductImage(models.Model):
         super().save(*args, **kwargs)
 
 
-class ProductVariant(models.Model):
+class ProductVariant(StockedModel, models.Model):
     """
     Product variants (e.g., different sizes, colors).
     Example: iPhone 15 Pro - 256GB Black
@@ -282,6 +400,11 @@ class ProductVariant(models.Model):
 
     # Stock
     stock_quantity = models.PositiveIntegerField(default=0)
+    reserved_quantity = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Held by unpaid orders (active stock reservations)"
+    )
 
     # Variant attributes (stored as JSON for flexibility)
     # Example: {"color": "Black", "size": "256GB", "material": "Titanium"}
@@ -292,6 +415,8 @@ class ProductVariant(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StockQuerySet.as_manager()
+
     class Meta:
         db_table = 'product_variants'
         verbose_name = 'Product Variant'
@@ -312,6 +437,9 @@ class ProductVariant(models.Model):
 
         super().save(*args, **kwargs)
 
+    def stock_key(self):
+        return self.product_id, self.pk
+
     @property
     def final_price(self):
         """Returns product price + variant adjustment"""
@@ -320,7 +448,82 @@ class ProductVariant(models.Model):
 
     @property
     def is_in_stock(self):
-        return self.stock_quantity > 0
+        return self.available_quantity > 0
+
+
+class StockMovementQuerySet(models.QuerySet):
+
+    def for_stock(self, product_id, variant_id):
+        """Movements of one stock row: a variant, or a product without variants"""
+        if variant_id is not None:
+            return self.filter(product_id=product_id, variant_id=variant_id)
+        return self.filter(product_id=product_id, variant__isnull=True)
+
+    def pending_total(self, product_id, variant_id):
+        """Sum of a stock row's movements not compacted into its snapshot yet"""
+        return self.for_stock(product_id, variant_id).filter(
+            is_compacted=False
+        ).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+class StockMovement(models.Model):
+    """
+    Append-only inventory ledger: one signed stock change per row.
+    Movements are added to the stock_quantity snapshot on reads until the
+    compaction task folds them in (is_compacted); rows are kept as history.
+    """
+    REASON_CHOICES = [
+        ('sale', 'Sale'),
+        ('cancellation', 'Cancellation'),
+        ('restock', 'Restock'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='stock_movements'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    quantity = models.IntegerField(help_text="Signed stock change")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=100, blank=True, help_text="e.g. order number")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    is_compacted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'stock_movements'
+        verbose_name = 'Stock Movement'
+        verbose_name_plural = 'Stock Movements'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Stock history
+            models.Index(fields=['product', 'variant', '-created_at']),
+            # Uncompacted delta on reads and the compaction scan
+            models.Index(
+                fields=['product', 'variant'],
+                condition=models.Q(is_compacted=False),
+                name='stock_mov_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}/{self.variant_id or '-'} {self.quantity:+d} ({self.reason})"
 
 
 class Review(models.Model):
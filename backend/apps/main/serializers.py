@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from .models import (
     Category, Brand, Product, ProductImage, ProductVariant,
-    Review, Wishlist, ProductTag
+    Review, Wishlist, ProductTag, StockMovement
 )
 from django.contrib.auth import get_user_model
 
@@ -99,11 +99,18 @@ class ProductImageSerializer(serializers.ModelSerializer):
 class ProductVariantSerializer(serializers.ModelSerializer):
     """For product variants (sizes, colors, etc.)"""
     is_in_stock = serializers.BooleanField(read_only=True)
+    available_quantity = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = ProductVariant
         fields = ['id', 'name', 'sku', 'price', 'attributes', 'stock_quantity',
-                  'is_in_stock', 'is_active', 'image']
+                  'available_quantity', 'is_in_stock', 'is_active', 'image']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Current stock, not the compacted snapshot
+        data['stock_quantity'] = instance.current_stock
+        return data
 
 
 class ProductTagSerializer(serializers.ModelSerializer):
@@ -165,6 +172,8 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     average_rating = serializers.FloatField(read_only=True)
     reviews_count = serializers.IntegerField(read_only=True)
     is_in_stock = serializers.BooleanField(read_only=True)
+    stock_quantity = serializers.IntegerField(source='current_stock', read_only=True)
+    available_quantity = serializers.IntegerField(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
@@ -174,8 +183,8 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'slug', 'description', 'short_description',
                   'category', 'brand', 'base_price', 'discount_price', 'price',
-                  'discount_percentage', 'stock_quantity', 'low_stock_threshold',
-                  'is_in_stock', 'sku', 'weight', 'is_active', 'is_featured',
+                  'discount_percentage', 'stock_quantity', 'available_quantity',
+                  'low_stock_threshold', 'is_in_stock', 'sku', 'weight', 'is_active', 'is_featured',
                   'is_new', 'average_rating', 'reviews_count', 'views_count',
                   'sales_count', 'meta_title', 'meta_description', 'meta_keywords',
                   'published_at', 'created_at', 'updated_at', 'images', 'variants',
@@ -234,3 +243,13 @@ class WishlistSerializer(serializers.ModelSerializer):
         # Automatically set the user from request context
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    """For stock history (inventory ledger entries)"""
+    created_by = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'product', 'variant', 'quantity', 'reason', 'reference',
+                  'created_by', 'is_compacted', 'created_at']
@@ -0,0 +1,263 @@
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from .models import Product, ProductVariant, StockMovement
+
+StockLine = Tuple[int, Optional[int], int]  # (product_id, variant_id, quantity)
+
+
+# Movements not compacted into a row's stock_quantity snapshot yet
+PENDING_STOCK_SQL = {
+    'products': (
+        "SELECT COALESCE(SUM(m.quantity), 0) FROM stock_movements m "
+        "WHERE m.product_id = {alias}.id AND m.variant_id IS NULL AND NOT m.is_compacted"
+    ),
+    'product_variants': (
+        "SELECT COALESCE(SUM(m.quantity), 0) FROM stock_movements m "
+        "WHERE m.product_id = {alias}.product_id AND m.variant_id = {alias}.id "
+        "AND NOT m.is_compacted"
+    ),
+}
+
+
+def available_stock_sql(table: str, alias: str) -> str:
+    """
+    SQL expression for a row's available stock: the stock_quantity snapshot
+    plus uncompacted movements, minus stock held for unpaid orders.
+    """
+    pending = PENDING_STOCK_SQL[table].format(alias=alias)
+    return f"({alias}.stock_quantity + ({pending}) - {alias}.reserved_quantity)"
+
+
+# Guarded writers lock their rows first (variants, then products, by id) so
+# the availability check that follows reads every committed movement
+LOCK_ROWS_SQL = "SELECT id FROM {table} WHERE id = ANY(%s) ORDER BY id FOR UPDATE"
+
+UPDATE_RESERVED_SQL = """
+UPDATE {table} AS t
+SET reserved_quantity = {reserved}
+FROM (VALUES {values}) AS v(id, quantity)
+WHERE t.id = v.id{guard}
+RETURNING t.id
+"""
+
+RESERVE = "t.reserved_quantity + v.quantity"
+RELEASE = "GREATEST(t.reserved_quantity - v.quantity, 0)"
+
+# Compaction: fold a chunk of movements into the snapshots (and sales counts)
+SELECT_PENDING_MOVEMENTS_SQL = """
+SELECT id, product_id, variant_id, quantity, reason
+FROM stock_movements
+WHERE NOT is_compacted
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+ADD_VARIANT_STOCK_SQL = """
+UPDATE product_variants AS t
+SET stock_quantity = GREATEST(t.stock_quantity + v.quantity, 0)
+FROM (VALUES {values}) AS v(id, quantity)
+WHERE t.id = v.id
+RETURNING t.id
+"""
+
+ADD_PRODUCT_STOCK_SQL = """
+UPDATE products AS t
+SET stock_quantity = GREATEST(t.stock_quantity + v.quantity, 0),
+    sales_count = GREATEST(t.sales_count + v.sold, 0)
+FROM (VALUES {values}) AS v(id, quantity, sold)
+WHERE t.id = v.id
+RETURNING t.id
+"""
+
+MARK_COMPACTED_SQL = "UPDATE stock_movements SET is_compacted = TRUE WHERE id = ANY(%s)"
+
+# Movement reasons counted in the product's sales_count (sold = -quantity)
+SALES_REASONS = ('sale', 'cancellation')
+
+
+class InsufficientStockError(Exception):
+    """One or more lines are short on stock; nothing was changed"""
+
+    def __init__(self, shortages):
+        super().__init__('Insufficient stock')
+        self.shortages = shortages
+
+
+def _group(lines: Iterable[StockLine]):
+    """
+    Per-row quantities, sorted by id so concurrent updates lock rows
+    in the same order: [(variant_id, qty)], [(product_id, qty)]
+    (products only for lines without a variant)
+    """
+    variants = defaultdict(int)
+    products = defaultdict(int)
+    for product_id, variant_id, quantity in lines:
+        if variant_id is not None:
+            variants[variant_id] += quantity
+        else:
+            products[product_id] += quantity
+    return sorted(variants.items()), sorted(products.items())
+
+
+def _execute(sql, rows, types) -> List[int]:
+    """Run an UPDATE ... FROM (VALUES ...) over rows, returning updated ids"""
+    if not rows:
+        return []
+    row_sql = '(' + ', '.join(f'%s::{type_}' for type_ in types) + ')'
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(sql.replace('{values}', ', '.join([row_sql] * len(rows))), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class InventoryService:
+    """
+    Stock ledger and reservation counters for order lines.
+
+    Stock changes are appended to StockMovement (one batched INSERT) instead
+    of rewriting stock_quantity; compact() periodically folds them into the
+    stock_quantity snapshot and the sales counts. Available stock is
+    snapshot + uncompacted movements - reserved_quantity. Guarded operations
+    check it under the row lock, so concurrent orders can't oversell, and
+    raise InsufficientStockError (rolling back every change) when a line is
+    short. Reserving and committing still lock and update the product or
+    variant row (its reserved_quantity counter), so concurrent orders for
+    one SKU still serialize on that row.
+    """
+
+    @staticmethod
+    def _update_reserved(lines, reserved, guarded) -> None:
+        lines = list(lines)
+        variants, products = _group(lines)
+        tables = (('product_variants', variants), ('products', products))
+
+        with transaction.atomic():
+            updated = {}
+            with connection.cursor() as cursor:
+                for table, rows in tables:
+                    if guarded and rows:
+                        cursor.execute(LOCK_ROWS_SQL.format(table=table), [[row[0] for row in rows]])
+            for table, rows in tables:
+                guard = f" AND {available_stock_sql(table, 't')} >= v.quantity" if guarded else ""
+                updated[table] = set(_execute(
+                    UPDATE_RESERVED_SQL.format(table=table, reserved=reserved, guard=guard, values='{values}'),
+                    rows, ('bigint', 'integer')
+                ))
+
+            shortages = [
+                (product_id, variant_id)
+                for product_id, variant_id, quantity in lines
+                if (variant_id is not None and variant_id not in updated['product_variants'])
+                or (variant_id is None and product_id not in updated['products'])
+            ] if guarded else []
+            if shortages:
+                transaction.set_rollback(True)
+
+        if shortages:
+            raise InsufficientStockError(shortages)
+
+    @staticmethod
+    def record_movements(lines: Iterable[StockLine], reason: str, reference: str = '', user=None) -> None:
+        """Append signed stock movements for lines in one INSERT"""
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=product_id, variant_id=variant_id, quantity=quantity,
+                reason=reason, reference=reference, created_by=user
+            )
+            for product_id, variant_id, quantity in lines if quantity
+        ])
+
+    @staticmethod
+    def reserve_stock(lines: Iterable[StockLine]) -> None:
+        """Hold available stock for lines (raises InsufficientStockError)"""
+        InventoryService._update_reserved(lines, RESERVE, guarded=True)
+
+    @staticmethod
+    def release_reserved(lines: Iterable[StockLine]) -> None:
+        """Drop holds for lines"""
+        InventoryService._update_reserved(lines, RELEASE, guarded=False)
+
+    @staticmethod
+    def commit_reserved(lines: Iterable[StockLine], reference: str = '') -> None:
+        """Take held stock for good (sale movements)"""
+        lines = list(lines)
+        with transaction.atomic():
+            InventoryService.release_reserved(lines)
+            InventoryService.record_movements(
+                [(product_id, variant_id, -quantity) for product_id, variant_id, quantity in lines],
+                'sale', reference
+            )
+
+    @staticmethod
+    def decrement_stock(lines: Iterable[StockLine], reference: str = '') -> None:
+        """Take available stock without a prior hold (raises InsufficientStockError)"""
+        lines = list(lines)
+        with transaction.atomic():
+            InventoryService.reserve_stock(lines)
+            InventoryService.commit_reserved(lines, reference)
+
+    @staticmethod
+    def restore_stock(lines: Iterable[StockLine], reference: str = '') -> None:
+        """Give stock back for lines (cancellation movements)"""
+        InventoryService.record_movements(lines, 'cancellation', reference)
+
+    @staticmethod
+    def set_stock(product_id: int, variant_id: Optional[int], quantity: int,
+                  reason: str = 'adjustment', reference: str = '', user=None) -> int:
+        """
+        Record the movement bringing a row's current stock to quantity
+        (admin edits, stock takes). Returns the recorded change.
+        """
+        model, pk = (ProductVariant, variant_id) if variant_id is not None else (Product, product_id)
+        with transaction.atomic():
+            snapshot = model.objects.select_for_update().filter(pk=pk).values_list(
+                'stock_quantity', flat=True
+            ).first()
+            if snapshot is None:
+                return 0
+            current = snapshot + StockMovement.objects.pending_total(product_id, variant_id)
+            change = quantity - current
+            InventoryService.record_movements([(product_id, variant_id, change)], reason, reference, user)
+        return change
+
+    @staticmethod
+    def compact(batch_size: int) -> int:
+        """
+        Fold one chunk of movements into the stock_quantity snapshots and
+        sales counts, marking them compacted, in one transaction.
+        Movements locked by a concurrent compaction are skipped.
+        Returns the number of movements compacted.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(SELECT_PENDING_MOVEMENTS_SQL, [batch_size])
+                movements = cursor.fetchall()
+            if not movements:
+                return 0
+
+            variants = defaultdict(int)
+            products = defaultdict(lambda: [0, 0])
+            for _, product_id, variant_id, quantity, reason in movements:
+                if variant_id is not None:
+                    variants[variant_id] += quantity
+                else:
+                    products[product_id][0] += quantity
+                if reason in SALES_REASONS:
+                    products[product_id][1] -= quantity
+
+            with connection.cursor() as cursor:
+                for table, ids in (('product_variants', sorted(variants)), ('products', sorted(products))):
+                    if ids:
+                        cursor.execute(LOCK_ROWS_SQL.format(table=table), [ids])
+            _execute(ADD_VARIANT_STOCK_SQL, sorted(variants.items()), ('bigint', 'integer'))
+            _execute(
+                ADD_PRODUCT_STOCK_SQL,
+                [(product_id, quantity, sold) for product_id, (quantity, sold) in sorted(products.items())],
+                ('bigint', 'integer', 'integer')
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(MARK_COMPACTED_SQL, [[movement[0] for movement in movements]])
+        return len(movements)
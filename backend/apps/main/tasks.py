@@ -0,0 +1,18 @@
+from celery import shared_task
+from django.conf import settings
+
+from .services import InventoryService
+
+
+@shared_task
+def compact_stock_movements(batch_size=None):
+    """Folding stock movements into the stock_quantity snapshots"""
+    batch_size = batch_size or settings.STOCK_COMPACTION_BATCH_SIZE
+    compacted = 0
+    while True:
+        count = InventoryService.compact(batch_size)
+        compacted += count
+        if count < batch_size:
+            break
+
+    return {'compacted_movements': compacted}
@@ -34,6 +34,9 @@ urlpatterns = [
     path('product-variants/<int:pk>/update/', views.ProductVariantUpdateView.as_view(), name='product-variant-update'),
     path('product-variants/<int:pk>/delete/', views.ProductVariantDeleteView.as_view(), name='product-variant-delete'),
 
+    # Stock history (inventory ledger) by product or variant SKU
+    path('stock/<str:sku>/history/', views.StockHistoryView.as_view(), name='stock-history'),
+
     # Review URLs
     path('products/<slug:product_slug>/reviews/', views.ProductReviewListView.as_view(), name='product-reviews'),
     path('products/<slug:product_slug>/reviews/create/', views.ReviewCreateView.as_view(), name='review-create'),
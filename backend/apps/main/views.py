@@ -2,18 +2,18 @@ from rest_framework import generics, permissions, status, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, Q, Avg
+from django.db.models import Count, Q, Avg, F, Prefetch
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from .models import (
     Category, Brand, Product, ProductImage, ProductVariant,
-    Review, Wishlist, ProductTag
+    Review, Wishlist, ProductTag, StockMovement
 )
 from .serializers import (
     CategoryListSerializer, CategoryDetailSerializer, CategoryCreateUpdateSerializer,
     BrandSerializer, ProductListSerializer, ProductDetailSerializer,
     ProductCreateUpdateSerializer, ProductImageSerializer, ProductVariantSerializer,
-    ReviewSerializer, WishlistSerializer, ProductTagSerializer
+    ReviewSerializer, WishlistSerializer, ProductTagSerializer, StockMovementSerializer
 )
 
 
@@ -177,7 +177,7 @@ class ProductListView(generics.ListAPIView):
     def get_queryset(self):
         queryset = Product.objects.filter(is_active=True).select_related(
             'category', 'brand'
-        ).prefetch_related('images')
+        ).prefetch_related('images').with_stock()
 
         # Filter by category (includes all subcategories recursively)
         category_slug = self.request.query_params.get('category__slug', None)
@@ -209,7 +209,7 @@ class ProductListView(generics.ListAPIView):
         # Filter by stock availability
         in_stock = self.request.query_params.get('in_stock', None)
         if in_stock == 'true':
-            queryset = queryset.filter(stock_quantity__gt=0)
+            queryset = queryset.filter(stock_quantity__gt=F('reserved_quantity') - F('stock_delta'))
 
         return queryset
 
@@ -233,8 +233,9 @@ class ProductDetailView(generics.RetrieveAPIView):
         return Product.objects.filter(is_active=True).select_related(
             'category', 'brand'
         ).prefetch_related(
-            'images', 'variants', 'reviews__user', 'product_tags'
-        )
+            'images', Prefetch('variants', queryset=ProductVariant.objects.with_stock()),
+            'reviews__user', 'product_tags'
+        ).with_stock()
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -265,7 +266,7 @@ class ProductRelatedView(generics.ListAPIView):
                 'category', 'brand'
             ).prefetch_related(
                 'images'
-            )[:4]  # Limit to 4 related products
+            ).with_stock()[:4]  # Limit to 4 related products
         except Product.DoesNotExist:
             return Product.objects.none()
 
@@ -294,6 +295,11 @@ class ProductUpdateView(generics.UpdateAPIView):
     queryset = Product.objects.all()
     lookup_field = 'slug'
 
+    def perform_update(self, serializer):
+        # A changed stock_quantity is recorded as an adjustment by this user
+        serializer.instance.stock_changed_by = self.request.user
+        serializer.save()
+
     def update(self, request, *args, **kwargs):
         super().update(request, *args, **kwargs)
         return Response({
@@ -351,6 +357,11 @@ class ProductVariantUpdateView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAdminUser]
     queryset = ProductVariant.objects.all()
 
+    def perform_update(self, serializer):
+        # A changed stock_quantity is recorded as an adjustment by this user
+        serializer.instance.stock_changed_by = self.request.user
+        serializer.save()
+
 
 class ProductVariantDeleteView(generics.DestroyAPIView):
     """Delete product variant (admin only)"""
@@ -358,6 +369,24 @@ class ProductVariantDeleteView(generics.DestroyAPIView):
     queryset = ProductVariant.objects.all()
 
 
+class StockHistoryView(generics.ListAPIView):
+    """Stock movements of a product or variant SKU, newest first (admin only)"""
+    serializer_class = StockMovementSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_queryset(self):
+        sku = self.kwargs.get('sku')
+        variant = ProductVariant.objects.filter(sku=sku).only('id', 'product_id').first()
+        if variant is not None:
+            movements = StockMovement.objects.for_stock(variant.product_id, variant.id)
+        else:
+            product = Product.objects.filter(sku=sku).only('id').first()
+            if product is None:
+                return StockMovement.objects.none()
+            movements = StockMovement.objects.for_stock(product.id, None)
+        return movements.select_related('created_by')
+
+
 # ==================== Review Views ====================
 
 class ProductReviewListView(generics.ListAPIView):
@@ -430,9 +459,12 @@ class WishlistListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user).select_related(
-            'product__category', 'product__brand'
-        ).prefetch_related('product__images').order_by('-created_at')
+        return Wishlist.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('product', queryset=Product.objects.select_related(
+                'category', 'brand'
+            ).with_stock()),
+            'product__images'
+        ).order_by('-created_at')
 
 
 class WishlistAddView(generics.CreateAPIView):
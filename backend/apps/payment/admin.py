@@ -1,8 +1,19 @@
+import json
+
 from django.contrib import admin
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.html import format_html
+from django.utils import timezone
 from .models import (
     ShippingAddress, Order, OrderItem, Payment,
-    Coupon, CouponUsage, OrderStatusHistory
+    Coupon, CouponUsage, StripeCoupon, OrderStatusHistory, StockReservation, OrderEvent,
+    WebhookEvent, ArchivedOrder, SalesRollup, ShippingRate, TaxRate
 )
+from .services import OrderSnapshotService
+from .events import emit_status_event
+from .exports import csv_lines, order_records
+from . import rates
 
 
 @admin.register(ShippingAddress)
@@ -54,6 +65,7 @@ class OrderAdmin(admin.ModelAdmin):
                        'shipped_at', 'delivered_at']
     inlines = [OrderItemInline, OrderStatusHistoryInline]
     date_hierarchy = 'created_at'
+    actions = ['export_csv']
 
     fieldsets = (
         ('Order Information', {
@@ -80,6 +92,7 @@ class OrderAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         """Track status changes"""
+        super().save_model(request, obj, form, change)
         if change and 'status' in form.changed_data:
             OrderStatusHistory.objects.create(
                 order=obj,
@@ -87,7 +100,18 @@ class OrderAdmin(admin.ModelAdmin):
                 notes=f'Status updated by admin',
                 changed_by=request.user
             )
-        super().save_model(request, obj, form, change)
+            emit_status_event(obj, reason='Status updated by admin')
+
+    def save_related(self, request, form, formsets, change):
+        """Re-render a paid order's snapshot after the order and its items are saved"""
+        super().save_related(request, form, formsets, change)
+        OrderSnapshotService.refresh(form.instance)
+
+    @admin.action(description='Export selected orders (CSV)')
+    def export_csv(self, request, queryset):
+        response = StreamingHttpResponse(csv_lines(order_records(queryset)), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="orders.csv"'
+        return response
 
 
 @admin.register(OrderItem)
@@ -168,6 +192,19 @@ class CouponUsageAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(StripeCoupon)
+class StripeCouponAdmin(admin.ModelAdmin):
+    list_display = ['coupon', 'amount_off', 'stripe_coupon_id', 'created_at']
+    search_fields = ['coupon__code', 'stripe_coupon_id']
+    readonly_fields = ['created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(OrderStatusHistory)
 class OrderStatusHistoryAdmin(admin.ModelAdmin):
     list_display = ['order', 'status', 'changed_by', 'created_at']
@@ -180,3 +217,117 @@ class OrderStatusHistoryAdmin(admin.ModelAdmin):
 
     def has_change_permission(self, request, obj=None):
         return False
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'product', 'variant', 'quantity', 'status', 'expires_at', 'created_at']
+    list_filter = ['status', 'expires_at']
+    search_fields = ['order__order_number', 'product__name']
+    readonly_fields = ['created_at', 'updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'event_type', 'status', 'attempts', 'available_at', 'created_at', 'processed_at']
+    list_filter = ['event_type', 'status', 'created_at']
+    search_fields = ['order__order_number']
+    readonly_fields = ['created_at', 'processed_at']
+    actions = ['retry_events']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Retry selected failed events')
+    def retry_events(self, request, queryset):
+        updated = queryset.filter(status='failed').update(
+            status='pending', attempts=0, available_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} event(s) queued for retry')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'event_type', 'status', 'attempts', 'next_attempt_at', 'ordering_key', 'occurred_at']
+    list_filter = ['status', 'event_type', 'occurred_at']
+    search_fields = ['event_id', 'ordering_key']
+    readonly_fields = ['created_at', 'processed_at']
+    actions = ['retry_events']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description='Retry selected failed or dead-letter events')
+    def retry_events(self, request, queryset):
+        updated = queryset.filter(status__in=['failed', 'dead']).update(
+            status='failed', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} event(s) queued for retry')
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_number', 'user', 'status', 'total', 'item_count', 'created_at', 'archived_at']
+    list_filter = ['status', 'created_at', 'archived_at']
+    search_fields = ['order_number', 'user__username', 'user__email']
+    exclude = ['document']
+    readonly_fields = ['order_document']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Document')
+    def order_document(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.data, indent=2))
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'product', 'category', 'brand', 'revenue', 'units', 'orders']
+    list_filter = ['category', 'brand']
+    list_select_related = ['product', 'category', 'brand']
+    search_fields = ['product__name', 'product__sku']
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class RateAdmin(admin.ModelAdmin):
+    list_filter = ['is_active', 'country', 'state']
+    search_fields = ['name', 'country', 'state', 'postal_prefix']
+    list_editable = ['is_active']
+
+    def delete_queryset(self, request, queryset):
+        """Bulk delete skips Model.delete(): rebuild the rate index here"""
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(rates.invalidate)
+
+
+@admin.register(ShippingRate)
+class ShippingRateAdmin(RateAdmin):
+    list_display = ['name', 'country', 'state', 'postal_prefix', 'min_weight', 'max_weight',
+                    'base_cost', 'cost_per_kg', 'is_active']
+
+
+@admin.register(TaxRate)
+class TaxRateAdmin(RateAdmin):
+    list_display = ['name', 'country', 'state', 'postal_prefix', 'rate', 'includes_shipping', 'is_active']
@@ -0,0 +1,203 @@
+"""
+Order domain events.
+
+emit() records an OrderEvent (transactional outbox) in the caller's
+transaction and, once it commits, asks Celery to dispatch pending events.
+dispatch() runs them in batches through the handlers registered with
+@handles(...); failed events are retried with exponential backoff and
+marked failed after settings.ORDER_EVENT_MAX_ATTEMPTS. The
+process_order_events beat task also sweeps up events whose post-commit
+kick was lost (broker down, worker restart).
+
+Events are delivered at least once, so handlers must be idempotent.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Coupon, CouponUsage, OrderEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order.created'
+ORDER_PAID = 'order.paid'
+ORDER_CANCELLED = 'order.cancelled'
+ORDER_SHIPPED = 'order.shipped'
+ORDER_REFUNDED = 'order.refunded'
+
+# Order statuses whose transitions are domain events
+STATUS_EVENTS = {
+    'paid': ORDER_PAID,
+    'cancelled': ORDER_CANCELLED,
+    'shipped': ORDER_SHIPPED,
+    'refunded': ORDER_REFUNDED,
+}
+
+HANDLERS = defaultdict(list)
+
+
+def handles(*event_types):
+    """Register the decorated function as a handler: handler(event)"""
+    def decorator(handler):
+        for event_type in event_types:
+            HANDLERS[event_type].append(handler)
+        return handler
+    return decorator
+
+
+def emit(order, event_type, **payload):
+    """Record an event for order; handlers run after the transaction commits"""
+    event = OrderEvent.objects.create(order=order, event_type=event_type, payload=payload)
+    transaction.on_commit(_queue_dispatch)
+    return event
+
+
+def emit_many(order_ids, event_type, **payload) -> None:
+    """Record the same event for many orders in one INSERT (batch jobs)"""
+    OrderEvent.objects.bulk_create([
+        OrderEvent(order_id=order_id, event_type=event_type, payload=payload)
+        for order_id in order_ids
+    ])
+    if order_ids:
+        transaction.on_commit(_queue_dispatch)
+
+
+def emit_status_event(order, **payload):
+    """Record the event for the order's new status, if it is one"""
+    event_type = STATUS_EVENTS.get(order.status)
+    if event_type:
+        return emit(order, event_type, **payload)
+    return None
+
+
+def _queue_dispatch():
+    """Ask a worker to dispatch now; the periodic sweep is the fallback"""
+    from .tasks import process_order_events
+    try:
+        with process_order_events.app.connection_for_write() as connection:
+            # Fail fast when the broker is down instead of stalling the response
+            connection.ensure_connection(max_retries=0)
+            process_order_events.apply_async(connection=connection, retry=False, ignore_result=True)
+    except Exception as e:
+        # The event is safe in the outbox; the periodic sweep picks it up
+        logger.warning(f"Could not queue order event dispatch: {e}")
+
+
+def dispatch(batch_size: int) -> int:
+    """
+    Run handlers for one batch of due events in one transaction.
+    Events locked by a concurrent dispatcher are skipped.
+    Returns the number of events picked up.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OrderEvent.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('order__user')
+            .filter(status='pending', available_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                # Savepoint: a failing handler only rolls back its own event
+                with transaction.atomic():
+                    for handler in HANDLERS[event.event_type]:
+                        handler(event)
+            except Exception as e:
+                event.error_message = str(e)
+                if event.attempts >= settings.ORDER_EVENT_MAX_ATTEMPTS:
+                    event.status = 'failed'
+                    logger.error(f"Order event {event.id} ({event.event_type}) failed for good: {e}")
+                else:
+                    delay = settings.ORDER_EVENT_RETRY_DELAY * 2 ** (event.attempts - 1)
+                    event.available_at = now + timedelta(seconds=delay)
+                    logger.warning(f"Order event {event.id} ({event.event_type}) failed, retrying in {delay}s: {e}")
+            else:
+                event.status = 'processed'
+                event.processed_at = timezone.now()
+                event.error_message = ''
+
+        OrderEvent.objects.bulk_update(
+            events, ['status', 'attempts', 'available_at', 'error_message', 'processed_at']
+        )
+    return len(events)
+
+
+# ==================== Handlers ====================
+
+@handles(ORDER_PAID)
+def record_coupon_usage(event):
+    """Count the coupon applied at payment (once per order)"""
+    order = event.order
+    if not order.coupon_id:
+        return
+
+    usage, created = CouponUsage.objects.get_or_create(
+        order=order,
+        coupon_id=order.coupon_id,
+        defaults={'user_id': order.user_id, 'discount_amount': order.coupon_discount}
+    )
+    if created:
+        Coupon.objects.filter(pk=order.coupon_id).update(used_count=F('used_count') + 1)
+
+
+@handles(ORDER_PAID)
+def add_to_sales_rollup(event):
+    from .services import SalesRollupService
+    SalesRollupService.record(event.order, 1)
+
+
+@handles(ORDER_CANCELLED, ORDER_REFUNDED)
+def remove_from_sales_rollup(event):
+    """No-op for orders that were never counted (e.g. unpaid cancellations)"""
+    from .services import SalesRollupService
+    SalesRollupService.record(event.order, -1)
+
+
+def _notify_customer(order, subject, message):
+    if order.user.email:
+        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [order.user.email])
+
+
+@handles(ORDER_PAID)
+def send_order_confirmation(event):
+    order = event.order
+    _notify_customer(
+        order,
+        f"Order {order.order_number} confirmed",
+        f"Thank you for your order!\n\n"
+        f"We received your payment of ${order.total} for {order.title}.\n"
+        f"We'll let you know when it ships."
+    )
+
+
+@handles(ORDER_SHIPPED)
+def send_shipping_notice(event):
+    order = event.order
+    tracking = f"\nTracking number: {order.tracking_number}" if order.tracking_number else ""
+    _notify_customer(
+        order,
+        f"Order {order.order_number} has shipped",
+        f"Your order {order.order_number} ({order.title}) is on its way.{tracking}"
+    )
+
+
+@handles(ORDER_CANCELLED)
+def send_cancellation_notice(event):
+    """Only paid orders: unpaid ones were cancelled by the customer or never paid"""
+    order = event.order
+    if not order.is_paid:
+        return
+    _notify_customer(
+        order,
+        f"Order {order.order_number} cancelled",
+        f"Your order {order.order_number} ({order.title}) has been cancelled.\n"
+        f"Your payment of ${order.total} will be refunded."
+    )
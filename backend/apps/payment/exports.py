@@ -0,0 +1,129 @@
+"""
+Streaming order exports for finance (CSV and JSON Lines).
+
+Orders are read through a server-side cursor (iterator(chunk_size)) with
+the user and shipping address joined and items/payments prefetched one
+chunk at a time, followed by the archived orders matching the same
+filters, so memory stays flat however many months are exported. Wrap
+csv_lines()/jsonl_lines() in a StreamingHttpResponse.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order
+
+ORDER_FIELDS = [
+    'order_number', 'status', 'payment_method', 'subtotal', 'discount_amount',
+    'tax_amount', 'shipping_cost', 'total', 'coupon_code', 'created_at', 'paid_at',
+]
+SHIPPING_FIELDS = ['full_name', 'city', 'state', 'postal_code', 'country']
+ITEM_FIELDS = [
+    'sku', 'product_name', 'variant_name', 'quantity',
+    'unit_price', 'discount_amount', 'total_price',
+]
+PAYMENT_FIELDS = ['payment_id', 'status', 'amount', 'currency', 'transaction_id', 'created_at']
+
+# One CSV row per order item, with the order columns repeated
+CSV_HEADER = (
+    ORDER_FIELDS + ['archived', 'user_id', 'user_email']
+    + [f'shipping_{field}' for field in SHIPPING_FIELDS]
+    + [f'item_{field}' for field in ITEM_FIELDS]
+    + ['paid_amount', 'payment_ids']
+)
+
+
+def export_filters(date_from, date_to, status=None) -> dict:
+    """Lookups for orders created on date_from..date_to (local days), optionally in one status"""
+    tz = timezone.get_current_timezone()
+    filters = {
+        'created_at__gte': datetime.combine(date_from, time.min, tzinfo=tz),
+        'created_at__lt': datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=tz),
+    }
+    if status:
+        filters['status'] = status
+    return filters
+
+
+def export_records(filters: dict, chunk_size: int = None):
+    """Export records of the orders, then the archived orders, matching filters"""
+    yield from order_records(Order.objects.filter(**filters), chunk_size)
+    yield from archived_order_records(ArchivedOrder.objects.filter(**filters), chunk_size)
+
+
+def order_records(queryset, chunk_size: int = None):
+    queryset = queryset.select_related('user', 'shipping_address').prefetch_related(
+        'items', 'payments'
+    ).order_by('id')
+    for order in queryset.iterator(chunk_size=chunk_size or settings.ORDER_EXPORT_CHUNK_SIZE):
+        record = {field: getattr(order, field) for field in ORDER_FIELDS}
+        record.update({
+            'archived': False,
+            'user_id': order.user_id,
+            'user_email': order.user.email,
+            'shipping': {field: getattr(order.shipping_address, field) for field in SHIPPING_FIELDS},
+            'items': [
+                {field: getattr(item, field) for field in ITEM_FIELDS}
+                for item in order.items.all()
+            ],
+            'payments': [
+                {field: getattr(payment, field) for field in PAYMENT_FIELDS}
+                for payment in order.payments.all()
+            ],
+        })
+        yield record
+
+
+def archived_order_records(queryset, chunk_size: int = None):
+    queryset = queryset.select_related('user').order_by('id')
+    for archived in queryset.iterator(chunk_size=chunk_size or settings.ORDER_EXPORT_CHUNK_SIZE):
+        data = archived.data
+        order = data['order']
+        record = {field: order[field] for field in ORDER_FIELDS}
+        record.update({
+            'archived': True,
+            'user_id': archived.user_id,
+            'user_email': archived.user.email,
+            'shipping': {field: order['shipping_address'][field] for field in SHIPPING_FIELDS},
+            'items': [{field: item[field] for field in ITEM_FIELDS} for item in order['items']],
+            'payments': [
+                {field: payment[field] for field in PAYMENT_FIELDS}
+                for payment in data['payments']
+            ],
+        })
+        yield record
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for record in records:
+        order = [record[field] for field in ORDER_FIELDS] + [
+            record['archived'], record['user_id'], record['user_email']
+        ] + [record['shipping'][field] for field in SHIPPING_FIELDS]
+        paid_amount = sum(
+            (Decimal(str(payment['amount'])) for payment in record['payments']
+             if payment['status'] == 'completed'),
+            Decimal('0')
+        )
+        totals = [paid_amount, ' '.join(payment['payment_id'] for payment in record['payments'])]
+        # Orders without items still get one row
+        for item in record['items'] or [dict.fromkeys(ITEM_FIELDS, '')]:
+            yield writer.writerow(order + [item[field] for field in ITEM_FIELDS] + totals)
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,109 @@
+"""
+Idempotency-Key support for non-idempotent POST endpoints
+(order creation, payment session creation).
+
+The first response for a key (per user and endpoint) is stored in Redis for
+settings.IDEMPOTENCY_KEY_TTL; retries with the same key get it back without
+running the view again. A lock short-circuits concurrent duplicates while
+the first request is still running.
+"""
+import functools
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from redis.exceptions import LockError
+from rest_framework import status
+from rest_framework.response import Response
+
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENT_REPLAY_HEADER = 'Idempotent-Replayed'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+RESPONSE_KEY = 'idempotency:{scope}:{user_id}:{key}'
+LOCK_KEY = 'idempotency:{scope}:{user_id}:{key}:lock'
+
+
+def request_fingerprint(request, args, kwargs) -> str:
+    """Hash of what the request asks for, to catch a key reused for another request"""
+    payload = json.dumps(
+        [request.method, request.path, kwargs, request.data],
+        sort_keys=True, cls=DjangoJSONEncoder
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def idempotent(scope):
+    """
+    Decorator for a view handler honouring the Idempotency-Key header.
+    Requests without the header run normally. Only responses below 500
+    are stored, so server errors can be retried with the same key.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if not key:
+                return handler(self, request, *args, **kwargs)
+            if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return Response({
+                    'error': f'{IDEMPOTENCY_KEY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            redis = get_redis()
+            names = {'scope': scope, 'user_id': request.user.id, 'key': key}
+            response_key = RESPONSE_KEY.format(**names)
+            fingerprint = request_fingerprint(request, args, kwargs)
+
+            stored = _replay(redis.get(response_key), fingerprint)
+            if stored is not None:
+                return stored
+
+            lock = redis.lock(LOCK_KEY.format(**names), timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+            if not lock.acquire(blocking=False):
+                return Response({
+                    'error': 'A request with this Idempotency-Key is already in progress'
+                }, status=status.HTTP_409_CONFLICT)
+
+            try:
+                # The first request may have finished between the read and the lock
+                stored = _replay(redis.get(response_key), fingerprint)
+                if stored is not None:
+                    return stored
+
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    redis.set(response_key, json.dumps({
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                    }, cls=DjangoJSONEncoder), ex=settings.IDEMPOTENCY_KEY_TTL)
+                return response
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    # Lock expired while the handler ran; another request may hold it now
+                    logger.warning(f"Idempotency lock for {response_key} expired before release")
+        return wrapper
+    return decorator
+
+
+def _replay(raw, fingerprint):
+    """Stored response for a retry, a 422 if the key was used for another request, else None"""
+    if raw is None:
+        return None
+    stored = json.loads(raw)
+    if stored['fingerprint'] != fingerprint:
+        return Response({
+            'error': f'{IDEMPOTENCY_KEY_HEADER} was already used for a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'])
+    response[IDEMPOTENT_REPLAY_HEADER] = 'true'
+    return response
@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.payment.partitions import add_months
+from apps.payment.services import SalesRollupService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups for a date range from orders and archived orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, required=True,
+                            help='First paid day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Last paid day to rebuild (YYYY-MM-DD, default: today)')
+
+    def handle(self, *args, **options):
+        date_from = options['date_from']
+        date_to = options['date_to'] or timezone.localdate()
+        if date_from > date_to:
+            raise CommandError('--from must not be after --to')
+
+        # One month per transaction keeps the rollup table lock short
+        start = date_from
+        while start <= date_to:
+            end = min(add_months(start.replace(day=1), 1) - timedelta(days=1), date_to)
+            rows = SalesRollupService.rebuild(start, end)
+            self.stdout.write(f'{start} .. {end}: {rows} rollup rows')
+            start = end + timedelta(days=1)
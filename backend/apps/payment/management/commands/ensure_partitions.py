@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.payment.partitions import PARTITIONED_TABLES, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create the monthly partitions for this month and the coming months'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=settings.PARTITION_MONTHS_AHEAD,
+            help='How many months ahead to create (default: PARTITION_MONTHS_AHEAD)'
+        )
+
+    def handle(self, *args, **options):
+        for table in PARTITIONED_TABLES:
+            created = ensure_partitions(table, options['months'])
+            for name in created:
+                self.stdout.write(f'Created {name}')
+            if not created:
+                self.stdout.write(f'{table}: partitions up to date')
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 09:21
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Renamed: the Order.coupon change it used to carry moved to 0016
+    replaces = [('payment', '0005_alter_order_coupon_stockreservation')]
+
+    dependencies = [
+        ('main', '0004_product_reserved_quantity_and_more'),
+        ('payment', '0004_order_coupon_order_coupon_code_order_coupon_discount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('status', models.CharField(choices=[('active', 'Active'), ('committed', 'Committed'), ('released', 'Released')], default='active', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='payment.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_reservations', to='main.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_reservations', to='main.productvariant')),
+            ],
+            options={
+                'verbose_name': 'Stock Reservation',
+                'verbose_name_plural': 'Stock Reservations',
+                'db_table': 'stock_reservations',
+                'ordering': ['expires_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'active')), fields=['expires_at'], name='stock_res_active_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-19 09:35
+
+from django.db import migrations, models
+
+# Summaries for existing orders, built the same way as at checkout
+BACKFILL_SUMMARY_SQL = """
+UPDATE orders o
+SET item_count = s.item_count,
+    title = LEFT(CASE WHEN s.lines > 1
+                      THEN s.first_name || ' and ' || (s.lines - 1) || ' more'
+                      ELSE s.first_name END, 300),
+    thumbnail = COALESCE(s.thumbnail, '')
+FROM (
+    SELECT DISTINCT ON (i.order_id)
+        i.order_id,
+        SUM(i.quantity) OVER w AS item_count,
+        COUNT(*) OVER w AS lines,
+        CASE WHEN i.variant_name <> '' THEN i.product_name || ' - ' || i.variant_name
+             ELSE i.product_name END AS first_name,
+        COALESCE(NULLIF(v.image, ''), (
+            SELECT pi.image FROM product_images pi
+            WHERE pi.product_id = i.product_id
+            ORDER BY pi.is_primary DESC, pi."order", pi.id
+            LIMIT 1
+        )) AS thumbnail
+    FROM order_items i
+    LEFT JOIN product_variants v ON v.id = i.variant_id
+    WINDOW w AS (PARTITION BY i.order_id)
+    ORDER BY i.order_id, i.id
+) s
+WHERE o.id = s.order_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0005_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, help_text='Total quantity of all items'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='thumbnail',
+            field=models.CharField(blank=True, help_text='Image path of the first item', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='title',
+            field=models.CharField(blank=True, help_text='First item name (and how many more)', max_length=300),
+        ),
+        migrations.RunSQL(BACKFILL_SUMMARY_SQL, migrations.RunSQL.noop),
+    ]
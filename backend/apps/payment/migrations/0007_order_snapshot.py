@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-19 09:37
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0006_order_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='snapshot',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
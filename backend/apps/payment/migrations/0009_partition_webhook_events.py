@@ -0,0 +1,138 @@
+# Generated by Django 6.0 on 2026-10-19 10:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# Rebuild webhook_events as a table partitioned by month on occurred_at:
+# move the old table aside, create the partitioned one (same index names),
+# create monthly partitions for the existing rows and the next months,
+# copy the rows over and drop the old table.
+PARTITION_WEBHOOK_EVENTS_SQL = """
+ALTER TABLE webhook_events RENAME TO webhook_events_unpartitioned;
+ALTER TABLE webhook_events_unpartitioned RENAME CONSTRAINT webhook_events_pkey TO webhook_events_unpartitioned_pkey;
+ALTER SEQUENCE webhook_events_id_seq RENAME TO webhook_events_unpartitioned_id_seq;
+ALTER INDEX webhook_eve_provide_2e40e6_idx RENAME TO webhook_events_unpartitioned_provider_idx;
+ALTER INDEX webhook_eve_status_330e1f_idx RENAME TO webhook_events_unpartitioned_status_idx;
+
+CREATE TABLE webhook_events (
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    provider varchar(20) NOT NULL,
+    event_id varchar(255) NOT NULL,
+    event_type varchar(100) NOT NULL,
+    status varchar(20) NOT NULL,
+    data jsonb NOT NULL,
+    processed_at timestamp with time zone NULL,
+    error_message text NULL,
+    created_at timestamp with time zone NOT NULL,
+    occurred_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, occurred_at),
+    CONSTRAINT webhook_event_unique UNIQUE (event_id, occurred_at)
+) PARTITION BY RANGE (occurred_at);
+CREATE INDEX webhook_eve_provide_2e40e6_idx ON webhook_events (provider, event_type);
+CREATE INDEX webhook_eve_status_330e1f_idx ON webhook_events (status);
+CREATE TABLE webhook_events_default PARTITION OF webhook_events DEFAULT;
+
+DO $$
+DECLARE
+    month date := date_trunc('month', LEAST(
+        (SELECT MIN(created_at) FROM webhook_events_unpartitioned), NOW()
+    ) AT TIME ZONE 'UTC')::date;
+BEGIN
+    WHILE month <= (date_trunc('month', NOW() AT TIME ZONE 'UTC') + interval '3 months')::date LOOP
+        EXECUTE format(
+            'CREATE TABLE webhook_events_p%s PARTITION OF webhook_events FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYYMM'),
+            month::timestamp AT TIME ZONE 'UTC',
+            (month + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+        );
+        month := (month + interval '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO webhook_events (
+    id, provider, event_id, event_type, status, data,
+    processed_at, error_message, created_at, occurred_at
+)
+SELECT
+    id, provider, event_id, event_type, status, data,
+    processed_at, error_message, created_at,
+    CASE WHEN data->>'created' ~ '^[0-9]+$'
+         THEN to_timestamp((data->>'created')::bigint)
+         ELSE created_at END
+FROM webhook_events_unpartitioned;
+
+SELECT setval(pg_get_serial_sequence('webhook_events', 'id'), COALESCE(MAX(id), 0) + 1, false)
+FROM webhook_events;
+
+DROP TABLE webhook_events_unpartitioned;
+"""
+
+# Back to a plain table (keeping one row per event_id)
+UNPARTITION_WEBHOOK_EVENTS_SQL = """
+ALTER TABLE webhook_events RENAME TO webhook_events_partitioned;
+ALTER TABLE webhook_events_partitioned RENAME CONSTRAINT webhook_events_pkey TO webhook_events_partitioned_pkey;
+ALTER SEQUENCE webhook_events_id_seq RENAME TO webhook_events_partitioned_id_seq;
+ALTER INDEX webhook_eve_provide_2e40e6_idx RENAME TO webhook_events_partitioned_provider_idx;
+ALTER INDEX webhook_eve_status_330e1f_idx RENAME TO webhook_events_partitioned_status_idx;
+
+CREATE TABLE webhook_events (
+    id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    provider varchar(20) NOT NULL,
+    event_id varchar(255) NOT NULL UNIQUE,
+    event_type varchar(100) NOT NULL,
+    status varchar(20) NOT NULL,
+    data jsonb NOT NULL,
+    processed_at timestamp with time zone NULL,
+    error_message text NULL,
+    created_at timestamp with time zone NOT NULL
+);
+CREATE INDEX webhook_events_event_id_443fdf2c_like ON webhook_events (event_id varchar_pattern_ops);
+CREATE INDEX webhook_eve_provide_2e40e6_idx ON webhook_events (provider, event_type);
+CREATE INDEX webhook_eve_status_330e1f_idx ON webhook_events (status);
+
+INSERT INTO webhook_events (
+    id, provider, event_id, event_type, status, data,
+    processed_at, error_message, created_at
+)
+SELECT DISTINCT ON (event_id)
+    id, provider, event_id, event_type, status, data,
+    processed_at, error_message, created_at
+FROM webhook_events_partitioned
+ORDER BY event_id, id;
+
+SELECT setval(pg_get_serial_sequence('webhook_events', 'id'), COALESCE(MAX(id), 0) + 1, false)
+FROM webhook_events;
+
+DROP TABLE webhook_events_partitioned;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_orderevent'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='webhookevent',
+                    name='occurred_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                migrations.AlterField(
+                    model_name='webhookevent',
+                    name='event_id',
+                    field=models.CharField(max_length=255),
+                ),
+                migrations.AddConstraint(
+                    model_name='webhookevent',
+                    constraint=models.UniqueConstraint(fields=('event_id', 'occurred_at'), name='webhook_event_unique'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(PARTITION_WEBHOOK_EVENTS_SQL, UNPARTITION_WEBHOOK_EVENTS_SQL),
+            ],
+        ),
+    ]
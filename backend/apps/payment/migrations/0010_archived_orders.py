@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-19 11:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0009_partition_webhook_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='couponusage',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='coupon_usages', to='payment.order'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_number', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled'), ('refunded', 'Refunded')], max_length=20)),
+                ('is_paid', models.BooleanField(default=False)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('title', models.CharField(blank=True, max_length=300)),
+                ('thumbnail', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField()),
+                ('document', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Order',
+                'verbose_name_plural': 'Archived Orders',
+                'db_table': 'archived_orders',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='archived_or_user_id_413cf4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-19 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_stockmovement'),
+        ('payment', '0010_archived_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='in_sales_rollup',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='orderevent',
+            name='event_type',
+            field=models.CharField(choices=[('order.created', 'Order created'), ('order.paid', 'Order paid'), ('order.cancelled', 'Order cancelled'), ('order.shipped', 'Order shipped'), ('order.refunded', 'Order refunded')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Day the order was paid')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('units', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0, help_text='Orders that included the product')),
+                ('brand', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='main.brand')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='main.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='main.product')),
+            ],
+            options={
+                'verbose_name': 'Sales Rollup',
+                'verbose_name_plural': 'Sales Rollups',
+                'db_table': 'sales_rollups',
+                'ordering': ['-date', 'product'],
+                'indexes': [models.Index(fields=['category', 'date'], name='sales_rollu_categor_4c6b59_idx'), models.Index(fields=['brand', 'date'], name='sales_rollu_brand_i_a8950e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='sales_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-19 13:05
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0011_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShippingRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('country', models.CharField(max_length=100)),
+                ('state', models.CharField(blank=True, help_text='Blank: any state', max_length=100)),
+                ('postal_prefix', models.CharField(blank=True, help_text='Blank: any postal code', max_length=20)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('min_weight', models.DecimalField(decimal_places=2, default=0, help_text='kg, inclusive', max_digits=8)),
+                ('max_weight', models.DecimalField(blank=True, decimal_places=2, help_text='kg, exclusive; blank: no limit', max_digits=8, null=True)),
+                ('base_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cost_per_kg', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+            options={
+                'verbose_name': 'Shipping Rate',
+                'verbose_name_plural': 'Shipping Rates',
+                'db_table': 'shipping_rates',
+                'ordering': ['country', 'state', 'postal_prefix', 'min_weight'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TaxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('country', models.CharField(max_length=100)),
+                ('state', models.CharField(blank=True, help_text='Blank: any state', max_length=100)),
+                ('postal_prefix', models.CharField(blank=True, help_text='Blank: any postal code', max_length=20)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rate', models.DecimalField(decimal_places=4, help_text='0.0825 = 8.25%', max_digits=6, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)])),
+                ('includes_shipping', models.BooleanField(default=False, help_text='Shipping cost is taxed too')),
+            ],
+            options={
+                'verbose_name': 'Tax Rate',
+                'verbose_name_plural': 'Tax Rates',
+                'db_table': 'tax_rates',
+                'ordering': ['country', 'state', 'postal_prefix'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0012_shipping_tax_rates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='ordering_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['ordering_key', 'status'], name='webhook_eve_orderin_89446b_idx'),
+        ),
+    ]
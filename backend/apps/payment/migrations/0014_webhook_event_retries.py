@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0013_webhook_event_ordering_key'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='webhookevent',
+            old_name='error_message',
+            new_name='last_error',
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed'), ('ignored', 'Ignored'), ('dead', 'Dead letter')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='webhook_eve_status_8017be_idx'),
+        ),
+        # Events that failed before retries were scheduled are due now
+        migrations.RunSQL(
+            "UPDATE webhook_events SET next_attempt_at = NOW() WHERE status = 'failed'",
+            migrations.RunSQL.noop,
+        ),
+    ]
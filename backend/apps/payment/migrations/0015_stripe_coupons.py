@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-19 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0014_webhook_event_retries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeCoupon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_off', models.PositiveIntegerField(help_text='Discount in cents')),
+                ('stripe_coupon_id', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_coupons', to='payment.coupon')),
+            ],
+            options={
+                'verbose_name': 'Stripe Coupon',
+                'verbose_name_plural': 'Stripe Coupons',
+                'db_table': 'stripe_coupons',
+                'constraints': [models.UniqueConstraint(fields=('coupon', 'amount_off'), name='stripe_coupon_unique')],
+            },
+        ),
+    ]
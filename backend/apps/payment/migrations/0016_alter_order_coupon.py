@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-19 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0015_stripe_coupons'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='coupon',
+            field=models.ForeignKey(blank=True, help_text='Coupon applied to this order', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='payment.coupon'),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from apps.main.models import Product, ProductVariant
+import json
 import uuid
+import zlib
 
 
 class ShippingAddress(models.Model):
@@ -128,6 +132,18 @@ class Order(models.Model):
     coupon_code = models.CharField(max_length=50, blank=True, help_text="Coupon code used (stored for reference)")
     coupon_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Discount amount from coupon")
 
+    # Listing summary, captured at order time so order history lists are
+    # served from this row alone
+    item_count = models.PositiveIntegerField(default=0, help_text="Total quantity of all items")
+    title = models.CharField(max_length=300, blank=True, help_text="First item name (and how many more)")
+    thumbnail = models.CharField(max_length=255, blank=True, help_text="Image path of the first item")
+
+    # Pre-rendered order document (OrderSerializer) for paid orders, refreshed
+    # on status changes; the order detail serves it without joins
+    snapshot = models.JSONField(null=True, blank=True, editable=False, encoder=DjangoJSONEncoder)
+
+    # Whether the order's lines are currently counted in SalesRollup
+    in_sales_rollup = models.BooleanField(default=False, editable=False)
 
     class Meta:
         db_table = 'orders'
@@ -149,6 +165,14 @@ class Order(models.Model):
             self.order_number = f"ORD-{uuid.uuid4().hex[:12].upper()}"
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def summary_title(names):
+        """Listing title for the item names, in order: 'First item and 2 more'"""
+        if not names:
+            return ''
+        title = names[0] if len(names) == 1 else f"{names[0]} and {len(names) - 1} more"
+        return title[:300]
+
     @property
     def total_items(self):
         """Total number of items in order"""
@@ -202,6 +226,60 @@ class OrderItem(models.Model):
         return f"{self.product_name} (x{self.quantity})"
 
 
+class StockReservation(models.Model):
+    """
+    Stock held for an unpaid order line until expires_at.
+    Active holds are counted in Product/ProductVariant.reserved_quantity;
+    payment commits them, expiry or cancellation releases them.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    ]
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='stock_reservations'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='stock_reservations'
+    )
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+        verbose_name = 'Stock Reservation'
+        verbose_name_plural = 'Stock Reservations'
+        ordering = ['expires_at']
+        indexes = [
+            # Expiry sweep only looks at active holds
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status='active'),
+                name='stock_res_active_expiry_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.order.order_number} - {self.product_id} x{self.quantity} ({self.status})"
+
+
 class Payment(models.Model):
     """
     Payment transactions.
@@ -354,9 +432,13 @@ class CouponUsage(models.Model):
         on_delete=models.CASCADE,
         related_name='coupon_usages'
     )
+    # Kept (without the order) when the order is archived, so per-user
+    # coupon limits still count it
     order = models.ForeignKey(
         Order,
-        on_delete=models.CASCADE,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
         related_name='coupon_usages'
     )
 
@@ -373,6 +455,34 @@ class CouponUsage(models.Model):
         return f"{self.user.username} used {self.coupon.code}"
 
 
+class StripeCoupon(models.Model):
+    """
+    Stripe coupon object reused by every checkout giving the same discount
+    with one of our coupons, instead of creating one per checkout.
+    Keyed by the discount in cents: Stripe percentage coupons would also
+    discount the shipping and tax line items.
+    """
+    coupon = models.ForeignKey(
+        Coupon,
+        on_delete=models.CASCADE,
+        related_name='stripe_coupons'
+    )
+    amount_off = models.PositiveIntegerField(help_text="Discount in cents")
+    stripe_coupon_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'stripe_coupons'
+        verbose_name = 'Stripe Coupon'
+        verbose_name_plural = 'Stripe Coupons'
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'amount_off'], name='stripe_coupon_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.coupon.code} - {self.amount_off / 100:.2f} off ({self.stripe_coupon_id})"
+
+
 class OrderStatusHistory(models.Model):
     """
     Track order status changes.
@@ -402,7 +512,10 @@ class OrderStatusHistory(models.Model):
         return f"{self.order.order_number} - {self.status}"
 
 class WebhookEvent(models.Model):
-    """События webhook от платежных систем"""
+    """
+    События webhook от платежных систем.
+    Partitioned by month on occurred_at (see apps.payment.partitions).
+    """
     PROVIDER_CHOICES = [
         ('stripe', 'Stripe'),
         ('paypal', 'PayPal'),
@@ -413,18 +526,30 @@ class WebhookEvent(models.Model):
         ('processed', 'Processed'),
         ('failed', 'Failed'),
         ('ignored', 'Ignored'),
+        ('dead', 'Dead letter'),
     ]
 
     provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
-    event_id = models.CharField(max_length=255, unique=True)
+    event_id = models.CharField(max_length=255)
     event_type = models.CharField(max_length=100)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     data = models.JSONField()
     processed_at = models.DateTimeField(null=True, blank=True)
-    error_message = models.TextField(blank=True, null=True)
+
+    # Retries: failed events run again at next_attempt_at (exponential backoff
+    # with jitter) and become dead letters after WEBHOOK_MAX_ATTEMPTS
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    # Partition key: when the provider created the event. Redeliveries keep
+    # it, so (event_id, occurred_at) still identifies an event
+    occurred_at = models.DateTimeField(default=timezone.now)
+    # Events with the same key (usually one order) are processed one at a
+    # time in occurred_at order, different keys in parallel
+    ordering_key = models.CharField(max_length=255, blank=True)
 
     class Meta:
         db_table = 'webhook_events'
@@ -434,6 +559,12 @@ class WebhookEvent(models.Model):
         indexes = [
             models.Index(fields=['provider', 'event_type']),
             models.Index(fields=['status']),
+            models.Index(fields=['ordering_key', 'status']),
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        constraints = [
+            # Unique constraints on a partitioned table must include the partition key
+            models.UniqueConstraint(fields=['event_id', 'occurred_at'], name='webhook_event_unique'),
         ]
 
     def __str__(self):
@@ -446,11 +577,245 @@ class WebhookEvent(models.Model):
         self.processed_at = timezone.now()
         self.save()
 
-    def mark_as_failed(self, error_message):
-        """Помечает событие как неудачно обработанное"""
+    def mark_as_failed(self, error_message, retry_at=None):
+        """Помечает событие как неудачно обработанное (dead letter without retry_at)"""
         from django.utils import timezone
-        self.status = 'failed'
-        self.error_message = error_message
+        self.status = 'failed' if retry_at else 'dead'
+        self.last_error = error_message
+        self.next_attempt_at = retry_at
         self.processed_at = timezone.now()
         self.save()
     
+
+
+class OrderEvent(models.Model):
+    """
+    Transactional outbox for order domain events.
+    Written in the same transaction as the change it describes and handled
+    after commit by apps.payment.events, so follow-up work (coupon
+    bookkeeping, emails, ...) survives a broker outage and is retried.
+    """
+    EVENT_TYPE_CHOICES = [
+        ('order.created', 'Order created'),
+        ('order.paid', 'Order paid'),
+        ('order.cancelled', 'Order cancelled'),
+        ('order.shipped', 'Order shipped'),
+        ('order.refunded', 'Order refunded'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='events'
+    )
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPE_CHOICES)
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Retries: handlers run again at available_at until ORDER_EVENT_MAX_ATTEMPTS
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    error_message = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'order_events'
+        verbose_name = 'Order Event'
+        verbose_name_plural = 'Order Events'
+        ordering = ['id']
+        indexes = [
+            # The dispatcher only looks at pending events
+            models.Index(
+                fields=['available_at'],
+                condition=models.Q(status='pending'),
+                name='order_event_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.order_id} ({self.status})"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Delivered, cancelled and refunded orders moved out of the hot tables
+    by the archive_old_orders task (see OrderArchiveService).
+    The summary columns serve order history listings; the full order
+    (items, address, status history, payments) is kept as one
+    zlib-compressed JSON document.
+    """
+    # Same id and number the order had in the orders table
+    id = models.BigIntegerField(primary_key=True)
+    order_number = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name='archived_orders'
+    )
+
+    # Listing summary (same columns as the orders row)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    is_paid = models.BooleanField(default=False)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    item_count = models.PositiveIntegerField(default=0)
+    title = models.CharField(max_length=300, blank=True)
+    thumbnail = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField()
+
+    document = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'archived_orders'
+        verbose_name = 'Archived Order'
+        verbose_name_plural = 'Archived Orders'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_number}"
+
+    @staticmethod
+    def compress(data: dict) -> bytes:
+        return zlib.compress(json.dumps(data, cls=DjangoJSONEncoder).encode())
+
+    @property
+    def data(self) -> dict:
+        """The archived document: {'order': <order detail>, 'payments': [...]}"""
+        return json.loads(zlib.decompress(bytes(self.document)))
+
+
+class SalesRollup(models.Model):
+    """
+    Daily sales per product (with its category and brand) for reporting.
+    Kept up to date from order paid/cancelled/refunded events by
+    SalesRollupService; rebuilt with manage.py backfill_sales_rollups.
+    """
+    date = models.DateField(help_text="Day the order was paid")
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='sales_rollups'
+    )
+    category = models.ForeignKey(
+        'main.Category',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='sales_rollups'
+    )
+    brand = models.ForeignKey(
+        'main.Brand',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='sales_rollups'
+    )
+
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0, help_text="Orders that included the product")
+
+    class Meta:
+        db_table = 'sales_rollups'
+        verbose_name = 'Sales Rollup'
+        verbose_name_plural = 'Sales Rollups'
+        ordering = ['-date', 'product']
+        constraints = [
+            # Also serves date range queries
+            models.UniqueConstraint(fields=['date', 'product'], name='sales_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'date']),
+            models.Index(fields=['brand', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_id}: {self.units} units"
+
+
+class RateZone(models.Model):
+    """
+    Destination zone of a rate: a country, optionally narrowed to a state
+    and/or a postal code prefix. The most specific matching zone wins
+    (see apps.payment.rates).
+    """
+    name = models.CharField(max_length=100)
+    country = models.CharField(max_length=100)
+    state = models.CharField(max_length=100, blank=True, help_text="Blank: any state")
+    postal_prefix = models.CharField(max_length=20, blank=True, help_text="Blank: any postal code")
+    is_active = models.BooleanField(default=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _rates_changed()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        _rates_changed()
+        return result
+
+
+def _rates_changed():
+    """Have every process rebuild its rate index once this transaction commits"""
+    from django.db import transaction
+    from .rates import invalidate
+    transaction.on_commit(invalidate)
+
+
+class ShippingRate(RateZone):
+    """
+    Shipping cost for a zone and weight bracket:
+    base_cost + cost_per_kg * cart weight.
+    """
+    min_weight = models.DecimalField(max_digits=8, decimal_places=2, default=0, help_text="kg, inclusive")
+    max_weight = models.DecimalField(
+        max_digits=8, decimal_places=2, null=True, blank=True, help_text="kg, exclusive; blank: no limit"
+    )
+    base_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_per_kg = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'shipping_rates'
+        verbose_name = 'Shipping Rate'
+        verbose_name_plural = 'Shipping Rates'
+        ordering = ['country', 'state', 'postal_prefix', 'min_weight']
+
+    def __str__(self):
+        return f"{self.name} ({self.min_weight}-{self.max_weight or '∞'} kg)"
+
+
+class TaxRate(RateZone):
+    """
+    Sales tax for a zone. Several rates of the same zone add up
+    (e.g. state and city tax).
+    """
+    rate = models.DecimalField(
+        max_digits=6, decimal_places=4,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+        help_text="0.0825 = 8.25%"
+    )
+    includes_shipping = models.BooleanField(default=False, help_text="Shipping cost is taxed too")
+
+    class Meta:
+        db_table = 'tax_rates'
+        verbose_name = 'Tax Rate'
+        verbose_name_plural = 'Tax Rates'
+        ordering = ['country', 'state', 'postal_prefix']
+
+    def __str__(self):
+        return f"{self.name} ({self.rate:.2%})"
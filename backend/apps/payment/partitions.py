@@ -0,0 +1,125 @@
+"""
+Monthly range partitions (PostgreSQL declarative partitioning).
+
+PARTITIONED_TABLES maps each partitioned table to its partition key column.
+A table has one partition per month, <table>_pYYYYMM, plus <table>_default
+for rows outside them. ensure_partitions() pre-creates the coming months
+(manage.py ensure_partitions, the maintain_partitions task) and
+drop_partitions_before() drops whole months for retention instead of
+deleting rows one by one. Rows matching RETAINED_ROWS (work not finished
+yet) are moved to the default partition first rather than dropped.
+"""
+import logging
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = {
+    'webhook_events': 'occurred_at',
+}
+
+# Rows retention must not destroy: pending, failed (awaiting retry) and dead
+# letters outlive their month
+RETAINED_ROWS = {
+    'webhook_events': "status NOT IN ('processed', 'ignored')",
+}
+
+CREATE_PARTITION_SQL = (
+    "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} "
+    "FOR VALUES FROM ('{start}') TO ('{end}')"
+)
+
+# Once detached, the month's range no longer exists, so re-inserting
+# through the parent routes the rows to the default partition
+DETACH_PARTITION_SQL = "ALTER TABLE {table} DETACH PARTITION {partition}"
+MOVE_RETAINED_ROWS_SQL = "INSERT INTO {table} SELECT * FROM {partition} WHERE {retained}"
+
+LIST_PARTITIONS_SQL = """
+SELECT c.relname
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = %s::regclass
+"""
+
+
+def add_months(month: date, months: int) -> date:
+    """First day of the month `months` away from month"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _bound(month: date) -> str:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+
+def ensure_partitions(table: str, months_ahead: int) -> list:
+    """
+    Create the partitions for this month and the next months_ahead months
+    (existing ones are left alone). Returns the names of new partitions.
+    """
+    this_month = timezone.now().date().replace(day=1)
+    existing = set(list_partitions(table))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(this_month, offset)
+        name = partition_name(table, month)
+        if name in existing:
+            continue
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(CREATE_PARTITION_SQL.format(
+                    partition=name, table=table,
+                    start=_bound(month), end=_bound(add_months(month, 1))
+                ))
+        except DatabaseError as e:
+            # e.g. rows for that month already sit in the default partition
+            logger.error(f"Could not create partition {name}: {e}")
+            continue
+        created.append(name)
+    return created
+
+
+def list_partitions(table: str) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(LIST_PARTITIONS_SQL, [table])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def drop_partitions_before(table: str, cutoff: datetime) -> list:
+    """
+    Drop the monthly partitions entirely older than cutoff and delete the
+    (few) older rows that landed in the default partition. Rows matching
+    RETAINED_ROWS[table] are moved to the default partition and kept.
+    Returns the names of dropped partitions.
+    """
+    retained = RETAINED_ROWS.get(table)
+    cutoff_month = cutoff.date().replace(day=1)
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})(\d{{2}})$")
+    dropped = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in sorted(list_partitions(table)):
+            match = pattern.match(name)
+            if match and date(int(match[1]), int(match[2]), 1) < cutoff_month:
+                if retained:
+                    cursor.execute(DETACH_PARTITION_SQL.format(table=table, partition=name))
+                    cursor.execute(MOVE_RETAINED_ROWS_SQL.format(
+                        table=table, partition=name, retained=retained
+                    ))
+                    if cursor.rowcount:
+                        logger.info(f"Kept {cursor.rowcount} unfinished rows of {name} in {table}_default")
+                cursor.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+        cursor.execute(
+            f"DELETE FROM {table}_default WHERE {PARTITIONED_TABLES[table]} < %s"
+            + (f" AND NOT ({retained})" if retained else ""),
+            [cutoff]
+        )
+    return dropped
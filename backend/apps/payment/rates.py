@@ -0,0 +1,171 @@
+"""
+Shipping and tax quotes.
+
+Active ShippingRate / TaxRate rows are compiled into an in-process index
+(country -> state -> postal code prefix -> rates), so quoting a cart is a
+few dict lookups and no queries. Saving or deleting a rate bumps a version
+in Redis; every process re-checks it at most once per
+RATES_VERSION_CHECK_INTERVAL seconds and rebuilds its index when it
+changed.
+
+Zone precedence: the address's state before any-state rates, and within
+those the longest matching postal prefix first.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from config.redis_client import get_redis
+
+from .models import ShippingRate, TaxRate
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'rates:version'
+CENT = Decimal('0.01')
+
+
+def normalize_region(value: str) -> str:
+    return (value or '').strip().upper()
+
+
+def normalize_postal_code(value: str) -> str:
+    """'sw1a 1aa' -> 'SW1A1AA', '94105-1234' -> '941051234'"""
+    return ''.join(ch for ch in (value or '').upper() if ch.isalnum())
+
+
+@dataclass(frozen=True)
+class Quote:
+    shipping_cost: Decimal
+    tax_amount: Decimal
+
+
+class RateIndex:
+    """Rates compiled for lookups by address"""
+
+    def __init__(self, shipping_rates: Iterable[ShippingRate], tax_rates: Iterable[TaxRate]):
+        self.shipping, self.shipping_prefix_length = self._compile(shipping_rates)
+        self.tax, self.tax_prefix_length = self._compile(tax_rates)
+        for prefixes in self.shipping.values():
+            for rates_by_prefix in prefixes.values():
+                for rates in rates_by_prefix.values():
+                    rates.sort(key=lambda rate: rate.min_weight)
+
+    @staticmethod
+    def _compile(rates):
+        index = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        longest = 0
+        for rate in rates:
+            prefix = normalize_postal_code(rate.postal_prefix)
+            index[normalize_region(rate.country)][normalize_region(rate.state)][prefix].append(rate)
+            longest = max(longest, len(prefix))
+        # Plain dicts: lookups must not create entries
+        return {
+            country: {state: dict(prefixes) for state, prefixes in states.items()}
+            for country, states in index.items()
+        }, longest
+
+    @staticmethod
+    def _zones(index, prefix_length, address):
+        """Rate lists of the zones matching the address, most specific first"""
+        states = index.get(normalize_region(address.country))
+        if not states:
+            return
+        state = normalize_region(address.state)
+        postal_code = normalize_postal_code(address.postal_code)[:prefix_length]
+        for state_key in ((state, '') if state else ('',)):
+            prefixes = states.get(state_key)
+            if not prefixes:
+                continue
+            for length in range(len(postal_code), -1, -1):
+                rates = prefixes.get(postal_code[:length])
+                if rates:
+                    yield rates
+
+    def shipping_rate(self, address, weight: Decimal) -> Optional[ShippingRate]:
+        """Rate of the most specific zone with a bracket for weight"""
+        for rates in self._zones(self.shipping, self.shipping_prefix_length, address):
+            for rate in rates:
+                if rate.min_weight <= weight and (rate.max_weight is None or weight < rate.max_weight):
+                    return rate
+        return None
+
+    def tax_rates(self, address) -> List[TaxRate]:
+        """Rates of the most specific zone with any"""
+        return next(self._zones(self.tax, self.tax_prefix_length, address), [])
+
+
+_index = None
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index() -> RateIndex:
+    """This process's rate index, rebuilt when rates changed"""
+    global _index, _version, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < settings.RATES_VERSION_CHECK_INTERVAL:
+        return _index
+
+    with _lock:
+        try:
+            version = get_redis().get(VERSION_KEY)
+        except RedisError as e:
+            # Keep serving the rates we have; retry after the interval
+            logger.warning(f"Could not read rates version: {e}")
+            version = _version
+        if _index is None or version != _version:
+            _index = RateIndex(
+                ShippingRate.objects.filter(is_active=True),
+                TaxRate.objects.filter(is_active=True)
+            )
+            _version = version
+        _checked_at = now
+    return _index
+
+
+def invalidate() -> None:
+    """Rates changed: rebuild here now and in other processes on their next check"""
+    global _index
+    _index = None
+    try:
+        get_redis().incr(VERSION_KEY)
+    except RedisError as e:
+        logger.warning(f"Could not bump rates version, other processes keep old rates: {e}")
+
+
+def cart_weight(items) -> Decimal:
+    """Total weight in kg of cart/order lines (products without a weight count as 0)"""
+    return sum((item.product.weight or Decimal('0')) * item.quantity for item in items) or Decimal('0')
+
+
+def quote(address, amount: Decimal, weight: Decimal) -> Quote:
+    """
+    Shipping cost and tax for goods worth amount (after product discounts)
+    weighing weight kg, shipped to address. Without a matching shipping rate
+    the flat DEFAULT_SHIPPING_COST applies; without a tax rate, no tax.
+    """
+    index = get_index()
+
+    rate = index.shipping_rate(address, weight)
+    if rate is None:
+        shipping_cost = settings.DEFAULT_SHIPPING_COST
+    else:
+        shipping_cost = rate.base_cost + rate.cost_per_kg * weight
+    shipping_cost = Decimal(shipping_cost).quantize(CENT, ROUND_HALF_UP)
+
+    tax_amount = sum(
+        (tax.rate * (amount + shipping_cost if tax.includes_shipping else amount)
+         for tax in index.tax_rates(address)),
+        Decimal('0')
+    ).quantize(CENT, ROUND_HALF_UP)
+
+    return Quote(shipping_cost=shipping_cost, tax_amount=tax_amount)
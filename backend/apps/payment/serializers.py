@@ -3,10 +3,18 @@ from .models import (
     ShippingAddress, Order, OrderItem, Payment,
     Coupon, CouponUsage, OrderStatusHistory
 )
+from datetime import timedelta
 from apps.main.models import Product, ProductVariant
+from apps.main.services import InsufficientStockError
 from apps.cart.models import Cart
+from apps.cart.services import BLOCKING_VERDICTS, CartService
+from apps.cart.storage import get_cart_store
+from .services import ReservationService
+from .events import emit, ORDER_CREATED
+from . import rates
 from django.utils import timezone
 from django.db import transaction
+from django.core.files.storage import default_storage
 from rest_framework.validators import UniqueForDateValidator
 
 
@@ -70,12 +78,35 @@ class OrderStatusHistorySerializer(serializers.ModelSerializer):
         fields = ['id', 'status', 'notes', 'changed_by_name', 'created_at']
 
 
+class ThumbnailField(serializers.ReadOnlyField):
+    """URL of the order's stored first-item image path (None without one)"""
+
+    def to_representation(self, value):
+        return default_storage.url(value) if value else None
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Compact order for history listings - served from the orders row alone.
+    Also renders ArchivedOrder rows and .values() rows with these fields.
+    """
+    thumbnail = ThumbnailField()
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_number', 'status', 'is_paid', 'total',
+            'item_count', 'title', 'thumbnail', 'created_at'
+        ]
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """Serializer for viewing orders"""
     items = OrderItemSerializer(many=True, read_only=True)
     shipping_address = ShippingAddressSerializer(read_only=True)
     status_history = OrderStatusHistorySerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
+    thumbnail = ThumbnailField()
 
     class Meta:
         model = Order
@@ -85,6 +116,7 @@ class OrderSerializer(serializers.ModelSerializer):
             'subtotal', 'discount_amount', 'tax_amount', 'shipping_cost', 'total',
             'tracking_number', 'shipped_at', 'delivered_at',
             'customer_notes', 'items', 'status_history', 'total_items',
+            'item_count', 'title', 'thumbnail',
             'coupon_code', 'coupon_discount',
             'created_at', 'updated_at'
         ]
@@ -137,6 +169,14 @@ class OrderCreateSerializer(serializers.Serializer):
         except Coupon.DoesNotExist:
             raise serializers.ValidationError("Invalid coupon code")
 
+    def save(self, **kwargs):
+        # Carts may be kept in Redis: persist the latest state and drop the
+        # hot copy so the order is built from (and clears) the flushed cart.
+        # Done before the order transaction so a failed checkout can't roll
+        # the flush back.
+        get_cart_store().flush(self.context['request'].user.id, evict=True)
+        return super().save(**kwargs)
+
     @transaction.atomic
     def create(self, validated_data):
         """Create order from user's cart"""
@@ -151,6 +191,19 @@ class OrderCreateSerializer(serializers.Serializer):
         if not cart.items.exists():
             raise serializers.ValidationError({"error": "Cart is empty"})
 
+        # Stock may have changed since the items were added
+        unavailable = [
+            line['item_id'] for line in CartService.revalidate(cart.items.values(
+                'id', 'product_id', 'variant_id', 'quantity', 'unit_price_snapshot'
+            ))
+            if line['verdict'] in BLOCKING_VERDICTS
+        ]
+        if unavailable:
+            raise serializers.ValidationError({
+                "error": "Some items are no longer available in the requested quantity",
+                "items": unavailable
+            })
+
         # Calculate totals
         subtotal = cart.subtotal
         discount_from_products = cart.total_discount
@@ -160,7 +213,6 @@ class OrderCreateSerializer(serializers.Serializer):
         coupon_code = validated_data.get('coupon_code')
 
         # Calculate subtotal after product discounts (for coupon validation)
-        from decimal import Decimal
         subtotal_after_discounts = subtotal - discount_from_products
 
         if coupon_code:
@@ -173,13 +225,23 @@ class OrderCreateSerializer(serializers.Serializer):
                 })
 
         # Calculate totals WITHOUT coupon (coupon applied later in payment webhook)
-        tax_amount = Decimal(0)  # TODO: Calculate based on shipping address
-        shipping_cost = Decimal(10.00)  # TODO: Calculate based on shipping method
+        cart_items = list(cart.items.all())
+        shipping_address = ShippingAddress.objects.get(id=validated_data['shipping_address_id'])
+        quote = rates.quote(shipping_address, subtotal_after_discounts, rates.cart_weight(cart_items))
+        tax_amount = quote.tax_amount
+        shipping_cost = quote.shipping_cost
         total = subtotal - discount_from_products + tax_amount + shipping_cost
 
-        # Create order
-        shipping_address = ShippingAddress.objects.get(id=validated_data['shipping_address_id'])
+        # Listing summary: first item's name and image, total quantity
+        first_item = cart_items[0]
+        if first_item.variant and first_item.variant.image:
+            thumbnail = first_item.variant.image.name
+        else:
+            thumbnail = first_item.product.images.order_by(
+                '-is_primary', 'order', 'id'
+            ).values_list('image', flat=True).first() or ''
 
+        # Create order
         order = Order.objects.create(
             user=user,
             shipping_address=shipping_address,
@@ -190,12 +252,19 @@ class OrderCreateSerializer(serializers.Serializer):
             shipping_cost=shipping_cost,
             total=total,
             customer_notes=validated_data.get('customer_notes', ''),
+            item_count=sum(cart_item.quantity for cart_item in cart_items),
+            title=Order.summary_title([
+                f"{cart_item.product.name} - {cart_item.variant.name}" if cart_item.variant
+                else cart_item.product.name
+                for cart_item in cart_items
+            ]),
+            thumbnail=thumbnail,
             # DON'T save coupon to order yet - will be saved after payment succeeds
         )
 
         # Create order items from cart
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 product=cart_item.product,
                 variant=cart_item.variant,
@@ -207,18 +276,25 @@ class OrderCreateSerializer(serializers.Serializer):
                 discount_amount=cart_item.discount_amount,
                 total_price=cart_item.total_price
             )
+            for cart_item in cart_items
+        ])
 
-            # Update product stock
-            if cart_item.variant:
-                cart_item.variant.stock_quantity -= cart_item.quantity
-                cart_item.variant.save()
-            else:
-                cart_item.product.stock_quantity -= cart_item.quantity
-                cart_item.product.save()
-
-            # Update product sales count
-            cart_item.product.sales_count += cart_item.quantity
-            cart_item.product.save()
+        # Hold the stock until the order is paid (or the hold expires); the
+        # UPDATE guard fails the whole order if a concurrent order took it first
+        try:
+            ReservationService.reserve(order, [
+                (cart_item.product_id, cart_item.variant_id, cart_item.quantity)
+                for cart_item in cart_items
+            ])
+        except InsufficientStockError as e:
+            shortages = set(e.shortages)
+            raise serializers.ValidationError({
+                "error": "Some items are no longer available in the requested quantity",
+                "items": [
+                    cart_item.id for cart_item in cart_items
+                    if (cart_item.product_id, cart_item.variant_id) in shortages
+                ]
+            })
 
         # Coupon usage will be recorded after successful payment (in webhook)
 
@@ -233,6 +309,8 @@ class OrderCreateSerializer(serializers.Serializer):
         # Clear cart
         cart.items.all().delete()
 
+        emit(order, ORDER_CREATED)
+
         return order
 
 
@@ -300,6 +378,40 @@ class PaymentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at']
 
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    """Query parameters of the sales report (defaults to the last 30 days)"""
+    GROUP_BY_CHOICES = ['date', 'product', 'category', 'brand']
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    group_by = serializers.ChoiceField(choices=GROUP_BY_CHOICES, default='date')
+    product = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    brand = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+    def validate(self, attrs):
+        attrs.setdefault('date_to', timezone.localdate())
+        attrs.setdefault('date_from', attrs['date_to'] - timedelta(days=29))
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_from': 'Must not be after date_to'})
+        return attrs
+
+class OrderExportQuerySerializer(serializers.Serializer):
+    """Query parameters of the order export (defaults to the last 30 days)"""
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    file_format = serializers.ChoiceField(choices=['csv', 'jsonl'], default='csv')
+
+    def validate(self, attrs):
+        attrs.setdefault('date_to', timezone.localdate())
+        attrs.setdefault('date_from', attrs['date_to'] - timedelta(days=29))
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_from': 'Must not be after date_to'})
+        return attrs
+
 class OrderOrCartItemSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1, read_only=True)
     original_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -1,19 +1,129 @@
+import json
 import stripe
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
-from typing import Dict, Optional, Tuple
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
 import logging
+import random
+import uuid
 
-from .models import Payment, WebhookEvent
+from .models import (
+    ArchivedOrder, Coupon, Order, OrderItem, Payment, SalesRollup, StockReservation, StripeCoupon,
+    WebhookEvent
+)
 from apps.payment.models import Payment, OrderStatusHistory
+from apps.main.services import InsufficientStockError, InventoryService, StockLine
+from .events import emit, emit_many, ORDER_PAID, ORDER_CANCELLED
+from .stripe_gateway import get_client
 
 logger = logging.getLogger(__name__)
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 User = get_user_model()
 
+# Add (sign 1) or subtract (sign -1) one order's lines to its paid day
+RECORD_SALES_SQL = """
+INSERT INTO sales_rollups (date, product_id, category_id, brand_id, revenue, units, orders)
+SELECT %(date)s, i.product_id, p.category_id, p.brand_id,
+       %(sign)s * SUM(i.total_price), %(sign)s * SUM(i.quantity), %(sign)s
+FROM order_items i
+JOIN products p ON p.id = i.product_id
+WHERE i.order_id = %(order_id)s
+GROUP BY i.product_id, p.category_id, p.brand_id
+ON CONFLICT (date, product_id) DO UPDATE
+SET revenue = sales_rollups.revenue + EXCLUDED.revenue,
+    units = sales_rollups.units + EXCLUDED.units,
+    orders = sales_rollups.orders + EXCLUDED.orders
+"""
+
+# Rebuild a date range from the orders counted in it (backfill)
+PAID_DAY = "(COALESCE(o.paid_at, o.created_at) AT TIME ZONE %(tz)s)::date"
+MARK_COUNTED_ORDERS_SQL = f"""
+UPDATE orders o
+SET in_sales_rollup = (o.is_paid AND o.status NOT IN ('cancelled', 'refunded'))
+WHERE {PAID_DAY} BETWEEN %(date_from)s AND %(date_to)s
+"""
+REBUILD_SALES_SQL = f"""
+INSERT INTO sales_rollups (date, product_id, category_id, brand_id, revenue, units, orders)
+SELECT {PAID_DAY}, i.product_id, p.category_id, p.brand_id,
+       SUM(i.total_price), SUM(i.quantity), COUNT(DISTINCT o.id)
+FROM orders o
+JOIN order_items i ON i.order_id = o.id
+JOIN products p ON p.id = i.product_id
+WHERE o.in_sales_rollup AND {PAID_DAY} BETWEEN %(date_from)s AND %(date_to)s
+GROUP BY 1, i.product_id, p.category_id, p.brand_id
+"""
+ADD_SALES_SQL = """
+INSERT INTO sales_rollups (date, product_id, category_id, brand_id, revenue, units, orders)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (date, product_id) DO UPDATE
+SET revenue = sales_rollups.revenue + EXCLUDED.revenue,
+    units = sales_rollups.units + EXCLUDED.units,
+    orders = sales_rollups.orders + EXCLUDED.orders
+"""
+
+# Expiry: cancel one chunk of stale pending orders, then drop their active holds.
+# The status guard and SKIP LOCKED make each order (and its stock) expire once.
+CANCEL_STALE_ORDERS_SQL = """
+UPDATE orders
+SET status = 'cancelled', updated_at = NOW()
+WHERE id IN (
+    SELECT id FROM orders
+    WHERE status = 'pending' AND created_at < %s
+    ORDER BY created_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+AND status = 'pending'
+RETURNING id, order_number
+"""
+RELEASE_ORDER_HOLDS_SQL = """
+UPDATE stock_reservations
+SET status = 'released', updated_at = NOW()
+WHERE order_id = ANY(%s) AND status = 'active'
+RETURNING product_id, variant_id, quantity
+"""
+
+# Webhook events sharing an ordering key are processed by one worker at a time
+LOCK_ORDERING_KEY_SQL = "SELECT pg_advisory_lock(hashtextextended(%s, 0))"
+UNLOCK_ORDERING_KEY_SQL = "SELECT pg_advisory_unlock(hashtextextended(%s, 0))"
+
+# Webhook ingestion: concurrent deliveries of an event race on the unique
+# (event_id, occurred_at) constraint, only the winner gets its id back
+INSERT_WEBHOOK_EVENT_SQL = """
+INSERT INTO webhook_events (
+    provider, event_id, event_type, status, data, attempts, created_at, occurred_at, ordering_key
+)
+VALUES (
+    %(provider)s, %(event_id)s, %(event_type)s, %(status)s, %(data)s::jsonb, 0,
+    NOW(), %(occurred_at)s, %(ordering_key)s
+)
+ON CONFLICT (event_id, occurred_at) DO NOTHING
+RETURNING id, created_at
+"""
+# Retries: claim a batch of failed events whose next attempt is due (back to
+# pending); concurrent claimers skip each other's rows
+CLAIM_DUE_WEBHOOK_EVENTS_SQL = """
+UPDATE webhook_events
+SET status = 'pending'
+WHERE (id, occurred_at) IN (
+    SELECT id, occurred_at FROM webhook_events
+    WHERE status = 'failed' AND next_attempt_at <= NOW()
+    ORDER BY next_attempt_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+AND status = 'failed'
+RETURNING ordering_key
+"""
+
+
 class StripeService:
     """Сервис для работы с Stripe"""
     
@@ -21,14 +131,14 @@ class StripeService:
     def create_customer(user) -> Optional[str]:
         """Создает клиента в Stripe"""
         try:
-            customer = stripe.Customer.create(
-                email=user.email,
-                name=user.get_full_name() or user.username,
-                metadata={
+            customer = get_client().v1.customers.create(params={
+                'email': user.email,
+                'name': user.get_full_name() or user.username,
+                'metadata': {
                     'user_id': user.id,
                     'username': user.username
                 }
-            )
+            })
             return customer.id
         except stripe.error.StripeError as e:
             logger.error(f"Error creating Stripe customer: {e}")
@@ -86,6 +196,19 @@ class StripeService:
                     "quantity": 1,
                 })
 
+            # Tax quoted at order creation (apps.payment.rates)
+            if order.tax_amount > 0:
+                line_items.append({
+                    "price_data": {
+                        "currency": "usd",
+                        "unit_amount": int(order.tax_amount * 100),
+                        "product_data": {
+                            "name": "Tax",
+                        },
+                    },
+                    "quantity": 1,
+                })
+
             # Session metadata
             session_params = {
                 "customer": user.stripe_customer_id,
@@ -111,15 +234,9 @@ class StripeService:
                         order_amount = order.subtotal - order.discount_amount
                         discount = coupon.calculate_discount(order_amount)
 
-                        # Create a Stripe coupon for this order
-                        stripe_coupon = stripe.Coupon.create(
-                            amount_off=int(discount * 100),  # Convert to cents
-                            currency='usd',
-                            duration='once',
-                            name=f"Order {order.order_number} - {coupon_code}"
-                        )
+                        # Stripe coupon for this discount (created once, then reused)
                         session_params['discounts'] = [{
-                            'coupon': stripe_coupon.id
+                            'coupon': StripeCouponService.stripe_coupon_id(coupon, discount)
                         }]
                         # Add coupon info to metadata for webhook processing
                         session_params['metadata']['coupon_code'] = coupon_code
@@ -127,7 +244,7 @@ class StripeService:
                 except Coupon.DoesNotExist:
                     pass
 
-            session = stripe.checkout.Session.create(**session_params)
+            session = get_client().v1.checkout.sessions.create(params=session_params)
 
             return {
                 'checkout_url': session.url,
@@ -156,7 +273,7 @@ class StripeService:
             if amount:
                 refund_data['amount'] = int(amount * 100)
 
-            refund = stripe.Refund.create(**refund_data)
+            refund = get_client().v1.refunds.create(params=refund_data)
             
             return refund.status == 'succeeded'
 
@@ -168,7 +285,7 @@ class StripeService:
     def retrieve_session(session_id: str) -> Optional[Dict]:
         """Get info about session"""
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = get_client().v1.checkout.sessions.retrieve(session_id)
             return {
                 'status': session.payment_status,
                 'payment_intent': session.payment_intent,
@@ -180,60 +297,479 @@ class StripeService:
             return None
 
 
+class StripeCouponService:
+    """
+    Stripe coupon objects for our coupons (StripeCoupon), one per coupon and
+    discount amount, created lazily on first checkout or ahead of time by
+    the sync_stripe_coupons task and reused afterwards.
+    """
+
+    @staticmethod
+    def stripe_coupon_id(coupon, discount: Decimal) -> str:
+        """Stripe coupon giving discount with coupon (raises StripeError when it can't be created)"""
+        amount_off = int(discount * 100)  # Convert to cents
+        stripe_coupon_id = StripeCoupon.objects.filter(
+            coupon=coupon, amount_off=amount_off
+        ).values_list('stripe_coupon_id', flat=True).first()
+        if stripe_coupon_id:
+            return stripe_coupon_id
+
+        # A concurrent checkout may have stored the same mapping first: the
+        # unique constraint keeps one, and every checkout uses that one
+        StripeCoupon.objects.bulk_create(
+            [StripeCouponService._create(coupon, amount_off)], ignore_conflicts=True
+        )
+        return StripeCoupon.objects.filter(
+            coupon=coupon, amount_off=amount_off
+        ).values_list('stripe_coupon_id', flat=True).get()
+
+    @staticmethod
+    def _create(coupon, amount_off: int) -> StripeCoupon:
+        """
+        Create the Stripe coupon. The idempotency key is per attempt (the SDK
+        reuses it for its own retries): a deterministic one would hand back a
+        coupon deleted or created with another name within Stripe's 24h window.
+        """
+        created = get_client().v1.coupons.create(
+            params={
+                'amount_off': amount_off,
+                'currency': 'usd',
+                'duration': 'once',
+                'name': coupon.code[:40],
+                'metadata': {'coupon_id': coupon.id, 'coupon_code': coupon.code},
+            },
+            options={'idempotency_key': f"coupon-{coupon.id}-{uuid.uuid4()}"}
+        )
+        return StripeCoupon(coupon=coupon, amount_off=amount_off, stripe_coupon_id=created.id)
+
+    @staticmethod
+    def sync() -> int:
+        """
+        Create the missing Stripe coupons for active fixed-amount coupons
+        (their full value) and store them in one INSERT. Percentage coupons
+        depend on the order amount and are created on first use.
+        Returns the number of Stripe coupons created.
+        """
+        coupons = Coupon.objects.filter(
+            is_active=True, discount_type='fixed', valid_to__gt=timezone.now()
+        ).order_by('id')
+        existing = set(StripeCoupon.objects.filter(
+            coupon__in=coupons
+        ).values_list('coupon_id', 'amount_off'))
+
+        created = []
+        for coupon in coupons:
+            amount_off = int(coupon.discount_value * 100)
+            if (coupon.id, amount_off) in existing:
+                continue
+            try:
+                created.append(StripeCouponService._create(coupon, amount_off))
+            except stripe.error.StripeError as e:
+                logger.error(f"Error syncing coupon {coupon.code} to Stripe: {e}")
+
+        StripeCoupon.objects.bulk_create(created, ignore_conflicts=True)
+        return len(created)
+
+
+class ReservationService:
+    """
+    Stock holds for unpaid orders.
+
+    Placing an order reserves its lines (reserved_quantity counters) with
+    an expiry; payment commits the holds into a permanent decrement, and
+    cancellation or the expiry sweep releases them.
+    """
+
+    @staticmethod
+    def _lines(reservations) -> list:
+        return [(r.product_id, r.variant_id, r.quantity) for r in reservations]
+
+    @staticmethod
+    def reserve(order, lines: Iterable[StockLine]) -> None:
+        """Hold stock for the order's lines (raises InsufficientStockError)"""
+        lines = list(lines)
+        with transaction.atomic():
+            InventoryService.reserve_stock(lines)
+            expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+            StockReservation.objects.bulk_create([
+                StockReservation(
+                    order=order, product_id=product_id, variant_id=variant_id,
+                    quantity=quantity, expires_at=expires_at
+                )
+                for product_id, variant_id, quantity in lines
+            ])
+
+    @staticmethod
+    def commit(order) -> None:
+        """
+        Turn the order's holds into a permanent stock decrement (paid order).
+        Holds that already expired are taken from available stock instead.
+        Orders without holds (placed before reservations) are left alone,
+        their stock was taken when they were created.
+        """
+        with transaction.atomic():
+            reservations = list(
+                order.reservations.select_for_update().exclude(status='committed')
+            )
+            active = [r for r in reservations if r.status == 'active']
+            expired = [r for r in reservations if r.status == 'released']
+
+            if active:
+                InventoryService.commit_reserved(ReservationService._lines(active), order.order_number)
+            if expired:
+                try:
+                    InventoryService.decrement_stock(ReservationService._lines(expired), order.order_number)
+                except InsufficientStockError as e:
+                    # Paid after the hold expired and the stock is gone: keep the
+                    # payment, leave the holds released and let staff resolve it
+                    logger.error(
+                        f"Order {order.order_number} paid after its stock hold expired, "
+                        f"insufficient stock for {e.shortages}"
+                    )
+                    expired = []
+
+            committed = active + expired
+            if committed:
+                order.reservations.filter(
+                    id__in=[r.id for r in committed]
+                ).update(status='committed', updated_at=timezone.now())
+
+    @staticmethod
+    def release(order) -> None:
+        """
+        Give back the order's stock (cancelled order): drop active holds,
+        restore committed ones. Orders without holds restore their items.
+        """
+        with transaction.atomic():
+            reservations = list(order.reservations.select_for_update())
+            active = [r for r in reservations if r.status == 'active']
+            committed = [r for r in reservations if r.status == 'committed']
+
+            if active:
+                InventoryService.release_reserved(ReservationService._lines(active))
+            if committed:
+                InventoryService.restore_stock(ReservationService._lines(committed), order.order_number)
+            if not reservations:
+                InventoryService.restore_stock(
+                    order.items.values_list('product_id', 'variant_id', 'quantity'),
+                    order.order_number
+                )
+
+            if active or committed:
+                order.reservations.filter(
+                    id__in=[r.id for r in active + committed]
+                ).update(status='released', updated_at=timezone.now())
+
+    @staticmethod
+    def release_expired(batch_size: int) -> int:
+        """
+        Release one chunk of expired holds.
+        Rows locked by a concurrent commit/release are skipped (SKIP LOCKED)
+        and picked up by a later sweep if still active.
+        """
+        with transaction.atomic():
+            reservations = list(
+                StockReservation.objects.select_for_update(skip_locked=True).filter(
+                    status='active', expires_at__lte=timezone.now()
+                ).order_by('expires_at')[:batch_size]
+            )
+            if not reservations:
+                return 0
+
+            InventoryService.release_reserved(ReservationService._lines(reservations))
+            StockReservation.objects.filter(
+                id__in=[r.id for r in reservations]
+            ).update(status='released', updated_at=timezone.now())
+        return len(reservations)
+
+
+class PendingOrderExpiryService:
+    """
+    Cancels orders left unpaid for PENDING_ORDER_EXPIRY_DAYS, a chunk at a
+    time with set-based statements instead of one transaction per order.
+    """
+    NOTES = 'Cancelled automatically: not paid in time'
+
+    @staticmethod
+    def expire_batch(cutoff: datetime, batch_size: int) -> int:
+        """
+        Cancel up to batch_size pending orders created before cutoff and
+        give their stock back, in one transaction. The status flip is the
+        checkpoint: an order is cancelled (and its stock released) by
+        exactly one run, orders locked elsewhere are left for a later one.
+        Returns the number of orders cancelled.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(CANCEL_STALE_ORDERS_SQL, [cutoff, batch_size])
+                orders = dict(cursor.fetchall())
+            if not orders:
+                return 0
+            order_ids = sorted(orders)
+
+            # Orders placed before reservations hold no stock: restore their items
+            with_holds = set(
+                StockReservation.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True)
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(RELEASE_ORDER_HOLDS_SQL, [order_ids])
+                held = cursor.fetchall()
+            if held:
+                InventoryService.release_reserved(held)
+            for order_id in order_ids:
+                if order_id not in with_holds:
+                    InventoryService.restore_stock(
+                        OrderItem.objects.filter(order_id=order_id).values_list(
+                            'product_id', 'variant_id', 'quantity'
+                        ),
+                        orders[order_id]
+                    )
+
+            OrderStatusHistory.objects.bulk_create([
+                OrderStatusHistory(order_id=order_id, status='cancelled', notes=PendingOrderExpiryService.NOTES)
+                for order_id in order_ids
+            ])
+            emit_many(order_ids, ORDER_CANCELLED, reason='Not paid in time')
+        return len(order_ids)
+
+
+class OrderSnapshotService:
+    """
+    Pre-rendered order documents for paid orders.
+    Items, prices and addresses no longer change once an order is paid, so
+    the detail endpoint serves the stored document instead of re-joining
+    items, products, images, variants, address and history on every read.
+    """
+
+    @staticmethod
+    def refresh(order: Order) -> Optional[Dict]:
+        """Render and store the order document (paid orders only); returns it"""
+        if not order.is_paid:
+            return None
+
+        from .serializers import OrderSerializer
+        document = Order.objects.select_related('shipping_address').prefetch_related(
+            'items__product__images',
+            'items__variant',
+            'status_history__changed_by'
+        ).get(pk=order.pk)
+        snapshot = OrderSerializer(document).data
+        Order.objects.filter(pk=order.pk).update(snapshot=snapshot)
+        # Keep the caller's instance in step so a later save() doesn't revert it
+        order.snapshot = snapshot
+        return snapshot
+
+
+class OrderArchiveService:
+    """
+    Moves finished orders (delivered, cancelled, refunded) with their items,
+    status history and payments out of the hot tables into ArchivedOrder,
+    so the orders tables only grow with recent activity.
+
+    Archived payments can no longer be found by Stripe session or payment
+    intent, so paid orders stay until STRIPE_DISPUTE_WINDOW_DAYS after
+    payment: refund and dispute webhooks only arrive within that window.
+    """
+    ARCHIVED_STATUSES = ['delivered', 'cancelled', 'refunded']
+
+    @staticmethod
+    def archive_batch(cutoff: datetime, batch_size: int) -> int:
+        """
+        Archive up to batch_size finished orders not updated since cutoff
+        (and, if paid, past the dispute window), in one transaction. Orders
+        locked elsewhere or with order events still pending are left for a
+        later run.
+        Returns the number of orders archived.
+        """
+        from .serializers import OrderSerializer
+
+        disputable_since = timezone.now() - timedelta(days=settings.STRIPE_DISPUTE_WINDOW_DAYS)
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('shipping_address')
+                .prefetch_related(
+                    'items__product__images',
+                    'items__variant',
+                    'status_history__changed_by'
+                )
+                .filter(status__in=OrderArchiveService.ARCHIVED_STATUSES, updated_at__lt=cutoff)
+                .exclude(paid_at__gte=disputable_since)
+                .exclude(events__status='pending')
+                .order_by('id')[:batch_size]
+            )
+            if not orders:
+                return 0
+
+            order_ids = [order.id for order in orders]
+            payments = defaultdict(list)
+            for payment in Payment.objects.filter(order_id__in=order_ids).order_by('id').values():
+                payments[payment['order_id']].append(payment)
+
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    id=order.id,
+                    order_number=order.order_number,
+                    user_id=order.user_id,
+                    status=order.status,
+                    is_paid=order.is_paid,
+                    total=order.total,
+                    item_count=order.item_count,
+                    title=order.title,
+                    thumbnail=order.thumbnail,
+                    created_at=order.created_at,
+                    document=ArchivedOrder.compress({
+                        'order': OrderSerializer(order).data,
+                        'payments': payments[order.id],
+                    }),
+                )
+                for order in orders
+            ])
+            # Cascades to items, history, payments, reservations and events;
+            # coupon usages stay (order set to NULL)
+            Order.objects.filter(id__in=order_ids).delete()
+
+        return len(orders)
+
+
+class SalesRollupService:
+    """
+    Daily per-product sales (SalesRollup) for reporting, maintained from
+    order events so reports never scan orders and order items.
+    An order counts on the day it was paid: order.paid adds its lines,
+    order.cancelled / order.refunded take them back out.
+    """
+
+    @staticmethod
+    def record(order: Order, sign: int) -> bool:
+        """
+        Add (sign=1) or remove (sign=-1) the order's lines.
+        Idempotent: Order.in_sales_rollup flips in the same transaction,
+        so redelivered events are no-ops. Returns whether anything changed.
+        """
+        with transaction.atomic():
+            flipped = Order.objects.filter(
+                pk=order.pk, in_sales_rollup=sign < 0
+            ).update(in_sales_rollup=sign > 0)
+            if not flipped:
+                return False
+
+            paid_at = order.paid_at or order.created_at
+            with connection.cursor() as cursor:
+                cursor.execute(RECORD_SALES_SQL, {
+                    'date': timezone.localdate(paid_at),
+                    'sign': sign,
+                    'order_id': order.pk,
+                })
+        return True
+
+    @staticmethod
+    def rebuild(date_from, date_to) -> int:
+        """
+        Recompute the rollups for paid days date_from..date_to (inclusive)
+        from orders and archived orders. Returns the number of rollup rows.
+        """
+        from django.utils.dateparse import parse_datetime
+        from apps.main.models import Product
+
+        params = {
+            'tz': timezone.get_current_timezone_name(),
+            'date_from': date_from,
+            'date_to': date_to,
+        }
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Hold off event handlers until the range is consistent again
+            cursor.execute("LOCK TABLE sales_rollups IN SHARE ROW EXCLUSIVE MODE")
+            SalesRollup.objects.filter(date__range=(date_from, date_to)).delete()
+            cursor.execute(MARK_COUNTED_ORDERS_SQL, params)
+            cursor.execute(REBUILD_SALES_SQL, params)
+
+            # Archived orders: only their compressed documents have the lines.
+            # Orders are paid within PENDING_ORDER_EXPIRY_DAYS of creation (or
+            # cancelled), so older ones can't have been paid in the range
+            archived = defaultdict(lambda: [Decimal('0'), 0, 0])
+            for row in ArchivedOrder.objects.filter(
+                status='delivered', is_paid=True,
+                created_at__date__gte=date_from - timedelta(days=settings.PENDING_ORDER_EXPIRY_DAYS),
+                created_at__date__lte=date_to
+            ).only('document').iterator(chunk_size=500):
+                order = row.data['order']
+                paid_day = timezone.localdate(parse_datetime(order['paid_at'] or order['created_at']))
+                if not date_from <= paid_day <= date_to:
+                    continue
+                for product_id in {item['product']['id'] for item in order['items']}:
+                    archived[(paid_day, product_id)][2] += 1
+                for item in order['items']:
+                    totals = archived[(paid_day, item['product']['id'])]
+                    totals[0] += Decimal(item['total_price'])
+                    totals[1] += item['quantity']
+
+            products = Product.objects.only('category_id', 'brand_id').in_bulk(
+                {product_id for _, product_id in archived}
+            )
+            cursor.executemany(ADD_SALES_SQL, [
+                (day, product_id, products[product_id].category_id, products[product_id].brand_id,
+                 revenue, units, orders)
+                for (day, product_id), (revenue, units, orders) in archived.items()
+                if product_id in products
+            ])
+        return SalesRollup.objects.filter(date__range=(date_from, date_to)).count()
+
+
 class PaymentService:
     """Main service for payment processing"""
 
     @staticmethod
     def process_successful_payment(payment: Payment, session_metadata: dict = None) -> bool:
-        """Handle successful payment"""
+        """
+        Handle successful payment. The order change, its history, snapshot
+        and order.paid event commit together, or not at all (webhook retry).
+        """
         try:
-            payment.mark_as_succeeded()
-
-            # Update order status
-            order = payment.order
-            if not order.is_paid:
-                from django.utils import timezone
-                order.is_paid = True
-                order.paid_at = timezone.now()
-                order.status = 'paid'
-
-                # Apply coupon to order if it was in the session metadata
-                if session_metadata and 'coupon_code' in session_metadata and 'coupon_discount' in session_metadata:
-                    from .models import Coupon, CouponUsage
-                    try:
-                        coupon = Coupon.objects.get(code=session_metadata['coupon_code'], is_active=True)
-                        if coupon.is_valid:
-                            order.coupon = coupon
-                            order.coupon_code = coupon.code
-                            order.coupon_discount = Decimal(session_metadata['coupon_discount'])
-
-                            # Recalculate total with coupon
-                            order_amount = order.subtotal - order.discount_amount
-                            order.total = order_amount + order.shipping_cost + order.tax_amount - order.coupon_discount
-
-                            # Increment coupon usage count
-                            coupon.used_count += 1
-                            coupon.save()
-
-                            # Create coupon usage record
-                            CouponUsage.objects.create(
-                                coupon=coupon,
-                                user=order.user,
-                                order=order,
-                                discount_amount=order.coupon_discount
-                            )
-                    except Coupon.DoesNotExist:
-                        logger.warning(f"Coupon {session_metadata.get('coupon_code')} not found during payment processing")
-
-                order.save()
-
-                # Add to order status history
-                OrderStatusHistory.objects.create(
-                    order=order,
-                    status='paid',
-                    notes='Payment completed successfully',
-                    changed_by=order.user
-                )
+            with transaction.atomic():
+                payment.mark_as_succeeded()
+
+                # Lock the order so concurrent deliveries can't both apply the payment
+                order = Order.objects.select_for_update().get(pk=payment.order_id)
+                payment.order = order
+                if not order.is_paid:
+                    order.is_paid = True
+                    order.paid_at = timezone.now()
+                    order.status = 'paid'
+
+                    # Apply coupon to order if it was in the session metadata
+                    if session_metadata and 'coupon_code' in session_metadata and 'coupon_discount' in session_metadata:
+                        from .models import Coupon
+                        try:
+                            coupon = Coupon.objects.get(code=session_metadata['coupon_code'], is_active=True)
+                            if coupon.is_valid:
+                                order.coupon = coupon
+                                order.coupon_code = coupon.code
+                                order.coupon_discount = Decimal(session_metadata['coupon_discount'])
+
+                                # Recalculate total with coupon (usage is counted by the order.paid event)
+                                order_amount = order.subtotal - order.discount_amount
+                                order.total = order_amount + order.shipping_cost + order.tax_amount - order.coupon_discount
+                        except Coupon.DoesNotExist:
+                            logger.warning(f"Coupon {session_metadata.get('coupon_code')} not found during payment processing")
+
+                    # Held stock becomes a permanent decrement
+                    ReservationService.commit(order)
+                    # Only the fields changed here: event handlers update in_sales_rollup/snapshot
+                    order.save(update_fields=[
+                        'is_paid', 'paid_at', 'status', 'coupon', 'coupon_code', 'coupon_discount', 'total',
+                        'updated_at'
+                    ])
+
+                    # Add to order status history
+                    OrderStatusHistory.objects.create(
+                        order=order,
+                        status='paid',
+                        notes='Payment completed successfully',
+                        changed_by=order.user
+                    )
+                    OrderSnapshotService.refresh(order)
+                    emit(order, ORDER_PAID)
 
             logger.info(f"Payment {payment.id} processed successfully")
             return True
@@ -244,23 +780,30 @@ class PaymentService:
 
     @staticmethod
     def process_failed_payment(payment: Payment, reason: str = "") -> bool:
-        """Handle failed payment"""
+        """
+        Handle failed payment. The cancellation, its history and the
+        order.cancelled event commit together.
+        """
         try:
-            payment.mark_as_failed(reason)
-
-            # Update order status to reflect payment failure
-            order = payment.order
-            if order.status == 'pending':
-                order.status = 'cancelled'
-                order.save()
-
-                # Add to order status history
-                OrderStatusHistory.objects.create(
-                    order=order,
-                    status='cancelled',
-                    notes=f'Payment failed: {reason}',
-                    changed_by=order.user
-                )
+            with transaction.atomic():
+                payment.mark_as_failed(reason)
+
+                # Update order status to reflect payment failure
+                order = Order.objects.select_for_update().get(pk=payment.order_id)
+                payment.order = order
+                if order.status == 'pending':
+                    ReservationService.release(order)
+                    order.status = 'cancelled'
+                    order.save(update_fields=['status', 'updated_at'])
+
+                    # Add to order status history
+                    OrderStatusHistory.objects.create(
+                        order=order,
+                        status='cancelled',
+                        notes=f'Payment failed: {reason}',
+                        changed_by=order.user
+                    )
+                    emit(order, ORDER_CANCELLED, reason=f'Payment failed: {reason}')
 
             logger.info(f"Payment {payment.id} marked as failed")
             return True
@@ -274,44 +817,151 @@ class WebhookService:
     """Service for webhook events"""
 
     @staticmethod
-    def process_stripe_webhook(event_data: Dict) -> bool:
-        """Handle Stripe webhook"""
-        try:
-            event_id = event_data.get('id')
-            event_type = event_data.get('type')
+    def occurred_at(event_data: Dict) -> datetime:
+        """When Stripe created the event (the same on every redelivery)"""
+        created = event_data.get('created')
+        if isinstance(created, (int, float)):
+            return datetime.fromtimestamp(created, tz=dt_timezone.utc)
+        return timezone.now()
 
-            # If this event already handled
-            if WebhookEvent.objects.filter(event_id=event_id).exists():
-                return True
+    @staticmethod
+    def ordering_key(event_data: Dict) -> str:
+        """
+        Key serializing an event with related ones: its order when the
+        object carries order_id metadata (checkout sessions), else its
+        payment intent, else the object itself
+        """
+        obj = (event_data.get('data') or {}).get('object') or {}
+        order_id = (obj.get('metadata') or {}).get('order_id')
+        if order_id:
+            return f"order:{order_id}"
+        if obj.get('payment_intent'):
+            return f"payment_intent:{obj['payment_intent']}"
+        if obj.get('id'):
+            return f"{obj.get('object', 'object')}:{obj['id']}"
+        return f"event:{event_data.get('id')}"
 
-            webhook_event = WebhookEvent.objects.create(
-                provider='stripe',
-                event_id=event_id,
-                event_type=event_type,
-                data=event_data
+    @staticmethod
+    def receive(event_data: Dict, provider: str = 'stripe') -> Optional[WebhookEvent]:
+        """
+        Store a verified event for asynchronous processing in one
+        INSERT ... ON CONFLICT DO NOTHING: of concurrent deliveries of an
+        event only the winning insert gets a row back. Returns None for a
+        redelivery of an event already stored.
+        """
+        webhook_event = WebhookEvent(
+            provider=provider,
+            event_id=event_data.get('id'),
+            event_type=event_data.get('type'),
+            status='pending',
+            data=event_data,
+            occurred_at=WebhookService.occurred_at(event_data),
+            ordering_key=WebhookService.ordering_key(event_data)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_WEBHOOK_EVENT_SQL, {
+                'provider': webhook_event.provider,
+                'event_id': webhook_event.event_id,
+                'event_type': webhook_event.event_type,
+                'status': webhook_event.status,
+                'data': json.dumps(event_data, cls=DjangoJSONEncoder),
+                'occurred_at': webhook_event.occurred_at,
+                'ordering_key': webhook_event.ordering_key,
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        webhook_event.id, webhook_event.created_at = row
+        return webhook_event
+
+    @staticmethod
+    def claim_due(batch_size: int) -> list:
+        """
+        Put up to batch_size failed events due for a retry back to pending
+        in one UPDATE ... RETURNING (rows claimed by a concurrent worker are
+        skipped). Returns the ordering key of each claimed event.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(CLAIM_DUE_WEBHOOK_EVENTS_SQL, [batch_size])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """
+        Seconds before retrying after `attempts` failures: WEBHOOK_RETRY_DELAY
+        doubled per attempt (capped at WEBHOOK_RETRY_MAX_DELAY), half of it
+        random so events failing together don't retry together
+        """
+        delay = min(settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX_DELAY)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def queue(ordering_key: str) -> None:
+        """Ask a webhooks worker to process the key's events; the periodic sweep is the fallback"""
+        from .tasks import process_webhook_events
+        try:
+            with process_webhook_events.app.connection_for_write() as conn:
+                # Fail fast when the broker is down instead of stalling the response
+                conn.ensure_connection(max_retries=0)
+                process_webhook_events.apply_async(
+                    args=[ordering_key], connection=conn, retry=False, ignore_result=True
+                )
+        except Exception as e:
+            # The event is stored; queue_pending_webhook_events picks it up
+            logger.warning(f"Could not queue webhook processing for {ordering_key}: {e}")
+
+    @staticmethod
+    def process_pending(ordering_key: str) -> int:
+        """
+        Process the key's pending events in occurred_at order.
+        A session advisory lock on the key makes concurrent workers for the
+        same key wait their turn, while other keys proceed in parallel.
+        Returns the number of events processed.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(LOCK_ORDERING_KEY_SQL, [ordering_key])
+        try:
+            events = list(
+                WebhookEvent.objects.filter(ordering_key=ordering_key, status='pending')
+                .order_by('occurred_at', 'id')
             )
+            for webhook_event in events:
+                WebhookService.process(webhook_event)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(UNLOCK_ORDERING_KEY_SQL, [ordering_key])
+        return len(events)
 
-            success = False
-            
+    @staticmethod
+    def process(webhook_event: WebhookEvent) -> bool:
+        """Run the handler for a stored event and record the outcome"""
+        event_data = webhook_event.data
+        event_type = webhook_event.event_type
+        webhook_event.attempts += 1
+        error = "Processing failed"
+        try:
             if event_type == 'checkout.session.completed':
-                success = WebhookService._handle_checkout_completed(event_data)                
+                success = WebhookService._handle_checkout_completed(event_data)
             elif event_type == 'charge.dispute.created':
                 success = WebhookService._handle_dispute_created(event_data)
             else:
                 webhook_event.status = 'ignored'
                 webhook_event.save()
                 return True
-
-            if success:
-                webhook_event.mark_as_processed()
-            else:
-                webhook_event.mark_as_failed("Processing failed")
-
-            return success
-
         except Exception as e:
-            logger.error(f"Error processing Stripe webhook: {e}")
-            return False
+            logger.error(f"Error processing Stripe webhook {webhook_event.event_id}: {e}")
+            error = str(e)
+            success = False
+
+        if success:
+            webhook_event.mark_as_processed()
+        elif webhook_event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            logger.error(f"Webhook event {webhook_event.event_id} dead-lettered after {webhook_event.attempts} attempts")
+            webhook_event.mark_as_failed(error)
+        else:
+            delay = WebhookService.retry_delay(webhook_event.attempts)
+            webhook_event.mark_as_failed(error, retry_at=timezone.now() + timedelta(seconds=delay))
+        return success
 
     @staticmethod
     def _handle_checkout_completed(event_data: Dict) -> bool:
@@ -0,0 +1,221 @@
+"""
+Outbound Stripe API calls.
+
+get_client() returns this process's StripeClient. Its HTTP client keeps a
+pooled keep-alive session (STRIPE_POOL_SIZE connections) with
+STRIPE_CONNECT_TIMEOUT / STRIPE_READ_TIMEOUT, and the SDK retries connection
+errors, 409s and 5xx up to STRIPE_MAX_NETWORK_RETRIES times, sending an
+Idempotency-Key with every POST so a retried request is not applied twice.
+
+Every attempt first passes a circuit breaker (after STRIPE_BREAKER_FAILURES
+consecutive connection errors or 5xx responses, calls fail fast for
+STRIPE_BREAKER_RESET_TIMEOUT seconds, then one trial call decides) and takes
+a token from a Redis token bucket shared by all processes
+(STRIPE_RATE_LIMIT_PER_SECOND, bursts of STRIPE_RATE_LIMIT_BURST). Both
+raise StripeUnavailable, a stripe.APIConnectionError, so callers handle it
+like any other Stripe outage.
+
+Point STRIPE_API_BASE at a local fake (e.g. stripe-mock) to run against it.
+"""
+import logging
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'stripe:ratelimit'
+
+# Refill the bucket for the time elapsed (Redis clock, shared by all
+# processes) and take a token; returns the seconds to wait when empty
+TAKE_TOKEN_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class StripeUnavailable(stripe.APIConnectionError):
+    """Stripe call refused locally: circuit open or outbound rate limit reached"""
+
+
+class CircuitBreaker:
+    """Per-process breaker: closed -> open after repeated failures -> one trial call"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self) -> bool:
+        """
+        Raise StripeUnavailable while open; let one trial call through after
+        the timeout. Returns whether this call is the trial.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise StripeUnavailable("Stripe circuit breaker is open, failing fast")
+            self._trial = True
+            return True
+
+    def cancel_trial(self) -> None:
+        """The trial call never reached Stripe: let the next call be the trial"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            # A failed trial call re-opens for another reset_timeout
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial:
+                    logger.error(f"Stripe circuit breaker opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class TokenBucket:
+    """Outbound request budget shared by every process through Redis"""
+
+    def __init__(self, key: str, rate: float, burst: int, max_wait: float):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._script = None
+
+    def acquire(self) -> None:
+        """
+        Take a token, waiting up to max_wait for one (StripeUnavailable past
+        that). Without Redis, requests go through unthrottled.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            try:
+                if self._script is None:
+                    self._script = get_redis().register_script(TAKE_TOKEN_LUA)
+                wait = float(self._script(keys=[self.key], args=[self.rate, self.burst]))
+            except RedisError as e:
+                logger.warning(f"Stripe rate limiter unavailable, not throttling: {e}")
+                return
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise StripeUnavailable("Outbound Stripe rate limit reached")
+            time.sleep(wait)
+
+
+class GatewayHTTPClient(stripe.RequestsClient):
+    """RequestsClient passing every attempt through the breaker and the bucket"""
+
+    def __init__(self, breaker: CircuitBreaker, bucket: TokenBucket, **kwargs):
+        super().__init__(**kwargs)
+        self.breaker = breaker
+        self.bucket = bucket
+
+    def request(self, method, url, headers, post_data=None):
+        return self._guarded(super().request, method, url, headers, post_data)
+
+    def request_stream(self, method, url, headers, post_data=None):
+        return self._guarded(super().request_stream, method, url, headers, post_data)
+
+    def _guarded(self, send, *args):
+        trial = self.breaker.before_call()
+        succeeded = None
+        try:
+            self.bucket.acquire()
+            try:
+                response = send(*args)
+            except stripe.APIConnectionError:
+                succeeded = False
+                raise
+            succeeded = response[1] < 500
+            return response
+        finally:
+            # Every outcome settles the trial, including not reaching Stripe
+            # at all (rate limited, unexpected error)
+            if succeeded is None:
+                if trial:
+                    self.breaker.cancel_trial()
+            elif succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+
+def pooled_session(pool_size: int) -> requests.Session:
+    """Keep-alive session reusing up to pool_size connections per host"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def build_client() -> stripe.StripeClient:
+    http_client = GatewayHTTPClient(
+        breaker=CircuitBreaker(settings.STRIPE_BREAKER_FAILURES, settings.STRIPE_BREAKER_RESET_TIMEOUT),
+        bucket=TokenBucket(
+            RATE_LIMIT_KEY,
+            settings.STRIPE_RATE_LIMIT_PER_SECOND,
+            settings.STRIPE_RATE_LIMIT_BURST,
+            settings.STRIPE_RATE_LIMIT_MAX_WAIT
+        ),
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        session=pooled_session(settings.STRIPE_POOL_SIZE),
+    )
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        base_addresses={'api': settings.STRIPE_API_BASE},
+    )
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client() -> stripe.StripeClient:
+    """This process's Stripe client (created on first use, after any fork)"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = build_client()
+    return _client
@@ -1,23 +1,84 @@
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from .models import Payment, WebhookEvent, Order
+from .models import Payment, WebhookEvent
 
 @shared_task
-def cancel_old_pending_orders():
-    """Canceling old pending payments"""
-    cutoff_date = timezone.now() - timedelta(days=7)
-    
-    
-    old_orders = Order.objects.filter(
+def cancel_old_pending_orders(batch_size=None):
+    """Canceling orders left unpaid for PENDING_ORDER_EXPIRY_DAYS"""
+    from .services import PendingOrderExpiryService
+
+    batch_size = batch_size or settings.PENDING_ORDER_EXPIRY_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=settings.PENDING_ORDER_EXPIRY_DAYS)
+    cancelled = 0
+    while True:
+        count = PendingOrderExpiryService.expire_batch(cutoff, batch_size)
+        cancelled += count
+        if count < batch_size:
+            break
+
+    return {'cancelled_orders': cancelled}
+
+@shared_task
+def release_expired_reservations(batch_size=None):
+    """Releasing stock held by unpaid orders past their expiry"""
+    from .services import ReservationService
+
+    batch_size = batch_size or settings.STOCK_RESERVATION_BATCH_SIZE
+    released = 0
+    while True:
+        count = ReservationService.release_expired(batch_size)
+        released += count
+        if count < batch_size:
+            break
+
+    return {'released_reservations': released}
+
+@shared_task
+def archive_old_orders(batch_size=None):
+    """Moving finished orders untouched for ORDER_ARCHIVE_AFTER_DAYS to the archive"""
+    from .services import OrderArchiveService
+
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while True:
+        count = OrderArchiveService.archive_batch(cutoff, batch_size)
+        archived += count
+        if count < batch_size:
+            break
+
+    return {'archived_orders': archived}
+
+@shared_task
+def process_order_events(batch_size=None):
+    """Running handlers for pending order events (outbox)"""
+    from .events import dispatch
+
+    batch_size = batch_size or settings.ORDER_EVENT_BATCH_SIZE
+    dispatched = 0
+    while True:
+        count = dispatch(batch_size)
+        dispatched += count
+        if count < batch_size:
+            break
+
+    return {'dispatched_order_events': dispatched}
+
+@shared_task
+def cleanup_old_order_events():
+    """Deleting handled order events"""
+    from .models import OrderEvent
+
+    cutoff_date = timezone.now() - timedelta(days=30)
+
+    deleted_events, _ = OrderEvent.objects.filter(
         created_at__lt=cutoff_date,
-        status__in=['pending']
-    )
-    
-    for order in old_orders:
-        order.status = 'cancelled'
-    
-    return {'cancelled_orders': old_orders}
+        status='processed'
+    ).delete()
+
+    return {'deleted_order_events': deleted_events}
 
 @shared_task
 def cleanup_old_payments():
@@ -35,37 +96,72 @@ def cleanup_old_payments():
 
 @shared_task
 def cleanup_old_webhook_events():
-    """Deleting old webhook events"""
-    cutoff_date = timezone.now() - timedelta(days=30)
-    
-    old_events = WebhookEvent.objects.filter(
-        created_at__lt=cutoff_date,
-        status__in=['processed', 'ignored']
+    """
+    Dropping webhook event partitions past retention (whole months);
+    pending, failed and dead events are kept in the default partition
+    """
+    from .partitions import drop_partitions_before
+
+    cutoff_date = timezone.now() - timedelta(days=settings.WEBHOOK_EVENT_RETENTION_DAYS)
+    dropped = drop_partitions_before('webhook_events', cutoff_date)
+
+    return {'dropped_webhook_event_partitions': dropped}
+
+@shared_task
+def maintain_partitions():
+    """Pre-creating the coming monthly partitions of partitioned tables"""
+    from .partitions import PARTITIONED_TABLES, ensure_partitions
+
+    created = []
+    for table in PARTITIONED_TABLES:
+        created += ensure_partitions(table, settings.PARTITION_MONTHS_AHEAD)
+
+    return {'created_partitions': created}
+
+@shared_task
+def process_webhook_events(ordering_key):
+    """Processing stored webhook events of one ordering key (webhooks queue)"""
+    from .services import WebhookService
+
+    return {'processed_webhook_events': WebhookService.process_pending(ordering_key)}
+
+@shared_task
+def queue_pending_webhook_events():
+    """Re-queueing webhook events stored but not picked up (broker down, lost task)"""
+    from .services import WebhookService
+
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_REQUEUE_AFTER)
+    ordering_keys = list(
+        WebhookEvent.objects.filter(status='pending', created_at__lt=cutoff)
+        .order_by('ordering_key').values_list('ordering_key', flat=True).distinct()
     )
-    
-    deleted_events, _ = old_events.delete()
-    
-    return {'deleted_webhook_events': deleted_events}
+    for ordering_key in ordering_keys:
+        WebhookService.queue(ordering_key)
+
+    return {'queued_ordering_keys': len(ordering_keys)}
 
 @shared_task
-def retry_failed_webhook_events():
-    """Повторная обработка неудачных webhook событий"""
+def retry_failed_webhook_events(batch_size=None):
+    """Повторная обработка неудачных webhook событий, когда подошло время попытки"""
     from .services import WebhookService
-    
-    # Находим события, которые не удалось обработать в последние 24 часа
-    retry_cutoff = timezone.now() - timedelta(hours=24)
-    
-    failed_events = WebhookEvent.objects.filter(
-        status='failed',
-        created_at__gte=retry_cutoff
-    )[:50]  # Ограничиваем количество для повторной обработки
-    
-    processed_count = 0
-    
-    for event in failed_events:
-        success = WebhookService.process_stripe_webhook(event.data)
-        if success:
-            event.mark_as_processed()
-            processed_count += 1
-    
-    return {'reprocessed_events': processed_count}
\ No newline at end of file
+
+    # Claimed events are processed by the webhooks workers in parallel (per
+    # ordering key); several runs of this task can claim at the same time
+    batch_size = batch_size or settings.WEBHOOK_RETRY_BATCH_SIZE
+    claimed = 0
+    while True:
+        ordering_keys = WebhookService.claim_due(batch_size)
+        claimed += len(ordering_keys)
+        for ordering_key in dict.fromkeys(ordering_keys):
+            WebhookService.queue(ordering_key)
+        if len(ordering_keys) < batch_size:
+            break
+
+    return {'retried_webhook_events': claimed}
+
+@shared_task
+def sync_stripe_coupons():
+    """Creating Stripe coupons ahead of checkout for active fixed-amount coupons"""
+    from .services import StripeCouponService
+
+    return {'created_stripe_coupons': StripeCouponService.sync()}
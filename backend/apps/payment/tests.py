@@ -1,3 +1,89 @@
-from django.test import TestCase
+import time
 
-# Create your tests here.
+import stripe
+from django.test import SimpleTestCase
+
+from .stripe_gateway import CircuitBreaker, GatewayHTTPClient, StripeUnavailable
+
+
+class FakeBucket:
+    def __init__(self):
+        self.limited = False
+
+    def acquire(self):
+        if self.limited:
+            raise StripeUnavailable("Outbound Stripe rate limit reached")
+
+
+class HalfOpenTrialTests(SimpleTestCase):
+    """The breaker must let a new trial through whatever happened to the last one"""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        self.bucket = FakeBucket()
+        self.client = GatewayHTTPClient(breaker=self.breaker, bucket=self.bucket)
+        self.calls = 0
+        self.breaker.record_failure()
+        self.elapse()
+
+    def elapse(self):
+        """Pretend the breaker opened longer than reset_timeout ago"""
+        self.breaker._opened_at = time.monotonic() - self.breaker.reset_timeout - 1
+
+    def send(self, status=200):
+        self.calls += 1
+        return b'{}', status, {}
+
+    def fail(self):
+        self.calls += 1
+        raise stripe.APIConnectionError("connection refused")
+
+    def test_successful_trial_closes(self):
+        self.client._guarded(self.send)
+        self.assertFalse(self.breaker.is_open)
+        self.client._guarded(self.send)
+        self.assertEqual(self.calls, 2)
+
+    def test_failed_trial_reopens_then_allows_next_trial(self):
+        with self.assertRaises(stripe.APIConnectionError):
+            self.client._guarded(self.fail)
+        self.assertTrue(self.breaker.is_open)
+
+        # Fails fast until the timeout passes again
+        with self.assertRaises(StripeUnavailable):
+            self.client._guarded(self.send)
+        self.assertEqual(self.calls, 1)
+
+        self.elapse()
+        self.client._guarded(self.send)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_server_error_trial_reopens(self):
+        self.client._guarded(self.send, 503)
+        self.assertTrue(self.breaker.is_open)
+        self.elapse()
+        self.client._guarded(self.send)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_rate_limited_trial_releases_trial(self):
+        self.bucket.limited = True
+        with self.assertRaises(StripeUnavailable):
+            self.client._guarded(self.send)
+        self.assertEqual(self.calls, 0)
+        self.assertTrue(self.breaker.is_open)
+
+        # The trial never reached Stripe, so the next call gets to be the trial
+        self.bucket.limited = False
+        self.client._guarded(self.send)
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_unexpected_error_releases_trial(self):
+        def broken():
+            raise ValueError("bad response")
+
+        with self.assertRaises(ValueError):
+            self.client._guarded(broken)
+        self.client._guarded(self.send)
+        self.assertFalse(self.breaker.is_open)
@@ -13,6 +13,7 @@ urlpatterns = [
     # Order URLs
     path('orders/', views.OrderListView.as_view(), name='order-list'),
     path('orders/create/', views.OrderCreateView.as_view(), name='order-create'),
+    path('checkout/quote/', views.CheckoutQuoteView.as_view(), name='checkout-quote'),
     path('orders/<str:order_number>/', views.OrderDetailView.as_view(), name='order-detail'),
     path('orders/<str:order_number>/cancel/', views.OrderCancelView.as_view(), name='order-cancel'),
 
@@ -29,4 +30,6 @@ urlpatterns = [
 
     # Admin URLs
     path('admin/orders/<str:order_number>/status/', views.OrderUpdateStatusView.as_view(), name='order-update-status'),
+    path('admin/reports/sales/', views.SalesReportView.as_view(), name='sales-report'),
+    path('admin/exports/orders/', views.OrderExportView.as_view(), name='order-export'),
 ]
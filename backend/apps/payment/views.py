@@ -2,22 +2,34 @@ from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Sum
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.conf import settings
+import logging
 import stripe
-import json
 from .models import (
     ShippingAddress, Order, OrderItem, Payment,
-    Coupon, OrderStatusHistory
+    Coupon, OrderStatusHistory, ArchivedOrder, SalesRollup
 )
 from .serializers import (
-    ShippingAddressSerializer, OrderSerializer, OrderCreateSerializer,
-    CouponSerializer, CouponValidateSerializer, PaymentSerializer
+    ShippingAddressSerializer, OrderSerializer, OrderSummarySerializer, OrderCreateSerializer,
+    CouponSerializer, CouponValidateSerializer, PaymentSerializer, SalesReportQuerySerializer,
+    OrderExportQuerySerializer
 )
-from .services import StripeService, WebhookService, PaymentService
+from .services import (
+    StripeService, WebhookService, PaymentService, ReservationService, OrderSnapshotService
+)
+from .idempotency import idempotent
+from . import rates
+from apps.cart.storage import get_cart_store
+from .events import emit, emit_status_event, ORDER_CANCELLED
+from .exports import csv_lines, export_filters, export_records, jsonl_lines
+
+logger = logging.getLogger(__name__)
 
 # ==================== Shipping Address Views ====================
 
@@ -103,34 +115,63 @@ class ShippingAddressSetDefaultView(APIView):
 # ==================== Order Views ====================
 
 class OrderListView(generics.ListAPIView):
-    """List user's orders with optional status filtering"""
-    serializer_class = OrderSerializer
+    """
+    List user's orders with optional status filtering.
+    Compact summaries read from the orders row alone; items, address and
+    history are served by the order detail. Archived orders are listed
+    alongside (one UNION query).
+    """
+    serializer_class = OrderSummarySerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Order.objects.filter(
-            user=self.request.user
-        ).prefetch_related(
-            'items__product',
-            'items__variant',
-            'shipping_address',
-            'status_history'
-        ).order_by('-created_at')
+        fields = OrderSummarySerializer.Meta.fields
+        orders = Order.objects.filter(user=self.request.user)
+        archived = ArchivedOrder.objects.filter(user=self.request.user)
 
         # Filter by status if provided
         status_filter = self.request.query_params.get('status', None)
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            orders = orders.filter(status=status_filter)
+            archived = archived.filter(status=status_filter)
 
-        return queryset
+        return orders.values(*fields).union(
+            archived.values(*fields), all=True
+        ).order_by('-created_at')
 
 
 class OrderDetailView(generics.RetrieveAPIView):
-    """Get order details"""
+    """
+    Get order details.
+    Paid orders are served from their stored snapshot (one row, no joins);
+    unpaid orders are rendered from the live tables and archived orders
+    from their archived document.
+    """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'order_number'
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            order = Order.objects.only('is_paid', 'snapshot').get(
+                order_number=kwargs['order_number'],
+                user=request.user
+            )
+        except Order.DoesNotExist:
+            archived = get_object_or_404(
+                ArchivedOrder.objects.only('document'),
+                order_number=kwargs['order_number'],
+                user=request.user
+            )
+            return Response(archived.data['order'])
+
+        if order.snapshot is not None:
+            return Response(order.snapshot)
+        if order.is_paid:
+            # Paid before snapshots were kept: render it once and store it
+            return Response(OrderSnapshotService.refresh(order))
+        return super().retrieve(request, *args, **kwargs)
+
     def get_queryset(self):
         return Order.objects.filter(
             user=self.request.user
@@ -142,11 +183,54 @@ class OrderDetailView(generics.RetrieveAPIView):
         )
 
 
+class CheckoutQuoteView(APIView):
+    """
+    Checkout summary of the user's cart shipped to one of their addresses:
+    subtotal, product discounts, shipping, tax and total (before coupon),
+    from the same rates order creation uses.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            address_id = int(request.query_params.get('shipping_address_id', ''))
+        except ValueError:
+            return Response({
+                'error': 'shipping_address_id is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        address = ShippingAddress.objects.filter(
+            id=address_id, user=request.user, is_active=True
+        ).first()
+        if address is None:
+            return Response({
+                'error': 'Invalid shipping address'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        cart = get_cart_store().get_cart(request.user)
+        items = list(cart.items.all())
+        subtotal = cart.subtotal
+        discount_amount = cart.total_discount
+        quote = rates.quote(address, subtotal - discount_amount, rates.cart_weight(items))
+
+        return Response({
+            'subtotal': subtotal,
+            'discount_amount': discount_amount,
+            'shipping_cost': quote.shipping_cost,
+            'tax_amount': quote.tax_amount,
+            'total': subtotal - discount_amount + quote.shipping_cost + quote.tax_amount,
+        })
+
+
 class OrderCreateView(generics.CreateAPIView):
-    """Create order from cart (checkout)"""
+    """
+    Create order from cart (checkout).
+    Retries with the same Idempotency-Key header get the first response back.
+    """
     serializer_class = OrderCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent('order-create')
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -163,47 +247,41 @@ class OrderCancelView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, order_number):
-        order = get_object_or_404(
-            Order,
-            order_number=order_number,
-            user=request.user
-        )
+        with transaction.atomic():
+            # Lock the order so concurrent cancels can't restore stock twice
+            order = get_object_or_404(
+                Order.objects.select_for_update(),
+                order_number=order_number,
+                user=request.user
+            )
 
-        # Can only cancel if not paid or already cancelled
-        if order.status in ['shipped', 'delivered']:
-            return Response({
-                'error': 'Cannot cancel order that has been shipped or delivered'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            # Can only cancel if not paid or already cancelled
+            if order.status in ['shipped', 'delivered']:
+                return Response({
+                    'error': 'Cannot cancel order that has been shipped or delivered'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-        if order.status == 'cancelled':
-            return Response({
-                'error': 'Order is already cancelled'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            if order.status == 'cancelled':
+                return Response({
+                    'error': 'Order is already cancelled'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Restore stock
-        for item in order.items.all():
-            if item.variant:
-                item.variant.stock_quantity += item.quantity
-                item.variant.save()
-            else:
-                item.product.stock_quantity += item.quantity
-                item.product.save()
-
-            # Update sales count
-            item.product.sales_count -= item.quantity
-            item.product.save()
-
-        # Update order status
-        order.status = 'cancelled'
-        order.save()
-
-        # Add to status history
-        OrderStatusHistory.objects.create(
-            order=order,
-            status='cancelled',
-            notes='Cancelled by customer',
-            changed_by=request.user
-        )
+            # Release the stock hold, or give back stock already taken
+            ReservationService.release(order)
+
+            # Update order status
+            order.status = 'cancelled'
+            order.save(update_fields=['status', 'updated_at'])
+
+            # Add to status history
+            OrderStatusHistory.objects.create(
+                order=order,
+                status='cancelled',
+                notes='Cancelled by customer',
+                changed_by=request.user
+            )
+            OrderSnapshotService.refresh(order)
+            emit(order, ORDER_CANCELLED, reason='Cancelled by customer')
 
         return Response({
             'message': 'Order cancelled successfully',
@@ -249,9 +327,13 @@ class CouponListView(generics.ListAPIView):
 # ==================== Payment Views ====================
 
 class PaymentCreateView(APIView):
-    """Process payment for an order - creates Stripe checkout session"""
+    """
+    Process payment for an order - creates Stripe checkout session.
+    Retries with the same Idempotency-Key header get the first session back.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent('payment-create')
     def post(self, request, order_number):
         order = get_object_or_404(
             Order,
@@ -298,8 +380,6 @@ class PaymentCreateView(APIView):
             )
 
             if not session:
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.error(f"StripeService.create_checkout_session returned None for order {order_number}")
                 return Response({
                     'error': 'Failed to create payment session. Please check Stripe configuration.'
@@ -325,9 +405,7 @@ class PaymentCreateView(APIView):
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            import logging
             import traceback
-            logger = logging.getLogger(__name__)
             logger.error(f"Payment processing error for order {order_number}: {str(e)}")
             logger.error(traceback.format_exc())
             return Response({
@@ -351,8 +429,6 @@ class OrderUpdateStatusView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def patch(self, request, order_number):
-        order = get_object_or_404(Order, order_number=order_number)
-
         new_status = request.data.get('status')
         notes = request.data.get('notes', '')
         tracking_number = request.data.get('tracking_number', '')
@@ -369,26 +445,37 @@ class OrderUpdateStatusView(APIView):
                 'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update order
-        order.status = new_status
+        # The status change, its history, snapshot and event commit together
+        with transaction.atomic():
+            order = get_object_or_404(Order.objects.select_for_update(), order_number=order_number)
 
-        if new_status == 'shipped' and not order.shipped_at:
-            order.shipped_at = timezone.now()
-            if tracking_number:
-                order.tracking_number = tracking_number
+            # Update order
+            previous_status = order.status
+            order.status = new_status
 
-        if new_status == 'delivered' and not order.delivered_at:
-            order.delivered_at = timezone.now()
+            if new_status == 'shipped' and not order.shipped_at:
+                order.shipped_at = timezone.now()
+                if tracking_number:
+                    order.tracking_number = tracking_number
 
-        order.save()
+            if new_status == 'delivered' and not order.delivered_at:
+                order.delivered_at = timezone.now()
 
-        # Add to status history
-        OrderStatusHistory.objects.create(
-            order=order,
-            status=new_status,
-            notes=notes,
-            changed_by=request.user
-        )
+            # Only the fields changed here: event handlers update in_sales_rollup/snapshot
+            order.save(update_fields=[
+                'status', 'shipped_at', 'tracking_number', 'delivered_at', 'updated_at'
+            ])
+
+            # Add to status history
+            OrderStatusHistory.objects.create(
+                order=order,
+                status=new_status,
+                notes=notes,
+                changed_by=request.user
+            )
+            OrderSnapshotService.refresh(order)
+            if new_status != previous_status:
+                emit_status_event(order, reason=notes)
 
         return Response({
             'message': f'Order status updated to {new_status}',
@@ -396,6 +483,85 @@ class OrderUpdateStatusView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class SalesReportView(APIView):
+    """
+    Sales report (admin only): revenue, units and orders per day, product,
+    category or brand over a date range. Reads the daily rollups only.
+    `orders` counts orders that included the product, so an order with
+    several products counts once per product.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    GROUP_FIELDS = {
+        'date': ['date'],
+        'product': ['product_id', 'product__name'],
+        'category': ['category_id', 'category__name'],
+        'brand': ['brand_id', 'brand__name'],
+    }
+
+    def get(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        rollups = SalesRollup.objects.filter(date__range=(params['date_from'], params['date_to']))
+        for dimension in ('product', 'category', 'brand'):
+            if dimension in params:
+                rollups = rollups.filter(**{f'{dimension}_id': params[dimension]})
+
+        totals = rollups.aggregate(revenue=Sum('revenue'), units=Sum('units'))
+        rows = rollups.values(*self.GROUP_FIELDS[params['group_by']]).annotate(
+            total_revenue=Sum('revenue'),
+            total_units=Sum('units'),
+            total_orders=Sum('orders')
+        )
+        if params['group_by'] == 'date':
+            rows = rows.order_by('date')
+        else:
+            rows = rows.order_by('-total_revenue')[:params['limit']]
+
+        return Response({
+            'date_from': params['date_from'],
+            'date_to': params['date_to'],
+            'group_by': params['group_by'],
+            'totals': {
+                'revenue': totals['revenue'] or 0,
+                'units': totals['units'] or 0,
+            },
+            'results': list(rows),
+        })
+
+
+class OrderExportView(APIView):
+    """
+    Stream orders with their items and payments as CSV (one row per item)
+    or JSON Lines (one order per line), admin only. Filters: date_from,
+    date_to (creation day), status. Archived orders are included.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    EXPORT_CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'jsonl': 'application/x-ndjson',
+    }
+
+    def get(self, request):
+        query = OrderExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        records = export_records(export_filters(
+            params['date_from'], params['date_to'], params.get('status')
+        ))
+        lines = csv_lines(records) if params['file_format'] == 'csv' else jsonl_lines(records)
+        response = StreamingHttpResponse(
+            lines, content_type=self.EXPORT_CONTENT_TYPES[params['file_format']]
+        )
+        filename = f"orders-{params['date_from']:%Y%m%d}-{params['date_to']:%Y%m%d}.{params['file_format']}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 # ==================== Stripe Webhook ====================
 
 @csrf_exempt
@@ -417,11 +583,14 @@ def stripe_webhook(request):
         # Invalid signature
         return JsonResponse({'error': 'Invalid signature'}, status=400)
 
-    # Process the event through WebhookService
+    # Store the event and answer right away; a webhooks worker processes it
     try:
-        WebhookService.process_stripe_webhook(event)
-        return JsonResponse({'status': 'success'}, status=200)
+        webhook_event = WebhookService.receive(event.to_dict())
     except Exception as e:
-        # Log error but return 200 to prevent Stripe from retrying
-        print(f"Webhook processing error: {str(e)}")
+        # Not stored: let Stripe retry
+        logger.error(f"Webhook storing error: {e}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    if webhook_event is not None:
+        WebhookService.queue(webhook_event.ordering_key)
+    return JsonResponse({'status': 'success'}, status=200)
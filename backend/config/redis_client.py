@@ -0,0 +1,15 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Shared Redis client for application data (carts, locks, ...).
+    Separate from the Celery broker database.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
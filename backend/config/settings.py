@@ -1,6 +1,8 @@
 import os
+from decimal import Decimal
 from pathlib import Path
 from decouple import config
+from corsheaders.defaults import default_headers
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -149,6 +151,9 @@ CORS_ALLOWED_ORIGINS = config(
     default='http://localhost:5173,http://127.0.0.1:5173'
 ).split(',')
 CORS_ALLOW_CREDENTIALS = True
+# Guest cart token (see apps.cart.storage.GuestCartStore)
+CORS_ALLOW_HEADERS = (*default_headers, 'x-cart-token', 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['X-Cart-Token', 'Idempotent-Replayed']
 
 from datetime import timedelta
 SIMPLE_JWT = {
@@ -242,6 +247,59 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
+# Stripe webhooks are processed on their own queue (celery -A config worker -Q webhooks)
+CELERY_TASK_ROUTES = {
+    'apps.payment.tasks.process_webhook_events': {'queue': 'webhooks'},
+}
+
+# Redis for application data (separate database from the Celery broker)
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/1')
+
+# Cart storage: 'database' (PostgreSQL only) or 'redis' (hot carts in Redis,
+# written behind to PostgreSQL)
+CART_STORAGE_BACKEND = config('CART_STORAGE_BACKEND', default='database')
+CART_REDIS_TTL = config('CART_REDIS_TTL', default=604800, cast=int)  # 7 days
+# Anonymous carts live only in Redis
+GUEST_CART_TTL = config('GUEST_CART_TTL', default=604800, cast=int)  # 7 days
+
+# Abandoned cart cleanup (apps.cart.tasks.cleanup_abandoned_carts)
+CART_ABANDONED_DAYS = config('CART_ABANDONED_DAYS', default=90, cast=int)
+CART_CLEANUP_BATCH_SIZE = config('CART_CLEANUP_BATCH_SIZE', default=5000, cast=int)  # cart ids per chunk
+CART_CLEANUP_SLEEP = config('CART_CLEANUP_SLEEP', default=0.5, cast=float)  # seconds between chunks
+
+# Stock held for unpaid orders (apps.payment.models.StockReservation)
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=1800, cast=int)  # 30 minutes
+STOCK_RESERVATION_BATCH_SIZE = config('STOCK_RESERVATION_BATCH_SIZE', default=500, cast=int)  # holds per sweep chunk
+# Unpaid order expiry (PendingOrderExpiryService)
+PENDING_ORDER_EXPIRY_DAYS = config('PENDING_ORDER_EXPIRY_DAYS', default=7, cast=int)
+PENDING_ORDER_EXPIRY_BATCH_SIZE = config('PENDING_ORDER_EXPIRY_BATCH_SIZE', default=2000, cast=int)  # orders per transaction
+# Idempotency-Key responses for order/payment creation (apps.payment.idempotency)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)  # 24 hours
+IDEMPOTENCY_LOCK_TIMEOUT = config('IDEMPOTENCY_LOCK_TIMEOUT', default=60, cast=int)  # seconds
+# Order domain events outbox (apps.payment.events)
+ORDER_EVENT_BATCH_SIZE = config('ORDER_EVENT_BATCH_SIZE', default=100, cast=int)  # events per transaction
+ORDER_EVENT_MAX_ATTEMPTS = config('ORDER_EVENT_MAX_ATTEMPTS', default=5, cast=int)
+ORDER_EVENT_RETRY_DELAY = config('ORDER_EVENT_RETRY_DELAY', default=60, cast=int)  # seconds, doubled per attempt
+# Order archive (OrderArchiveService)
+ORDER_ARCHIVE_AFTER_DAYS = config('ORDER_ARCHIVE_AFTER_DAYS', default=180, cast=int)  # finished orders untouched this long
+ORDER_ARCHIVE_BATCH_SIZE = config('ORDER_ARCHIVE_BATCH_SIZE', default=200, cast=int)  # orders per transaction
+STRIPE_DISPUTE_WINDOW_DAYS = config('STRIPE_DISPUTE_WINDOW_DAYS', default=120, cast=int)  # paid orders kept this long after payment
+# Streaming order exports (apps.payment.exports)
+ORDER_EXPORT_CHUNK_SIZE = config('ORDER_EXPORT_CHUNK_SIZE', default=500, cast=int)  # orders per cursor fetch
+# Shipping and tax quotes (apps.payment.rates)
+DEFAULT_SHIPPING_COST = config('DEFAULT_SHIPPING_COST', default='10.00', cast=Decimal)  # no shipping rate for the address
+RATES_VERSION_CHECK_INTERVAL = config('RATES_VERSION_CHECK_INTERVAL', default=30, cast=int)  # seconds between rate change checks
+# Monthly partitions (apps.payment.partitions)
+PARTITION_MONTHS_AHEAD = config('PARTITION_MONTHS_AHEAD', default=3, cast=int)  # created in advance
+WEBHOOK_EVENT_RETENTION_DAYS = config('WEBHOOK_EVENT_RETENTION_DAYS', default=30, cast=int)  # finished events dropped by whole months
+# Asynchronous webhook processing (WebhookService.process_pending)
+WEBHOOK_REQUEUE_AFTER = config('WEBHOOK_REQUEUE_AFTER', default=60, cast=int)  # seconds pending before the sweep re-queues
+WEBHOOK_MAX_ATTEMPTS = config('WEBHOOK_MAX_ATTEMPTS', default=8, cast=int)  # then dead letter
+WEBHOOK_RETRY_DELAY = config('WEBHOOK_RETRY_DELAY', default=60, cast=int)  # seconds, doubled per attempt (with jitter)
+WEBHOOK_RETRY_MAX_DELAY = config('WEBHOOK_RETRY_MAX_DELAY', default=21600, cast=int)  # 6 hours
+WEBHOOK_RETRY_BATCH_SIZE = config('WEBHOOK_RETRY_BATCH_SIZE', default=100, cast=int)  # events claimed per statement
+# Inventory ledger compaction (apps.main.tasks.compact_stock_movements)
+STOCK_COMPACTION_BATCH_SIZE = config('STOCK_COMPACTION_BATCH_SIZE', default=5000, cast=int)  # movements per chunk
 
 # Celery Beat
 CELERY_BEAT_SCHEDULE = {
@@ -251,18 +309,69 @@ CELERY_BEAT_SCHEDULE = {
     },
     'cancel-old-pending-orders': {
         'task': 'apps.payment.tasks.cancel_old_pending_orders',
-        'schedule': 604800.0,  # weekly
+        'schedule': 300.0,  # every 5 minutes
     },
     'cleanup-old-webhook-events': {
         'task': 'apps.payment.tasks.cleanup_old_webhook_events',
         'schedule': 86400.0,  # daily
     },
+    'archive-old-orders': {
+        'task': 'apps.payment.tasks.archive_old_orders',
+        'schedule': 86400.0,  # daily
+    },
+    'maintain-partitions': {
+        'task': 'apps.payment.tasks.maintain_partitions',
+        'schedule': 86400.0,  # daily
+    },
+    'queue-pending-webhook-events': {
+        'task': 'apps.payment.tasks.queue_pending_webhook_events',
+        'schedule': 60.0,  # every minute (sweeps events missed after storing)
+    },
     'retry-failed-webhook-events': {
         'task': 'apps.payment.tasks.retry_failed_webhook_events',
+        'schedule': 60.0,  # every minute (retries are scheduled per event)
+    },
+    'flush-dirty-carts': {
+        'task': 'apps.cart.tasks.flush_dirty_carts',
+        'schedule': 15.0,  # every 15 seconds
+    },
+    'cleanup-abandoned-carts': {
+        'task': 'apps.cart.tasks.cleanup_abandoned_carts',
+        'schedule': 86400.0,  # daily
+    },
+    'process-order-events': {
+        'task': 'apps.payment.tasks.process_order_events',
+        'schedule': 60.0,  # every minute (sweeps events missed after commit)
+    },
+    'cleanup-old-order-events': {
+        'task': 'apps.payment.tasks.cleanup_old_order_events',
+        'schedule': 86400.0,  # daily
+    },
+    'release-expired-reservations': {
+        'task': 'apps.payment.tasks.release_expired_reservations',
+        'schedule': 60.0,  # every minute
+    },
+    'compact-stock-movements': {
+        'task': 'apps.main.tasks.compact_stock_movements',
+        'schedule': 60.0,  # every minute
+    },
+    'sync-stripe-coupons': {
+        'task': 'apps.payment.tasks.sync_stripe_coupons',
         'schedule': 3600.0,  # every hour
     },
 }
 
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY', default='')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
-STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+# Outbound Stripe API calls (apps.payment.stripe_gateway)
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')  # e.g. http://localhost:12111 for stripe-mock
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=3.0, cast=float)  # seconds
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=15.0, cast=float)  # seconds
+STRIPE_MAX_NETWORK_RETRIES = config('STRIPE_MAX_NETWORK_RETRIES', default=2, cast=int)  # with idempotency keys
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)  # keep-alive connections per process
+STRIPE_BREAKER_FAILURES = config('STRIPE_BREAKER_FAILURES', default=5, cast=int)  # consecutive, then fail fast
+STRIPE_BREAKER_RESET_TIMEOUT = config('STRIPE_BREAKER_RESET_TIMEOUT', default=30, cast=int)  # seconds before a trial call
+STRIPE_RATE_LIMIT_PER_SECOND = config('STRIPE_RATE_LIMIT_PER_SECOND', default=25, cast=float)  # all processes together
+STRIPE_RATE_LIMIT_BURST = config('STRIPE_RATE_LIMIT_BURST', default=25, cast=int)
+STRIPE_RATE_LIMIT_MAX_WAIT = config('STRIPE_RATE_LIMIT_MAX_WAIT', default=2.0, cast=float)  # seconds, then fail fast
\ No newline at end of file
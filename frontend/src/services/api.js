@@ -169,7 +169,10 @@ export const ordersAPI = {
   getAll: (params) => api.get('/payment/orders/', { params }),
   getByOrderNumber: (orderNumber) => api.get(`/payment/orders/${orderNumber}/`),
   create: (data) => api.post('/payment/orders/create/', data),
-  cancel: (orderNumber) => api.post(`/payment/orders/${orderNumber}/cancel/`)
+  cancel: (orderNumber) => api.post(`/payment/orders/${orderNumber}/cancel/`),
+  quote: (shippingAddressId) => api.get('/payment/checkout/quote/', {
+    params: { shipping_address_id: shippingAddressId }
+  })
 }
 
 export const shippingAPI = {